@@ -1,10 +1,10 @@
 from django.contrib import admin
-from .models import AudioAnalysis, WordComparison, AnalysisResult, BatchUpload
+from .models import AudioAnalysis, WordComparison, ParagraphComparison, AnalysisResult, BatchUpload, Script
 
 @admin.register(AudioAnalysis)
 class AudioAnalysisAdmin(admin.ModelAdmin):
     list_display = ['title', 'user', 'accuracy_score', 'total_words', 'correct_words', 'created_at']
-    list_filter = ['created_at', 'accuracy_score']
+    list_filter = ['created_at', 'accuracy_score', 'analysis_mode']
     search_fields = ['title', 'user__username']
     readonly_fields = ['accuracy_score', 'total_words', 'correct_words', 'missing_words', 'wrong_words']
     
@@ -21,6 +21,15 @@ class WordComparisonAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('analysis')
 
+@admin.register(ParagraphComparison)
+class ParagraphComparisonAdmin(admin.ModelAdmin):
+    list_display = ['analysis', 'paragraph_index', 'status', 'similarity', 'start_time', 'end_time']
+    list_filter = ['status']
+    search_fields = ['analysis__title']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('analysis')
+
 @admin.register(AnalysisResult)
 class AnalysisResultAdmin(admin.ModelAdmin):
     list_display = ['analysis', 'processing_time', 'whisper_model_used']
@@ -38,3 +47,10 @@ class BatchUploadAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user')
+
+@admin.register(Script)
+class ScriptAdmin(admin.ModelAdmin):
+    list_display = ['content_hash', 'word_count', 'created_at']
+    search_fields = ['content_hash']
+    exclude = ['word_ids']
+    readonly_fields = ['content_hash', 'word_count', 'created_at']
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AudioCheckerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'audio_checker'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas)
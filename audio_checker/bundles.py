@@ -0,0 +1,170 @@
+"""
+Offline Whisper model bundles.
+
+whisper.load_model() unpickles a .pt checkpoint on every load and downloads it
+first when it is missing, which fails on hosts without network access. A
+bundle is the same model pre-staged in WHISPER_MODEL_DIR in a layout that
+loads without either:
+
+    <model_dir>/<model_size>/model.safetensors   weights, read through mmap
+    <model_dir>/<model_size>/manifest.json       dims, alignment heads, checksums
+
+`manage.py stage_models` writes bundles from a whisper checkpoint. When a
+model directory is configured, models are loaded only from bundles; a missing
+or corrupt bundle raises ModelBundleError instead of reaching the network.
+
+The model is built on the meta device and the mapped tensors are assigned to
+it, so loading does not initialise random weights only to overwrite them, and
+the weights are paged in from the file as they are first used.
+
+This module does not import Django, so job processes can use it.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+WEIGHTS_FILE = 'model.safetensors'
+MANIFEST_FILE = 'manifest.json'
+# faster-whisper models are kept in the Hugging Face cache layout under here
+FASTER_WHISPER_DIR = 'faster-whisper'
+
+
+class ModelBundleError(RuntimeError):
+    """Raised when a model bundle is missing, incomplete or fails its checksum"""
+
+
+def bundle_path(model_dir: str, model_size: str) -> str:
+    return os.path.join(model_dir, model_size)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(model_dir: str, model_size: str) -> dict:
+    path = os.path.join(bundle_path(model_dir, model_size), MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise ModelBundleError(
+            f"No {model_size} model bundle in {model_dir}; stage it with "
+            f"`manage.py stage_models {model_size}`"
+        )
+    with open(path, encoding='utf-8') as fh:
+        manifest = json.load(fh)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ModelBundleError(f"{path} has unsupported bundle format {manifest.get('format')}")
+    return manifest
+
+
+def verify_bundle(model_dir: str, model_size: str) -> dict:
+    """Check every file of a bundle against its manifest and return the manifest"""
+    manifest = read_manifest(model_dir, model_size)
+    for name, expected in manifest['files'].items():
+        path = os.path.join(bundle_path(model_dir, model_size), name)
+        if not os.path.exists(path):
+            raise ModelBundleError(f"{path} is missing")
+        if os.path.getsize(path) != expected['size']:
+            raise ModelBundleError(f"{path} is {os.path.getsize(path)} bytes, expected {expected['size']}")
+        if file_sha256(path) != expected['sha256']:
+            raise ModelBundleError(f"{path} does not match its sha256 checksum")
+    return manifest
+
+
+def stage_whisper_bundle(model_size: str, model_dir: str, checkpoint: str = None) -> str:
+    """
+    Convert a whisper checkpoint into a bundle in model_dir and return its
+    path. checkpoint is a .pt file; without one the official checkpoint is
+    downloaded into whisper's cache (so stage on a host with network access,
+    or copy the .pt files over and pass them in).
+    """
+    import torch
+    import whisper
+    from safetensors.torch import save_file
+
+    if checkpoint is None:
+        if model_size not in whisper._MODELS:
+            raise ModelBundleError(f"Unknown whisper model {model_size}; pass a checkpoint file")
+        download_root = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'whisper')
+        checkpoint = whisper._download(whisper._MODELS[model_size], download_root, False)
+    logger.info(f"Staging {model_size} bundle from {checkpoint}")
+    data = torch.load(checkpoint, map_location='cpu', weights_only=True)
+    state_dict = {name: tensor.contiguous() for name, tensor in data['model_state_dict'].items()}
+    alignment_heads = whisper._ALIGNMENT_HEADS.get(model_size)
+
+    # Write next to the final location and swap it in, so a bundle that is
+    # being loaded is never half-written
+    target = bundle_path(model_dir, model_size)
+    staging = target + '.staging'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    weights = os.path.join(staging, WEIGHTS_FILE)
+    save_file(state_dict, weights, metadata={'model_size': model_size})
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'model_size': model_size,
+        'dims': data['dims'],
+        'alignment_heads': alignment_heads.decode('ascii') if alignment_heads else None,
+        'files': {WEIGHTS_FILE: {'size': os.path.getsize(weights), 'sha256': file_sha256(weights)}},
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    return target
+
+
+def stage_faster_whisper_model(model_size: str, model_dir: str) -> str:
+    """Download a faster-whisper model into model_dir for offline use"""
+    from faster_whisper.utils import download_model
+    return download_model(model_size, cache_dir=os.path.join(model_dir, FASTER_WHISPER_DIR))
+
+
+def build_empty_whisper(dims):
+    """A Whisper module whose parameters and buffers are not allocated yet"""
+    import torch
+    from whisper.model import Whisper
+    try:
+        with torch.device('meta'):
+            return Whisper(dims)
+    except Exception as e:
+        # Older torch: build on CPU and let load_state_dict overwrite the
+        # initialised weights
+        logger.warning(f"Could not build the model on the meta device, building on CPU: {e}")
+        return Whisper(dims)
+
+
+def load_whisper_bundle(model_dir: str, model_size: str, verify: bool = True, device: str = None):
+    """Load a whisper model from its bundle without unpickling or network access"""
+    import numpy as np
+    import torch
+    from safetensors.torch import load_file
+    from whisper.model import ModelDimensions
+
+    manifest = verify_bundle(model_dir, model_size) if verify else read_manifest(model_dir, model_size)
+    dims = ModelDimensions(**manifest['dims'])
+    state_dict = load_file(os.path.join(bundle_path(model_dir, model_size), WEIGHTS_FILE), device='cpu')
+    model = build_empty_whisper(dims)
+    model.load_state_dict(state_dict, assign=True)
+    # Buffers that are not saved with the weights are rebuilt here
+    mask = torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(-np.inf).triu_(1)
+    model.decoder.register_buffer('mask', mask, persistent=False)
+    if manifest.get('alignment_heads'):
+        model.set_alignment_heads(manifest['alignment_heads'].encode('ascii'))
+    else:
+        all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+        all_heads[dims.n_text_layer // 2:] = True
+        model.register_buffer('alignment_heads', all_heads.to_sparse(), persistent=False)
+    unloaded = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if unloaded:
+        raise ModelBundleError(f"{model_size} bundle does not provide {', '.join(unloaded)}")
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return model.to(device)
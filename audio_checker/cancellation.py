@@ -0,0 +1,32 @@
+"""
+Cooperative cancellation for long-running analyses.
+
+A CancelToken wraps an event that the supervising process sets when a job is
+cancelled. Engines call check() between decoding windows, so a cancelled job
+stops at the next window boundary instead of running to the end of the file.
+"""
+import threading
+
+
+class AnalysisCancelled(Exception):
+    """Raised inside a job when its cancel token has been set"""
+
+
+class CancelToken:
+    """Cancellation flag shared between a job and whoever supervises it"""
+
+    def __init__(self, event=None):
+        # A multiprocessing.Event when the job runs in a child process
+        self.event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def check(self):
+        """Raise AnalysisCancelled if the job has been cancelled"""
+        if self.event.is_set():
+            raise AnalysisCancelled("Analysis was cancelled")
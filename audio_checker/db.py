@@ -0,0 +1,54 @@
+"""
+SQLite tuning and serialized writes.
+
+SQLite allows a single writer at a time. Two things keep concurrent analysis
+workers from failing with "database is locked":
+
+- apply_sqlite_pragmas runs on every new connection and sets
+  settings.SQLITE_PRAGMAS. WAL lets web reads continue while a worker
+  writes, and busy_timeout makes a blocked writer wait instead of failing.
+- @serialized_write runs worker writes one at a time on a single writer
+  thread, so workers never compete for the write lock among themselves.
+  On other databases the decorated functions run directly.
+"""
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+WRITER_THREAD_NAME = 'db-writer'
+
+db_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=WRITER_THREAD_NAME)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created handler that applies SQLITE_PRAGMAS to SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def run_write(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def serialized_write(func):
+    """Run func on the single writer thread when the database is SQLite"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.vendor != 'sqlite' or threading.current_thread().name.startswith(WRITER_THREAD_NAME):
+            # Not SQLite, or already on the writer thread (nested writes)
+            return func(*args, **kwargs)
+        return db_writer.submit(run_write, func, args, kwargs).result()
+    return wrapper
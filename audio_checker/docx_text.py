@@ -0,0 +1,87 @@
+"""
+Streaming text extraction from .docx scripts.
+
+python-docx builds an object tree of the whole document before giving back
+any text, which is slow and memory hungry for scripts of hundreds of pages,
+and its document.paragraphs skips tables and text boxes. Here word/document.xml
+is read straight from the zip with ElementTree.iterparse. Each paragraph is
+yielded as soon as its closing tag is parsed, and its elements are then
+dropped, so memory stays bounded by the largest top-level block (a paragraph
+or a table) rather than by the document.
+
+Paragraphs come from the body, table cells and text boxes, in the order
+their closing tags appear: a text box's paragraphs come before the paragraph
+that anchors it. A text box is stored twice (the DrawingML version, and a
+VML copy in mc:Fallback for older readers), and only the first is read.
+
+This module does not import Django, so job processes can use it.
+"""
+import zipfile
+from typing import Iterator, Tuple
+from xml.etree import ElementTree
+
+from .sources import seekable_source
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+BODY = W + 'body'
+PARAGRAPH = W + 'p'
+TEXT = W + 't'
+FALLBACK = MC + 'Fallback'
+# Run content that python-docx also renders as text
+SPECIAL_CHARACTERS = {
+    W + 'tab': '\t',
+    W + 'br': '\n',
+    W + 'cr': '\n',
+    W + 'noBreakHyphen': '-',
+}
+
+
+def iter_docx_paragraphs(source: str) -> Iterator[Tuple[int, str]]:
+    """
+    (offset, text) for every non-empty paragraph of a .docx, stripped.
+    offset is where the paragraph starts in the script text, the paragraphs
+    joined by single spaces.
+    """
+    with zipfile.ZipFile(seekable_source(source)) as package, package.open('word/document.xml') as xml:
+        depth = 0
+        body, body_depth = None, None
+        # Text of the paragraphs being read; a text box's paragraphs are
+        # nested inside the paragraph that anchors it
+        open_paragraphs = []
+        in_fallback = 0
+        offset = 0
+        for event, elem in ElementTree.iterparse(xml, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                depth += 1
+                if tag == BODY:
+                    body, body_depth = elem, depth
+                elif tag == FALLBACK:
+                    in_fallback += 1
+                elif tag == PARAGRAPH and not in_fallback:
+                    open_paragraphs.append([])
+                continue
+            depth -= 1
+            if tag == FALLBACK:
+                in_fallback -= 1
+            elif in_fallback or not open_paragraphs:
+                pass
+            elif tag == TEXT:
+                open_paragraphs[-1].append(elem.text or '')
+            elif tag in SPECIAL_CHARACTERS:
+                open_paragraphs[-1].append(SPECIAL_CHARACTERS[tag])
+            elif tag == PARAGRAPH:
+                text = ''.join(open_paragraphs.pop()).strip()
+                elem.clear()
+                if text:
+                    yield offset, text
+                    offset += len(text) + 1
+            if depth == body_depth:
+                # A top-level paragraph or table is done; drop it
+                body.clear()
+
+
+def docx_paragraphs(source: str):
+    """The non-empty paragraphs of a .docx, stripped"""
+    return [text for _, text in iter_docx_paragraphs(source)]
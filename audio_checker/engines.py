@@ -0,0 +1,450 @@
+"""
+Transcription engines used by AudioAnalyzer.
+
+An engine loads a speech model and turns audio into text plus timestamped
+segments in Whisper's result format ({'text', 'segments', 'language'}, each
+segment carrying 'start', 'end' and 'text', plus per-word 'words' timings when
+the engine was created with word_timestamps=True). The analyzer only talks to this
+interface, so the rest of the pipeline does not care which backend ran.
+
+Engines:
+    whisper         openai-whisper (default); supports forced alignment and
+                    stacked batch decoding
+    faster-whisper  CTranslate2 backend via the optional faster-whisper package,
+                    int8 on CPU
+    stub            deterministic fake for tests and benchmarks; reads the
+                    transcript from a sidecar '<audio>.stub.txt' file
+
+With a model_dir (WHISPER_MODEL_DIR), models are loaded only from the
+offline bundles staged there (see bundles.py) and never downloaded. With a
+compile_mode (WHISPER_COMPILE), the whisper engine runs its encoder compiled
+(see inference.compile_encoder).
+
+Model packages (whisper, torch, faster-whisper, librosa) are imported where
+they are used, so importing this module does not load them; only job
+processes that actually transcribe pay for them.
+"""
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+
+from .bundles import FASTER_WHISPER_DIR, load_whisper_bundle
+from .cancellation import CancelToken
+from .inference import compile_encoder, quantize_dynamic_int8
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Whisper's defaults for attaching punctuation to the neighbouring word
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
+
+# The cancel token of the engine transcribing on each thread; see install_cancel_check
+cancel_scope = threading.local()
+
+DECODE_OPTIONS = {
+    'fp16': False,
+    'task': 'transcribe',
+    'verbose': False,
+    'condition_on_previous_text': False,
+    'temperature': 0.0,
+}
+
+
+def load_whisper_model(model_size: str, quantize: bool = False, model_dir: str = None, compile_mode: str = None,
+                       compile_cache_dir: str = None):
+    """
+    Load an openai-whisper model, optionally as dynamic int8 on CPU. With a
+    model_dir the model comes from its offline bundle there; with a
+    compile_mode its encoder is compiled, caching artifacts in compile_cache_dir.
+    """
+    device = 'cpu' if quantize else None
+    if model_dir:
+        model = load_whisper_bundle(model_dir, model_size, device=device)
+    else:
+        import whisper
+        model = whisper.load_model(model_size, device=device)
+    if quantize:
+        model = quantize_dynamic_int8(model)
+    if compile_mode:
+        compile_encoder(model, compile_mode, compile_cache_dir, f"{model_size}-{'int8' if quantize else 'fp32'}")
+    return model
+
+
+def install_cancel_check(model):
+    """
+    Check the active cancel token before every 30-second window.
+    model.transcribe calls model.decode once per window (and per temperature
+    fallback), so shadowing it on the instance makes long transcriptions
+    cancellable. Models are shared between engines (and, preloaded, between
+    jobs), so the wrapper is installed once per model and checks whichever
+    token the calling thread set with active_cancel_token.
+    """
+    if getattr(model, 'cancel_check_installed', False):
+        return
+    decode = model.decode
+
+    def checked_decode(mel, *args, **kwargs):
+        token = getattr(cancel_scope, 'token', None)
+        if token is not None:
+            token.check()
+        return decode(mel, *args, **kwargs)
+
+    model.decode = checked_decode
+    model.cancel_check_installed = True
+
+
+@contextmanager
+def active_cancel_token(token: CancelToken):
+    """Make token the one checked by decode calls on this thread"""
+    previous = getattr(cancel_scope, 'token', None)
+    cancel_scope.token = token
+    try:
+        yield
+    finally:
+        cancel_scope.token = previous
+
+
+class TranscriptionEngine:
+    """Base class for transcription backends"""
+    name = None
+    supports_forced_alignment = False
+
+    def __init__(self, model_size: str, quantize: bool = False, threads: int = 0, cancel_token: CancelToken = None,
+                 model_dir: str = None, compile_mode: str = None, compile_cache_dir: str = None,
+                 word_timestamps: bool = False):
+        self.model_size = model_size
+        self.word_timestamps = word_timestamps
+        self.quantize = quantize
+        self.threads = threads
+        self.model_dir = model_dir
+        self.compile_mode = compile_mode
+        self.compile_cache_dir = compile_cache_dir
+        self.cancel_token = cancel_token or CancelToken()
+        self.load()
+
+    def load(self):
+        """Load the model weights"""
+        raise NotImplementedError
+
+    def load_audio(self, audio_path: str) -> np.ndarray:
+        """Decode an audio file to a 16kHz mono float32 array"""
+        import whisper
+        try:
+            return whisper.load_audio(audio_path, sr=SAMPLE_RATE)
+        except Exception as ffmpeg_error:
+            logger.warning(f"ffmpeg decode failed, falling back to librosa: {ffmpeg_error}")
+            import librosa
+            audio, _ = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True)
+            return audio
+
+    def transcribe(self, audio, language=None) -> Dict:
+        """Transcribe a file path or 16kHz array; returns {'text', 'segments', 'language'}"""
+        raise NotImplementedError
+
+    def transcribe_window(self, audio: np.ndarray, start: float, end: float, language=None) -> List[Dict]:
+        """Transcribe audio[start:end] (seconds) and return segments on the file's timeline"""
+        window = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        if len(window) == 0:
+            return []
+        segments = []
+        for seg in self.transcribe(window, language=language).get('segments', []):
+            seg = dict(seg)
+            seg['start'] = seg['start'] + start
+            seg['end'] = min(seg['end'] + start, end)
+            if seg.get('words'):
+                seg['words'] = [
+                    dict(word, start=word['start'] + start, end=min(word['end'] + start, end))
+                    for word in seg['words']
+                ]
+            segments.append(seg)
+        return segments
+
+    def transcribe_batch(self, audio_paths: List[str]) -> List[Dict]:
+        """Transcribe several short clips; engines without batching run them in turn"""
+        return [self.transcribe(path) for path in audio_paths]
+
+    def detect_language(self, audio: np.ndarray) -> str:
+        """Detect the spoken language from the first 30 seconds of audio"""
+        return self.transcribe(audio[:30 * SAMPLE_RATE]).get('language') or 'en'
+
+    def force_align(self, audio: np.ndarray, start: float, end: float, words: List[str], language: str) -> List[Dict]:
+        """
+        Score the given words against audio[start:end]. Returns one
+        {'start', 'end', 'probability'} dict per word on the file's timeline.
+        """
+        raise NotImplementedError(f"{self.name} engine does not support forced alignment")
+
+
+class WhisperEngine(TranscriptionEngine):
+    """openai-whisper running in PyTorch"""
+    name = 'whisper'
+    supports_forced_alignment = True
+
+    def load(self):
+        from .preload import whisper_models
+        # In a job process forked from the preloading server this reuses the
+        # server's weights instead of loading a private copy
+        self.model = whisper_models.get((self.model_size, self.quantize))
+        if self.model is None:
+            self.model = load_whisper_model(self.model_size, self.quantize, self.model_dir, self.compile_mode,
+                                            self.compile_cache_dir)
+        else:
+            logger.info(f"Using preloaded {self.model_size} model")
+        self._tokenizers = {}
+        install_cancel_check(self.model)
+
+    def transcribe(self, audio, language=None) -> Dict:
+        with active_cancel_token(self.cancel_token):
+            return self.model.transcribe(audio, language=language, word_timestamps=self.word_timestamps,
+                                         **DECODE_OPTIONS)
+
+    def transcribe_batch(self, audio_paths: List[str]) -> List[Dict]:
+        """Run the encoder and greedy decoder once over the stacked log-mel batch"""
+        import torch
+        import whisper
+        self.cancel_token.check()
+        audios = [self.load_audio(path) for path in audio_paths]
+        mels = [
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), self.model.dims.n_mels)
+            for audio in audios
+        ]
+        mel_batch = torch.stack(mels).to(self.model.device)
+        options = whisper.DecodingOptions(
+            task="transcribe",
+            language=None,
+            temperature=0.0,
+            without_timestamps=True,
+            fp16=False
+        )
+        results = whisper.decode(self.model, mel_batch, options)
+        transcriptions = []
+        for audio, result in zip(audios, results):
+            text = result.text.strip()
+            segments = [{
+                'id': 0,
+                'start': 0.0,
+                'end': len(audio) / SAMPLE_RATE,
+                'text': ' ' + text,
+                'no_speech_prob': result.no_speech_prob,
+            }] if text else []
+            transcriptions.append({'text': text, 'segments': segments, 'language': result.language})
+        return transcriptions
+
+    def detect_language(self, audio: np.ndarray) -> str:
+        if not self.model.is_multilingual:
+            return 'en'
+        import whisper
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), self.model.dims.n_mels).to(self.model.device)
+        _, probs = self.model.detect_language(mel)
+        return max(probs, key=probs.get)
+
+    def tokenizer(self, language: str):
+        if language not in self._tokenizers:
+            from whisper.tokenizer import get_tokenizer
+            self._tokenizers[language] = get_tokenizer(
+                self.model.is_multilingual,
+                num_languages=self.model.num_languages,
+                language=language,
+                task='transcribe'
+            )
+        return self._tokenizers[language]
+
+    def force_align(self, audio: np.ndarray, start: float, end: float, words: List[str], language: str) -> List[Dict]:
+        """
+        Teacher-forced alignment of the words using Whisper's cross-attention
+        heads; one timing per word, in order. words should be normalized
+        (AudioAnalyzer.preprocess_text): Whisper splits punctuation into words
+        of its own, which are merged back into their neighbours here. Raises
+        ValueError if the timings still do not line up with the words.
+        """
+        import whisper
+        from whisper.audio import N_FRAMES, HOP_LENGTH
+        from whisper.timing import find_alignment, merge_punctuations
+        self.cancel_token.check()
+        tokenizer = self.tokenizer(language)
+        chunk = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        mel = whisper.log_mel_spectrogram(chunk, self.model.dims.n_mels)
+        mel = whisper.pad_or_trim(mel, N_FRAMES).to(self.model.device)
+        num_frames = len(chunk) // HOP_LENGTH
+        text_tokens = tokenizer.encode(' ' + ' '.join(words))
+        alignment = find_alignment(self.model, tokenizer, text_tokens, mel, num_frames)
+        merge_punctuations(alignment, PREPEND_PUNCTUATIONS, APPEND_PUNCTUATIONS)
+        # Merged punctuation is left behind as empty words
+        timings = [timing for timing in alignment if timing.word.strip()]
+        if len(timings) != len(words):
+            raise ValueError(f"Forced alignment returned {len(timings)} timings for {len(words)} words")
+        return [
+            {'start': start + timing.start, 'end': start + timing.end, 'probability': timing.probability}
+            for timing in timings
+        ]
+
+
+class FasterWhisperEngine(TranscriptionEngine):
+    """CTranslate2 Whisper via the optional faster-whisper package"""
+    name = 'faster-whisper'
+
+    def load(self):
+        from faster_whisper import WhisperModel
+        offline = {}
+        if self.model_dir:
+            # Staged by `manage.py stage_models --engine faster-whisper`
+            offline = {'download_root': os.path.join(self.model_dir, FASTER_WHISPER_DIR), 'local_files_only': True}
+        self.model = WhisperModel(
+            self.model_size,
+            device='cpu',
+            compute_type='int8' if self.quantize else 'float32',
+            cpu_threads=self.threads,
+            **offline
+        )
+
+    def transcribe(self, audio, language=None) -> Dict:
+        segment_iter, info = self.model.transcribe(
+            audio,
+            language=language,
+            task='transcribe',
+            beam_size=1,
+            temperature=0.0,
+            condition_on_previous_text=False,
+            word_timestamps=self.word_timestamps
+        )
+        # Segments are decoded lazily as the iterator advances
+        segments = []
+        for seg in segment_iter:
+            self.cancel_token.check()
+            segment = {'id': seg.id, 'start': seg.start, 'end': seg.end, 'text': seg.text}
+            if seg.words:
+                segment['words'] = [
+                    {'word': word.word, 'start': word.start, 'end': word.end, 'probability': word.probability}
+                    for word in seg.words
+                ]
+            segments.append(segment)
+        return {
+            'text': ''.join(seg['text'] for seg in segments),
+            'segments': segments,
+            'language': info.language,
+        }
+
+
+class StubAudio(np.ndarray):
+    """Silent samples of a stub clip that remember the file they were loaded from"""
+    source = None
+
+    def __array_finalize__(self, obj):
+        self.source = getattr(obj, 'source', None)
+
+
+class StubEngine(TranscriptionEngine):
+    """
+    Deterministic engine for tests and benchmarks. The transcript of
+    'clip.wav' is read from 'clip.wav.stub.txt' and its words are laid out at
+    STUB_WORDS_PER_SECOND, one segment per STUB_SEGMENT_WORDS words; audio
+    is never decoded. Forced alignment lays the offered words out the same
+    way and is confident in those that match the transcript.
+    """
+    name = 'stub'
+    supports_forced_alignment = True
+    STUB_WORDS_PER_SECOND = 2.5
+    STUB_SEGMENT_WORDS = 12
+
+    def load(self):
+        self.words = []
+        self.source = None
+
+    def read_transcript(self, audio_path: str) -> List[str]:
+        sidecar = audio_path + '.stub.txt'
+        if not os.path.exists(sidecar):
+            return []
+        with open(sidecar, encoding='utf-8') as fh:
+            return fh.read().split()
+
+    def words_for(self, audio) -> List[str]:
+        """
+        Transcript of the file the array was loaded from, so a second engine
+        (e.g. the cascade's refine engine) can transcribe windows of an array
+        the first one loaded. Only the last file's transcript is kept.
+        """
+        source = getattr(audio, 'source', None)
+        if source is not None and source != self.source:
+            self.words = self.read_transcript(source)
+            self.source = source
+        return self.words
+
+    def load_audio(self, audio_path: str) -> np.ndarray:
+        self.words = self.read_transcript(audio_path)
+        self.source = audio_path
+        audio = np.zeros(int(len(self.words) / self.STUB_WORDS_PER_SECOND * SAMPLE_RATE), dtype=np.float32)
+        audio = audio.view(StubAudio)
+        audio.source = audio_path
+        return audio
+
+    def segments_between(self, start: float, end: float) -> List[Dict]:
+        first = int(round(start * self.STUB_WORDS_PER_SECOND))
+        last = min(int(round(end * self.STUB_WORDS_PER_SECOND)), len(self.words))
+        segments = []
+        for idx in range(first, last, self.STUB_SEGMENT_WORDS):
+            chunk = self.words[idx:min(idx + self.STUB_SEGMENT_WORDS, last)]
+            segments.append({
+                'id': len(segments),
+                'start': idx / self.STUB_WORDS_PER_SECOND,
+                'end': (idx + len(chunk)) / self.STUB_WORDS_PER_SECOND,
+                'text': ' ' + ' '.join(chunk),
+            })
+        return segments
+
+    def transcribe(self, audio, language=None) -> Dict:
+        self.cancel_token.check()
+        if isinstance(audio, str):
+            self.load_audio(audio)
+            duration = len(self.words) / self.STUB_WORDS_PER_SECOND
+        else:
+            self.words_for(audio)
+            duration = len(audio) / SAMPLE_RATE
+        segments = self.segments_between(0.0, duration)
+        return {'text': ''.join(seg['text'] for seg in segments), 'segments': segments, 'language': 'en'}
+
+    def transcribe_window(self, audio: np.ndarray, start: float, end: float, language=None) -> List[Dict]:
+        self.cancel_token.check()
+        self.words_for(audio)
+        return self.segments_between(start, end)
+
+    def detect_language(self, audio: np.ndarray) -> str:
+        return 'en'
+
+    def force_align(self, audio: np.ndarray, start: float, end: float, words: List[str], language: str) -> List[Dict]:
+        self.cancel_token.check()
+        spoken = self.words_for(audio)
+        first = int(round(start * self.STUB_WORDS_PER_SECOND))
+        timings = []
+        for offset, word in enumerate(words):
+            idx = first + offset
+            heard = re.sub(r"[^\w']", '', spoken[idx].lower()) if idx < len(spoken) else ''
+            timings.append({
+                'start': idx / self.STUB_WORDS_PER_SECOND,
+                'end': (idx + 1) / self.STUB_WORDS_PER_SECOND,
+                'probability': 1.0 if heard == word else 0.0,
+            })
+        return timings
+
+
+ENGINES = {engine.name: engine for engine in (WhisperEngine, FasterWhisperEngine, StubEngine)}
+
+
+def create_engine(name: str, model_size: str, quantize: bool = False, threads: int = 0,
+                  cancel_token: CancelToken = None, model_dir: str = None, compile_mode: str = None,
+                  compile_cache_dir: str = None, word_timestamps: bool = False) -> TranscriptionEngine:
+    """Instantiate and load the named engine"""
+    try:
+        engine_class = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown transcription engine: {name}")
+    logger.info(f"Loading {name} engine with {model_size} model")
+    return engine_class(model_size, quantize=quantize, threads=threads, cancel_token=cancel_token,
+                        model_dir=model_dir, compile_mode=compile_mode, compile_cache_dir=compile_cache_dir,
+                        word_timestamps=word_timestamps)
@@ -1,10 +1,10 @@
 from django import forms
-from .models import AudioAnalysis, BatchUpload
+from .models import AudioAnalysis, BatchUpload, selectable_engine_choices
 
 class AudioAnalysisForm(forms.ModelForm):
     class Meta:
         model = AudioAnalysis
-        fields = ['title', 'script_file', 'audio_file']
+        fields = ['title', 'script_file', 'audio_file', 'analysis_mode', 'engine']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -17,8 +17,18 @@ class AudioAnalysisForm(forms.ModelForm):
             'audio_file': forms.FileInput(attrs={
                 'class': 'form-control',
                 'accept': '.wav,.mp3,.m4a,.flac'
+            }),
+            'analysis_mode': forms.Select(attrs={
+                'class': 'form-select'
+            }),
+            'engine': forms.Select(attrs={
+                'class': 'form-select'
             })
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['engine'].choices = selectable_engine_choices()
     
     def clean_script_file(self):
         script_file = self.cleaned_data.get('script_file')
@@ -38,14 +48,24 @@ class BatchUploadForm(forms.ModelForm):
     """Form for creating a batch upload"""
     class Meta:
         model = BatchUpload
-        fields = ['title']
+        fields = ['title', 'analysis_mode', 'engine']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'Enter batch title (e.g., "Episode 1-5 Analysis")'
+            }),
+            'analysis_mode': forms.Select(attrs={
+                'class': 'form-select'
+            }),
+            'engine': forms.Select(attrs={
+                'class': 'form-select'
             })
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['engine'].choices = selectable_engine_choices()
+
 class FilePairForm(forms.Form):
     """Form for individual script-audio file pairs"""
     title = forms.CharField(
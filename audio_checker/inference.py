@@ -0,0 +1,165 @@
+"""
+CPU inference configuration for Whisper models.
+
+Workers call configure_threads() before running a model so that concurrent
+analyses split the cores between them instead of each letting torch use all
+of them, and models can be converted with quantize_dynamic_int8() so their
+linear layers run as int8 matmuls. compile_encoder() optionally runs the
+encoder, the dominant cost of each 30-second window, compiled.
+
+torch is imported inside the functions that use it, so importing this module
+(the web process does, via the worker and services modules) stays cheap.
+"""
+import contextlib
+import functools
+import importlib.util
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def threads_per_worker(workers: int, cpu_count: int = None) -> int:
+    """Split the available cores evenly between concurrent workers"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+
+def configure_threads(num_threads: int):
+    """
+    Pin torch's intra-op thread pool for the calling worker thread.
+    With torch's OpenMP backend the setting is per OS thread, so it has to be
+    called from inside each worker before it runs inference.
+    """
+    import torch
+    if torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+        logger.info(f"torch intra-op threads set to {num_threads}")
+
+
+def quantize_dynamic_int8(model):
+    """
+    Apply dynamic int8 quantization to every linear layer of a Whisper model.
+    Whisper wraps nn.Linear in a subclass that only casts dtypes, which
+    quantize_dynamic does not recognise, so those layers are converted back to
+    plain nn.Linear first (equivalent for fp32 on CPU).
+    """
+    import torch
+    import torch.nn as nn
+    for module in model.modules():
+        if isinstance(module, nn.Linear) and type(module) is not nn.Linear:
+            module.__class__ = nn.Linear
+    quantized = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    logger.info("Applied dynamic int8 quantization to Whisper linear layers")
+    return quantized
+
+
+@functools.lru_cache(maxsize=None)
+def torch_available() -> bool:
+    """Whether torch is installed; the stub and faster-whisper engines run without it"""
+    return importlib.util.find_spec('torch') is not None
+
+
+class LazyInferenceMode(contextlib.ContextDecorator):
+    """
+    torch.inference_mode() that imports torch when entered, not when created.
+    Where torch is not installed there is no autograd to turn off, and it
+    does nothing.
+    """
+
+    def _recreate_cm(self):
+        # A fresh instance per decorated call, so concurrent calls do not
+        # share the wrapped mode object
+        return LazyInferenceMode()
+
+    def __enter__(self):
+        self.mode = None
+        if not torch_available():
+            return None
+        import torch
+        self.mode = torch.inference_mode()
+        return self.mode.__enter__()
+
+    def __exit__(self, *exc_info):
+        if self.mode is None:
+            return False
+        return self.mode.__exit__(*exc_info)
+
+
+def inference_context():
+    """Context manager (or decorator) for running models without autograd bookkeeping"""
+    return LazyInferenceMode()
+
+
+# Opt-in compiled execution of the Whisper encoder (WHISPER_COMPILE)
+COMPILE_MODES = ('compile', 'torchscript')
+
+
+def trace_encoder(encoder, n_mels: int, n_frames: int, cache_path: str):
+    """TorchScript-trace the encoder, or load the trace cached at cache_path"""
+    import torch
+    device = next(encoder.parameters()).device
+    if os.path.exists(cache_path):
+        logger.info(f"Loading traced encoder from {cache_path}")
+        return torch.jit.load(cache_path, map_location=device)
+    example = torch.zeros(1, n_mels, n_frames, device=device)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(encoder.eval(), example))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    torch.jit.save(traced, temp_path)
+    os.replace(temp_path, cache_path)
+    logger.info(f"Traced encoder cached at {cache_path}")
+    return traced
+
+
+def compile_forward(forward, cache_dir: str):
+    """torch.compile a forward function, keeping inductor's compiled kernels in cache_dir"""
+    import torch
+    import torch._inductor.config as inductor_config
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(cache_dir, 'inductor'))
+    inductor_config.fx_graph_cache = True
+    # Compile in-process; a compile worker pool would not survive the fork
+    # from the preloading server
+    inductor_config.compile_threads = 1
+    return torch.compile(forward, dynamic=True)
+
+
+def compile_encoder(model, mode: str, cache_dir: str, cache_key: str) -> bool:
+    """
+    Run a Whisper model's encoder compiled: 'compile' uses torch.compile
+    (compiled lazily on the first call), 'torchscript' a frozen trace. The
+    compiled artifacts are kept in cache_dir, under cache_key for traces, so
+    restarts skip the compilation. If compiling fails, or the compiled encoder
+    fails on a call, the encoder falls back to eager execution. Returns
+    whether the compiled encoder is in use.
+    """
+    import torch
+    encoder = model.encoder
+    eager_forward = encoder.forward
+    try:
+        if mode == 'torchscript':
+            cache_path = os.path.join(cache_dir, f"encoder-{cache_key}-torch{torch.__version__}.pt")
+            compiled = trace_encoder(encoder, model.dims.n_mels, 2 * model.dims.n_audio_ctx, cache_path)
+        elif mode == 'compile':
+            compiled = compile_forward(eager_forward, cache_dir)
+        else:
+            raise ValueError(f"Unknown compile mode: {mode}")
+    except Exception as e:
+        logger.warning(f"Could not {mode} the encoder, running it eagerly: {e}")
+        return False
+
+    def forward(x):
+        nonlocal compiled
+        if compiled is not None:
+            try:
+                return compiled(x)
+            except Exception as e:
+                logger.warning(f"Compiled encoder failed, falling back to eager: {e}")
+                compiled = None
+        return eager_forward(x)
+
+    # Shadow forward on the instance; whisper calls model.encoder(mel)
+    encoder.forward = forward
+    logger.info(f"Encoder running with {mode}")
+    return True
@@ -0,0 +1,313 @@
+"""
+Killable analysis jobs.
+
+The model work for an analysis runs in a child process, so it can really be
+stopped. Cancelling a job sets its cancel event, and the engines check that
+event between decoding windows. If a job overruns its time budget, or does
+not stop within CANCEL_GRACE_SECONDS of a cancel, the watchdog terminates the
+process. That frees its CPU at once, and the next job gets a fresh process.
+
+Job processes are forked from a fork server (configure_job_processes), which
+can preload Whisper models so all jobs on a host share one copy of the
+weights (see preload.py). Where there is no fork server (Windows), each job is
+spawned as a fresh interpreter.
+
+The supervising thread in the web process only waits, polls for cancel
+requests and writes results to the database. This module does not import
+Django, so it can be imported in the child.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from .cancellation import AnalysisCancelled, CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Jobs are never forked straight from the web process: it is multi-threaded
+# and may have torch's OpenMP pool running, which can deadlock a forked
+# child. The fork server is a clean single-threaded process instead.
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# How often the supervisor checks for cancel requests and the time budget
+POLL_SECONDS = 1.0
+# How long a cancelled job gets to reach a window boundary before it is killed
+CANCEL_GRACE_SECONDS = 10.0
+
+# Jobs running in this process, by analysis id, so a cancel request handled by
+# this process can signal the job directly instead of waiting for the next poll
+running_jobs = {}
+running_jobs_lock = threading.Lock()
+
+
+def configure_job_processes(preload=(), warm_up=True, **load_options):
+    """
+    Start the fork server that job processes are forked from, after it has
+    imported the analysis code and loaded the (model_size, quantize) Whisper
+    models in preload, warming them up unless warm_up is False. load_options
+    (model_dir, compile_mode, compile_cache_dir) are passed on to
+    engines.load_whisper_model(). Call once per process before the first job
+    starts. Returns without waiting for the models; see preloaded_models().
+    """
+    if START_METHOD != 'forkserver':
+        return
+    from multiprocessing import forkserver
+    from .preload import PRELOAD_ENV
+    multiprocessing.get_context(START_METHOD).set_forkserver_preload(['audio_checker.preload'])
+    # The server inherits the environment when it starts. Set the model
+    # list only for that moment, so this process never loads the models.
+    # The server imports its preload modules before applying our sys.path,
+    # so the project directory goes on PYTHONPATH as well.
+    saved_env = {key: os.environ.get(key) for key in (PRELOAD_ENV, 'PYTHONPATH')}
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.environ[PRELOAD_ENV] = json.dumps({
+        'models': [[size, bool(quantize)] for size, quantize in preload],
+        'warm_up': warm_up,
+        'load_options': load_options,
+    })
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [project_dir, saved_env['PYTHONPATH']]))
+    try:
+        forkserver.ensure_running()
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    logger.info(f"Job fork server started, preloading {list(preload) or 'no models'}")
+
+
+def report_preloaded(conn):
+    """Child-side: send back the models this job process inherited"""
+    from .preload import whisper_models
+    conn.send(sorted(whisper_models))
+    conn.close()
+
+
+def preloaded_models():
+    """
+    Start a job process and return the (model_size, quantize) models it
+    inherited. The fork server only forks once it has finished preloading,
+    so this blocks until jobs start warm.
+    """
+    context = multiprocessing.get_context(START_METHOD)
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=report_preloaded, args=(sender,), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        return [tuple(key) for key in receiver.recv()]
+    except EOFError:
+        return []
+    finally:
+        receiver.close()
+        process.join()
+
+
+class JobTimeout(TimeoutError):
+    """Raised when the watchdog kills a job that overran its time budget"""
+
+
+class LeaseLost(RuntimeError):
+    """Raised when a job's heartbeat finds that its lease was taken away"""
+
+
+def keep_take_media(analyzer, audio_path, result, media):
+    """
+    Child-side: store the take's canonical audio and error clips (see
+    media.py) and record them in result. Review media is a convenience, so
+    failing to store it does not fail the analysis.
+    """
+    from .media import store_take_media
+    try:
+        result.update(store_take_media(
+            lambda: analyzer.load_audio_array(audio_path), result['comparisons'], media
+        ))
+    except Exception as e:
+        logger.warning(f"Could not store review media for {audio_path}: {e}")
+
+
+def analyze_job(cancel_token, analyzer_kwargs, script, audio_path, mode, media=None):
+    """
+    Child-side: run one analysis of the take at audio_path against script (a
+    scripts.ParsedScript) and return its result dict. media, if given, are
+    the options for keeping the take's review media.
+    """
+    from .services import AudioAnalyzer
+    analyzer = AudioAnalyzer(cancel_token=cancel_token, **analyzer_kwargs)
+    result = analyzer.analyze_audio_accuracy(None, audio_path, mode=mode, script=script)
+    if media:
+        keep_take_media(analyzer, audio_path, result, media)
+    return result
+
+
+def batch_job(cancel_token, analyzer_kwargs, pairs, media=None):
+    """
+    Child-side: transcribe short clips as one stacked batch, then align each
+    clip. Returns one result dict per (script, audio_path), an error message
+    string for a clip that failed, or None for a clip longer than
+    BATCH_MAX_CLIP_SECONDS, which the worker queues to run on its own.
+    Clips whose duration cannot be read are kept in the batch. Clips read
+    against the same script share one ParsedScript. media, if given, holds
+    the review media options of each clip.
+    """
+    from .services import AudioAnalyzer, BATCH_MAX_CLIP_SECONDS
+    analyzer = AudioAnalyzer(cancel_token=cancel_token, **analyzer_kwargs)
+    # Probed here rather than in the worker, so the supervising (web) process
+    # never loads an audio decoder
+    durations = [analyzer.get_audio_duration(audio_path) for _, audio_path in pairs]
+    if not all(durations):
+        logger.warning(f"Could not read the duration of {durations.count(0)} of {len(pairs)} clips; batching them anyway")
+    short = [index for index, duration in enumerate(durations) if duration <= BATCH_MAX_CLIP_SECONDS]
+    transcriptions = dict(zip(short, analyzer.transcribe_batch([pairs[index][1] for index in short]))) if short else {}
+    results = []
+    for index, (script, audio_path) in enumerate(pairs):
+        cancel_token.check()
+        if index not in transcriptions:
+            results.append(None)
+            continue
+        try:
+            result = analyzer.analyze_audio_accuracy(None, audio_path, transcription=transcriptions[index],
+                                                     script=script)
+        except Exception as e:
+            results.append(str(e))
+            continue
+        if media:
+            keep_take_media(analyzer, audio_path, result, media[index])
+        results.append(result)
+    return results
+
+
+def child_main(conn, cancel_event, threads, target, args):
+    """Entry point of the job process: run target and send back its outcome"""
+    from .inference import configure_threads
+    if threads:
+        configure_threads(threads)
+    try:
+        conn.send(('ok', target(CancelToken(cancel_event), *args)))
+    except AnalysisCancelled:
+        conn.send(('cancelled', None))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class AnalysisJob:
+    """
+    Run target(cancel_token, *args) in a child process and supervise it.
+
+    analysis_ids are the analyses the job works on. is_cancel_requested is a
+    callable the supervisor polls (e.g. a database query). heartbeat is
+    called every heartbeat_interval seconds while the job runs and returns
+    False once the job no longer holds its lease. Both run in the calling
+    process and are never sent to the child.
+    """
+
+    def __init__(self, analysis_ids, target, args, budget, threads=0, is_cancel_requested=None,
+                 heartbeat=None, heartbeat_interval=15.0):
+        self.analysis_ids = list(analysis_ids)
+        self.target = target
+        self.args = args
+        self.budget = budget
+        self.threads = threads
+        self.is_cancel_requested = is_cancel_requested
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        context = multiprocessing.get_context(START_METHOD)
+        self.cancel_event = context.Event()
+        self.receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=child_main,
+            args=(sender, self.cancel_event, threads, target, args),
+            daemon=True
+        )
+        self._sender = sender
+        self.cancelled_at = None
+
+    def cancel(self):
+        """Ask the job to stop at its next window boundary"""
+        if self.cancelled_at is None:
+            logger.info(f"Cancelling job for analyses {self.analysis_ids}")
+            self.cancel_event.set()
+            self.cancelled_at = time.time()
+
+    def kill(self):
+        """Terminate the child process, escalating to SIGKILL if it ignores SIGTERM"""
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+
+    def run(self):
+        """
+        Start the job and block until it finishes. Returns the target's result.
+        Raises AnalysisCancelled if the job was cancelled, JobTimeout if it
+        overran its budget, LeaseLost if its heartbeat was refused, or
+        RuntimeError if the child failed or died.
+        """
+        started = time.time()
+        last_heartbeat = started
+        self.process.start()
+        # The child owns the sending end now. Closing ours lets recv() see EOF
+        # if the child dies without sending anything.
+        self._sender.close()
+        with running_jobs_lock:
+            for analysis_id in self.analysis_ids:
+                running_jobs[analysis_id] = self
+        try:
+            while True:
+                if self.receiver.poll(POLL_SECONDS):
+                    try:
+                        status, payload = self.receiver.recv()
+                    except EOFError:
+                        self.process.join()
+                        raise RuntimeError(f"Analysis process exited with code {self.process.exitcode}")
+                    self.process.join()
+                    if status == 'cancelled':
+                        raise AnalysisCancelled("Analysis was cancelled")
+                    if status == 'error':
+                        raise RuntimeError(payload)
+                    return payload
+                elapsed = time.time() - started
+                if elapsed > self.budget:
+                    logger.error(f"Watchdog: job for analyses {self.analysis_ids} exceeded {self.budget:.0f}s, killing it")
+                    self.kill()
+                    raise JobTimeout(f"Analysis exceeded its {self.budget:.0f}s time budget")
+                if self.heartbeat and time.time() - last_heartbeat >= self.heartbeat_interval:
+                    last_heartbeat = time.time()
+                    if self.heartbeat() is False:
+                        logger.error(f"Job for analyses {self.analysis_ids} lost its lease, killing it")
+                        self.kill()
+                        raise LeaseLost("Job lease was taken over by another worker")
+                if self.cancelled_at is None and self.is_cancel_requested and self.is_cancel_requested():
+                    self.cancel()
+                if self.cancelled_at is not None and time.time() - self.cancelled_at > CANCEL_GRACE_SECONDS:
+                    logger.warning(f"Job for analyses {self.analysis_ids} ignored cancel, killing it")
+                    self.kill()
+                    raise AnalysisCancelled("Analysis was cancelled")
+        finally:
+            self.kill()
+            self.receiver.close()
+            with running_jobs_lock:
+                for analysis_id in self.analysis_ids:
+                    if running_jobs.get(analysis_id) is self:
+                        del running_jobs[analysis_id]
+
+
+def cancel_running_job(analysis_id) -> bool:
+    """
+    Signal the job running analysis_id in this process, if there is one.
+    Batched jobs are shared with other analyses and only stop once all of
+    their analyses are cancelled, which their supervisor polls for.
+    """
+    with running_jobs_lock:
+        job = running_jobs.get(analysis_id)
+    if job is None or len(job.analysis_ids) > 1:
+        return False
+    job.cancel()
+    return True
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from audio_checker.storage import prune_media_store, prune_unused_scripts
+
+
+class Command(BaseCommand):
+    help = ("Evict expired and least recently used uploads and their review media from the media store, "
+            "then delete parsed scripts no analysis uses")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days', type=float, default=settings.MEDIA_RETENTION_DAYS,
+            help='Evict media last used longer ago than this (default: MEDIA_RETENTION_DAYS; 0 keeps it)'
+        )
+        parser.add_argument(
+            '--max-gb', type=float, default=settings.MEDIA_STORE_MAX_BYTES / 1024 ** 3,
+            help='Then evict the least recently used media while the store is larger (default: MEDIA_STORE_MAX_GB)'
+        )
+
+    def handle(self, *args, **options):
+        evicted, freed = prune_media_store(options['retention_days'], int(options['max_gb'] * 1024 ** 3))
+        scripts = prune_unused_scripts()
+        self.stdout.write(self.style.SUCCESS(
+            f"Evicted {evicted} files, freed {freed / (1024 * 1024):.1f}MB, removed {scripts} unused parsed scripts"
+        ))
@@ -0,0 +1,44 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from audio_checker.worker import clear_ready_file, run_worker, start_job_processes, worker_name
+
+
+class Command(BaseCommand):
+    help = "Run analysis workers that claim queued analyses from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.ANALYSIS_WORKERS,
+            help='Number of analyses to run at once (default: ANALYSIS_WORKERS)'
+        )
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the current jobs finish...")
+            clear_ready_file()
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        # Load and warm up PRELOAD_MODELS once; every job process shares their
+        # weights. The workers only claim jobs once this returns.
+        self.stdout.write("Warming up job processes...")
+        start_job_processes()
+        threads = [
+            threading.Thread(target=run_worker, args=(worker_name(index), stop_event))
+            for index in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(f"Started {len(threads)} analysis workers"))
+        # Wait with a timeout so signals are delivered to the main thread
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1.0)
@@ -0,0 +1,60 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from audio_checker.bundles import (
+    ModelBundleError, bundle_path, stage_faster_whisper_model, stage_whisper_bundle, verify_bundle
+)
+
+
+class Command(BaseCommand):
+    help = "Pre-stage model weights in WHISPER_MODEL_DIR so workers load them offline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_sizes', nargs='+', help='Model sizes to stage, e.g. tiny base small')
+        parser.add_argument(
+            '--model-dir', default=settings.WHISPER_MODEL_DIR,
+            help='Bundle directory (default: WHISPER_MODEL_DIR)'
+        )
+        parser.add_argument(
+            '--checkpoint-dir',
+            help='Directory of whisper <size>.pt checkpoints to convert instead of downloading them'
+        )
+        parser.add_argument(
+            '--engine', choices=['whisper', 'faster-whisper'], default='whisper',
+            help='Engine whose models to stage (default: whisper)'
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only check the existing whisper bundles against their checksums'
+        )
+
+    def handle(self, *args, **options):
+        model_dir = options['model_dir']
+        if not model_dir:
+            raise CommandError("Set WHISPER_MODEL_DIR or pass --model-dir")
+        os.makedirs(model_dir, exist_ok=True)
+        failed = []
+        for model_size in options['model_sizes']:
+            try:
+                if options['verify']:
+                    verify_bundle(model_dir, model_size)
+                    self.stdout.write(self.style.SUCCESS(f"{model_size}: OK ({bundle_path(model_dir, model_size)})"))
+                elif options['engine'] == 'faster-whisper':
+                    path = stage_faster_whisper_model(model_size, model_dir)
+                    self.stdout.write(self.style.SUCCESS(f"{model_size}: staged in {path}"))
+                else:
+                    checkpoint = None
+                    if options['checkpoint_dir']:
+                        checkpoint = os.path.join(options['checkpoint_dir'], f'{model_size}.pt')
+                        if not os.path.exists(checkpoint):
+                            raise ModelBundleError(f"{checkpoint} not found")
+                    path = stage_whisper_bundle(model_size, model_dir, checkpoint)
+                    verify_bundle(model_dir, model_size)
+                    self.stdout.write(self.style.SUCCESS(f"{model_size}: staged in {path}"))
+            except ModelBundleError as e:
+                self.stderr.write(self.style.ERROR(f"{model_size}: {e}"))
+                failed.append(model_size)
+        if failed:
+            raise CommandError(f"Failed: {', '.join(failed)}")
@@ -0,0 +1,215 @@
+"""
+Retained audio for reviewing an analysis.
+
+The job process keeps the take it decoded as canonical audio: 16 kHz mono
+16-bit PCM WAV, stored under the take's content key (see storage.py). In
+that format a time maps straight to a byte offset, so a clip is one ranged
+read, whatever format the take was uploaded in and wherever it is stored.
+
+Clips around the errors of a take are pre-cut into its clip directory at
+ingest, named by their padded bounds in milliseconds. A review session then
+serves them from small files instead of reading into the canonical audio for
+every request.
+
+The take's waveform is stored as a pyramid of min/max peaks, one
+audiowaveform-format .dat file per zoom level, named by its samples per
+pixel. The finest level is reduced from the samples in one vectorized pass;
+each coarser level halves the one below it. A waveform view fetches only the
+level for its zoom, a few KB to a few MB for hours of audio.
+
+This module does not import Django, so job processes can use it.
+"""
+import logging
+import os
+import struct
+
+import numpy as np
+
+from .engines import SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WIDTH = 2  # bytes per sample, 16-bit PCM
+ERROR_TYPES = ('wrong', 'missing', 'extra')
+# Finest waveform level (250 peaks per second) and the number of levels;
+# the coarsest is 2**(PEAK_LEVELS - 1) times coarser (about 16s per peak)
+PEAK_BASE_SAMPLES_PER_PIXEL = 64
+PEAK_LEVELS = 13
+# audiowaveform .dat header: version, flags (1 = 8-bit values), sample rate,
+# samples per pixel, length in pixels
+PEAK_HEADER = struct.Struct('<iIiiI')
+
+
+def wav_header(frames: int) -> bytes:
+    """Header of a canonical WAV holding frames samples"""
+    data_size = frames * SAMPLE_WIDTH
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, 1,
+        SAMPLE_RATE, SAMPLE_RATE * SAMPLE_WIDTH, SAMPLE_WIDTH, 8 * SAMPLE_WIDTH, b'data', data_size
+    )
+
+
+WAV_HEADER_SIZE = len(wav_header(0))
+
+
+def write_canonical_wav(audio: np.ndarray, path: str):
+    """Write a 16kHz float32 array as the canonical WAV at path"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2')
+    # Written next to the final path and swapped in, so readers never see a
+    # half-written file
+    partial = path + '.partial'
+    with open(partial, 'wb') as out:
+        out.write(wav_header(len(pcm)))
+        out.write(pcm.tobytes())
+    os.replace(partial, path)
+
+
+def canonical_frames(size: int) -> int:
+    """Samples in a canonical WAV of size bytes"""
+    return max(0, size - WAV_HEADER_SIZE) // SAMPLE_WIDTH
+
+
+def frames_to_ms(frames: int) -> int:
+    return frames * 1000 // SAMPLE_RATE
+
+
+def clip_bounds(start_ms: int, end_ms: int, padding_ms: int, max_ms: int, duration_ms: int = None):
+    """Padded (start_ms, end_ms) of a clip, within the audio and at most max_ms long"""
+    start = max(0, start_ms - padding_ms)
+    end = max(end_ms, start_ms) + padding_ms
+    if duration_ms is not None:
+        end = min(end, duration_ms)
+    return start, max(start, min(end, start + max_ms))
+
+
+def file_range_reader(path: str):
+    """read_range(first, last) over a local file, as storage backends provide it"""
+    def read_range(first, last):
+        with open(path, 'rb') as fh:
+            fh.seek(first)
+            return fh.read(last - first + 1)
+    return read_range
+
+
+def clip_bytes(read_range, frames: int, start_ms: int, end_ms: int) -> bytes:
+    """
+    WAV of start_ms..end_ms of a canonical WAV of frames samples, reading
+    only those samples through read_range(first_byte, last_byte)
+    """
+    first = min(start_ms * SAMPLE_RATE // 1000, frames)
+    last = min(end_ms * SAMPLE_RATE // 1000, frames)
+    data = b''
+    if last > first:
+        data = read_range(WAV_HEADER_SIZE + first * SAMPLE_WIDTH, WAV_HEADER_SIZE + last * SAMPLE_WIDTH - 1)
+    return wav_header(len(data) // SAMPLE_WIDTH) + data
+
+
+def clip_path(clip_dir: str, start_ms: int, end_ms: int) -> str:
+    return os.path.join(clip_dir, f'{start_ms}-{end_ms}.wav')
+
+
+def precut_error_clips(canonical_path: str, clip_dir: str, comparisons, padding_ms: int, max_ms: int,
+                       limit: int) -> int:
+    """
+    Cut the clips around the first limit timed errors of a take, as the clip
+    endpoint would request them; returns how many clips were cut
+    """
+    frames = canonical_frames(os.path.getsize(canonical_path))
+    read_range = file_range_reader(canonical_path)
+    spans = {}
+    for comp in comparisons:
+        if comp.get('error_type') in ERROR_TYPES and comp.get('start') is not None:
+            start_ms, end_ms = max(0, round(comp['start'] * 1000)), max(0, round(comp['end'] * 1000))
+            bounds = clip_bounds(start_ms, end_ms, padding_ms, max_ms, frames_to_ms(frames))
+            spans[bounds] = None
+            if len(spans) >= limit:
+                break
+    os.makedirs(clip_dir, exist_ok=True)
+    for start_ms, end_ms in spans:
+        path = clip_path(clip_dir, start_ms, end_ms)
+        if not os.path.exists(path):
+            with open(path + '.partial', 'wb') as out:
+                out.write(clip_bytes(read_range, frames, start_ms, end_ms))
+            os.replace(path + '.partial', path)
+    return len(spans)
+
+
+def peak_levels(audio: np.ndarray, base: int = PEAK_BASE_SAMPLES_PER_PIXEL, levels: int = PEAK_LEVELS):
+    """
+    {samples_per_pixel: (mins, maxs)} for base, 2*base, 4*base... as int8
+    arrays; the last pixel of a level may cover fewer samples
+    """
+    pixels = -(-len(audio) // base) or 1
+    # Edge padding repeats the last sample, so it never adds a peak
+    frames = np.pad(audio, (0, pixels * base - len(audio)), mode='edge') if len(audio) else np.zeros(base)
+    frames = frames.reshape(pixels, base)
+    mins = np.round(np.clip(frames.min(axis=1), -1.0, 1.0) * 127).astype(np.int8)
+    maxs = np.round(np.clip(frames.max(axis=1), -1.0, 1.0) * 127).astype(np.int8)
+    pyramid = {base: (mins, maxs)}
+    for level in range(1, levels):
+        if len(mins) % 2:
+            mins, maxs = np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+        mins = mins.reshape(-1, 2).min(axis=1)
+        maxs = maxs.reshape(-1, 2).max(axis=1)
+        pyramid[base << level] = (mins, maxs)
+    return pyramid
+
+
+def write_peaks(path: str, samples_per_pixel: int, mins: np.ndarray, maxs: np.ndarray):
+    """Write one level as an audiowaveform (version 1, 8-bit) .dat file"""
+    data = np.empty(len(mins) * 2, dtype=np.int8)
+    data[0::2], data[1::2] = mins, maxs
+    partial = path + '.partial'
+    with open(partial, 'wb') as out:
+        out.write(PEAK_HEADER.pack(1, 1, SAMPLE_RATE, samples_per_pixel, len(mins)))
+        out.write(data.tobytes())
+    os.replace(partial, path)
+
+
+def peaks_path(peaks_dir: str, samples_per_pixel: int) -> str:
+    return os.path.join(peaks_dir, f'{samples_per_pixel}.dat')
+
+
+def store_peaks(audio: np.ndarray, peaks_dir: str):
+    os.makedirs(peaks_dir, exist_ok=True)
+    for samples_per_pixel, (mins, maxs) in peak_levels(audio).items():
+        write_peaks(peaks_path(peaks_dir, samples_per_pixel), samples_per_pixel, mins, maxs)
+
+
+def peaks_for_zoom(peaks_dir: str, samples_per_pixel: int) -> str:
+    """
+    The stored level with the most samples per pixel not above
+    samples_per_pixel (the finest level for anything finer)
+    """
+    level = PEAK_BASE_SAMPLES_PER_PIXEL
+    while level * 2 <= samples_per_pixel and level < PEAK_BASE_SAMPLES_PER_PIXEL << (PEAK_LEVELS - 1):
+        level *= 2
+    return peaks_path(peaks_dir, level)
+
+
+def store_take_media(decode, comparisons, options: dict) -> dict:
+    """
+    Child-side: keep a take as canonical audio and waveform peaks and pre-cut
+    its error clips. decode() returns the take as a 16kHz float32 array; it
+    is not called if another analysis of the same take stored it already.
+    options come from worker.media_options(); files are written under
+    options['root'] (the media directory, or a staging directory that the
+    worker uploads to object storage). Returns the names stored.
+    """
+    canonical_path = os.path.join(options['root'], options['canonical_audio'])
+    if not options['stored'] and not os.path.exists(canonical_path):
+        audio = decode()
+        store_peaks(audio, os.path.join(options['root'], options['peaks_dir']))
+        # Written last: its presence means the take's media is complete
+        write_canonical_wav(audio, canonical_path)
+    clip_count = 0
+    # Clips of a take stored in object storage by an earlier analysis are
+    # cut on request instead
+    if options['precut_limit'] and os.path.exists(canonical_path):
+        clip_count = precut_error_clips(
+            canonical_path, os.path.join(options['root'], options['clip_dir']), comparisons,
+            options['padding_ms'], options['max_ms'], options['precut_limit']
+        )
+    logger.info(f"Stored canonical audio {options['canonical_audio']}, its peaks and {clip_count} error clips")
+    return {'canonical_audio': options['canonical_audio']}
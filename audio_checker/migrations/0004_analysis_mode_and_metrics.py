@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0003_batchupload_audioanalysis_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='metrics',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='analysis_mode',
+            field=models.CharField(choices=[('standard', 'Standard'), ('cascade', 'Cascade (fast model, refine errors)')], default='standard', max_length=20),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0004_analysis_mode_and_metrics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='audioanalysis',
+            name='analysis_mode',
+            field=models.CharField(choices=[('standard', 'Standard'), ('cascade', 'Cascade (fast model, refine errors)'), ('verify', 'Script verification (forced alignment)')], default='standard', max_length=20),
+        ),
+    ]
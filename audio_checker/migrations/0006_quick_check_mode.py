@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0005_alter_audioanalysis_analysis_mode_verify'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchupload',
+            name='analysis_mode',
+            field=models.CharField(choices=[('standard', 'Standard'), ('cascade', 'Cascade (fast model, refine errors)'), ('verify', 'Script verification (forced alignment)'), ('quick', 'Quick check (sampled estimate)')], default='standard', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='audioanalysis',
+            name='analysis_mode',
+            field=models.CharField(choices=[('standard', 'Standard'), ('cascade', 'Cascade (fast model, refine errors)'), ('verify', 'Script verification (forced alignment)'), ('quick', 'Quick check (sampled estimate)')], default='standard', max_length=20),
+        ),
+    ]
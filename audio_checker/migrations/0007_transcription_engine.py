@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0006_quick_check_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='engine',
+            field=models.CharField(blank=True, choices=[('', 'Default engine'), ('whisper', 'Whisper (PyTorch)'), ('faster-whisper', 'faster-whisper (CTranslate2)'), ('stub', 'Stub (tests and benchmarks)')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='batchupload',
+            name='engine',
+            field=models.CharField(blank=True, choices=[('', 'Default engine'), ('whisper', 'Whisper (PyTorch)'), ('faster-whisper', 'faster-whisper (CTranslate2)'), ('stub', 'Stub (tests and benchmarks)')], default='', max_length=20),
+        ),
+    ]
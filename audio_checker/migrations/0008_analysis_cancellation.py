@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0007_transcription_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='cancel_requested',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='failure_reason',
+            field=models.CharField(blank=True, choices=[('error', 'Error'), ('timeout', 'Timed out'), ('cancelled', 'Cancelled')], default='', max_length=20),
+        ),
+    ]
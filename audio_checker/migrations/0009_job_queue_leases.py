@@ -0,0 +1,61 @@
+from django.db import migrations, models
+
+
+def set_existing_job_status(apps, schema_editor):
+    # Finished analyses must not be picked up by the new queue; analyses
+    # still marked as processing had their threads die with the old process,
+    # so they are queued again
+    AudioAnalysis = apps.get_model('audio_checker', 'AudioAnalysis')
+    AudioAnalysis.objects.filter(accuracy_score=-1).update(job_status='failed')
+    AudioAnalysis.objects.filter(accuracy_score__isnull=False).exclude(accuracy_score=-1).update(job_status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0008_analysis_cancellation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='job_group',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='job_status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(set_existing_job_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0009_job_queue_leases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParagraphComparison',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paragraph_index', models.IntegerField()),
+                ('script_paragraph', models.TextField(blank=True)),
+                ('audio_paragraph', models.TextField(blank=True)),
+                ('similarity', models.FloatField(default=0.0)),
+                ('status', models.CharField(choices=[('Correct', 'Correct'), ('Wrong', 'Wrong'), ('Missing', 'Missing'), ('Extra', 'Extra')], max_length=10)),
+                ('start_time', models.FloatField(blank=True, null=True)),
+                ('end_time', models.FloatField(blank=True, null=True)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paragraph_comparisons', to='audio_checker.audioanalysis')),
+            ],
+            options={
+                'ordering': ['paragraph_index', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0010_paragraph_comparisons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wordcomparison',
+            name='end_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='wordcomparison',
+            name='start_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='wordcomparison',
+            index=models.Index(fields=['analysis', 'error_type', 'start_ms'], name='audio_check_analysi_ba61a0_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0011_word_comparison_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audioanalysis',
+            name='canonical_audio',
+            field=models.FileField(blank=True, upload_to='canonical/'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+import audio_checker.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0012_canonical_audio'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='audioanalysis',
+            name='audio_file',
+            field=models.FileField(storage=audio_checker.storage.media_store, upload_to='audio/'),
+        ),
+        migrations.AlterField(
+            model_name='audioanalysis',
+            name='script_file',
+            field=models.FileField(storage=audio_checker.storage.media_store, upload_to='scripts/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+import audio_checker.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0013_content_addressed_uploads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='audioanalysis',
+            name='canonical_audio',
+            field=models.FileField(blank=True, storage=audio_checker.storage.review_store, upload_to='canonical/'),
+        ),
+    ]
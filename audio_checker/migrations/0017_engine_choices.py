@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_checker', '0016_analysis_last_reviewed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='audioanalysis',
+            name='engine',
+            field=models.CharField(blank=True, choices=[('', 'Default engine'), ('whisper', 'Whisper (PyTorch)'), ('faster-whisper', 'faster-whisper (CTranslate2)')], default='', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='batchupload',
+            name='engine',
+            field=models.CharField(blank=True, choices=[('', 'Default engine'), ('whisper', 'Whisper (PyTorch)'), ('faster-whisper', 'faster-whisper (CTranslate2)')], default='', max_length=20),
+        ),
+    ]
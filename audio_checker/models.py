@@ -1,7 +1,34 @@
 from django.db import models
 from django.contrib.auth.models import User
+import importlib.util
 import os
 
+from .scripts import ParsedScript
+from .storage import media_store, review_store
+
+ANALYSIS_MODE_CHOICES = [
+    ('standard', 'Standard'),
+    ('cascade', 'Cascade (fast model, refine errors)'),
+    ('verify', 'Script verification (forced alignment)'),
+    ('quick', 'Quick check (sampled estimate)'),
+]
+
+# Engines users can pick; blank means the deployment's TRANSCRIPTION_ENGINE
+# setting. The stub engine is for tests and benchmarks and can only be chosen
+# through that setting.
+ENGINE_CHOICES = [
+    ('', 'Default engine'),
+    ('whisper', 'Whisper (PyTorch)'),
+    ('faster-whisper', 'faster-whisper (CTranslate2)'),
+]
+# Optional package each engine needs beyond requirements.txt
+ENGINE_PACKAGES = {'faster-whisper': 'faster_whisper'}
+
+def selectable_engine_choices():
+    """ENGINE_CHOICES without the engines whose package is not installed"""
+    return [(value, label) for value, label in ENGINE_CHOICES
+            if value not in ENGINE_PACKAGES or importlib.util.find_spec(ENGINE_PACKAGES[value])]
+
 class BatchUpload(models.Model):
     """Model to handle batch uploads of multiple script-audio pairs"""
     title = models.CharField(max_length=200)
@@ -14,6 +41,8 @@ class BatchUpload(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ], default='pending')
+    analysis_mode = models.CharField(max_length=20, choices=ANALYSIS_MODE_CHOICES, default='standard')
+    engine = models.CharField(max_length=20, choices=ENGINE_CHOICES, default='', blank=True)
     
     def __str__(self):
         return f"Batch: {self.title}"
@@ -27,14 +56,72 @@ class BatchUpload(models.Model):
     def get_failed_analyses(self):
         return self.analyses.filter(accuracy_score=-1).count()
 
+class Script(models.Model):
+    """
+    A script parsed once and shared by every analysis of it, keyed by the
+    content hash of its .docx; see scripts.py
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    text = models.TextField()
+    paragraphs = models.JSONField(default=list)
+    # Distinct comparison words, and the script's words as uint32 indexes into them
+    vocabulary = models.JSONField(default=list)
+    word_ids = models.BinaryField()
+    word_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Script {self.content_hash[:12]} ({self.word_count} words)"
+
+    def parsed(self):
+        return ParsedScript.from_stored(self.text, self.paragraphs, self.vocabulary, bytes(self.word_ids))
+
 class AudioAnalysis(models.Model):
     title = models.CharField(max_length=200)
-    script_file = models.FileField(upload_to='scripts/')
-    audio_file = models.FileField(upload_to='audio/')
+    # Stored by content hash and shared by analyses of the same file; see storage.py
+    script_file = models.FileField(upload_to='scripts/', storage=media_store)
+    audio_file = models.FileField(upload_to='audio/', storage=media_store)
+    # The parsed script_file, set when a worker first runs the analysis
+    script = models.ForeignKey(Script, on_delete=models.SET_NULL, related_name='analyses', null=True, blank=True)
+    # The decoded take (16 kHz mono WAV) that review clips are cut from; see
+    # media.py. Like the uploads it is keyed by the take's content hash and
+    # stays until the media store evicts the take (retention days or least
+    # recently used; see storage.prune_media_store)
+    canonical_audio = models.FileField(upload_to='canonical/', blank=True, storage=review_store)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Last time the take's audio, clips or waveform were served for review
+    # (refreshed at most every MEDIA_TOUCH_INTERVAL_SECONDS); counts as a use
+    # of its media for eviction
+    last_reviewed_at = models.DateTimeField(null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     batch = models.ForeignKey(BatchUpload, on_delete=models.CASCADE, related_name='analyses', null=True, blank=True)
+    analysis_mode = models.CharField(max_length=20, choices=ANALYSIS_MODE_CHOICES, default='standard')
+    engine = models.CharField(max_length=20, choices=ENGINE_CHOICES, default='', blank=True)
+    # Set by the cancel endpoint/CLI; the worker supervising the job polls it
+    cancel_requested = models.BooleanField(default=False)
+    # Why a failed analysis (accuracy_score == -1) stopped
+    failure_reason = models.CharField(max_length=20, choices=[
+        ('error', 'Error'),
+        ('timeout', 'Timed out'),
+        ('cancelled', 'Cancelled'),
+    ], blank=True, default='')
+    
+    # Job queue state (see worker.py)
+    job_status = models.CharField(max_length=10, choices=[
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], default='queued', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker_id = models.CharField(max_length=100, blank=True, default='')
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    # Short batched clips that a worker claims and transcribes together
+    job_group = models.CharField(max_length=64, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
     
     # Analysis results
     accuracy_score = models.FloatField(null=True, blank=True)
@@ -64,17 +151,62 @@ class WordComparison(models.Model):
         ('wrong', 'Wrong'),
         ('extra', 'Extra'),
     ], default='correct')
+    # Where the word is heard, in milliseconds; a missing word gets the gap
+    # between its neighbours
+    start_ms = models.PositiveIntegerField(null=True, blank=True)
+    end_ms = models.PositiveIntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['word_index']
+        indexes = [
+            # Jump to the next error after a point in the audio
+            models.Index(fields=['analysis', 'error_type', 'start_ms']),
+        ]
+
+    @property
+    def start_time(self):
+        return self.start_ms / 1000 if self.start_ms is not None else None
+
+    @property
+    def end_time(self):
+        return self.end_ms / 1000 if self.end_ms is not None else None
+
+class ParagraphComparison(models.Model):
+    """Paragraph-mode comparison row, computed once when the analysis finishes"""
+    analysis = models.ForeignKey(AudioAnalysis, on_delete=models.CASCADE, related_name='paragraph_comparisons')
+    paragraph_index = models.IntegerField()
+    # Paragraph text with the differing words wrapped in highlight spans
+    script_paragraph = models.TextField(blank=True)
+    audio_paragraph = models.TextField(blank=True)
+    similarity = models.FloatField(default=0.0)
+    status = models.CharField(max_length=10, choices=[
+        ('Correct', 'Correct'),
+        ('Wrong', 'Wrong'),
+        ('Missing', 'Missing'),
+        ('Extra', 'Extra'),
+    ])
+    # Where the audio paragraph is heard, in seconds
+    start_time = models.FloatField(null=True, blank=True)
+    end_time = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['paragraph_index', 'id']
 
 class AnalysisResult(models.Model):
     analysis = models.OneToOneField(AudioAnalysis, on_delete=models.CASCADE, related_name='detailed_result')
     transcribed_text = models.TextField()
-    script_text = models.TextField()
+    # Copy of the script text kept by analyses that predate the Script
+    # registry; newer ones read analysis.script
+    script_text = models.TextField(blank=True, default='')
     processing_time = models.FloatField(null=True, blank=True)  # in seconds
     whisper_model_used = models.CharField(max_length=32, null=True, blank=True)
     segments = models.JSONField(null=True, blank=True)  # Store Whisper segments
+    metrics = models.JSONField(null=True, blank=True)  # Mode-specific cost/accuracy figures
     
     def __str__(self):
         return f"Result for {self.analysis.title}"
+
+    def get_script_text(self):
+        if self.analysis.script_id:
+            return self.analysis.script.text
+        return self.script_text
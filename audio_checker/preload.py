@@ -0,0 +1,80 @@
+"""
+Whisper models shared by all job processes on a host.
+
+Job processes are forked from a multiprocessing fork server, which imports
+this module once when it starts. Every model listed in the PRELOAD_ENV
+environment variable is loaded at that point, before any fork. Job processes
+forked afterwards inherit the weights copy-on-write. Inference only reads the
+weights, so the pages stay shared and each job's private memory is little
+more than its activations. Without this, every job loaded its own copy.
+
+Each preloaded model is warmed up with one decode over a window of silence.
+That pages in the weights and fills whisper's cached mel filters and
+tokenizers, so a job's first window does not pay for them; the jobs inherit
+the warm state along with the weights.
+
+WhisperEngine.load() picks a model from whisper_models when one matches its
+size and quantization, and loads its own otherwise.
+"""
+import gc
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# JSON {"models": [[model_size, quantize], ...], "warm_up": ..., "load_options": {...}},
+# passed to the fork server by jobs.configure_job_processes
+PRELOAD_ENV = 'AUDIO_CHECKER_PRELOAD_MODELS'
+
+# (model_size, quantize) -> loaded whisper model
+whisper_models = {}
+
+
+def warm_up(model):
+    """Transcribe a window of silence so first-inference costs are paid now"""
+    import numpy as np
+    from .engines import DECODE_OPTIONS, SAMPLE_RATE
+    from .inference import inference_context
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    with inference_context():
+        model.transcribe(silence, language='en', **DECODE_OPTIONS)
+
+
+def preload_models(specs, warm=True, **load_options):
+    """
+    Load (and warm up) the given (model_size, quantize) models into
+    whisper_models; load_options go to engines.load_whisper_model()
+    """
+    import torch
+    from .engines import load_whisper_model
+    # Load single-threaded so the fork server never starts an OpenMP pool;
+    # a pool inherited across fork deadlocks the child. Each job process
+    # sets its own thread count before running inference.
+    torch.set_num_threads(1)
+    for model_size, quantize in specs:
+        key = (model_size, bool(quantize))
+        if key not in whisper_models:
+            logger.info(f"Preloading {model_size} model (int8={bool(quantize)})")
+            whisper_models[key] = load_whisper_model(model_size, bool(quantize), **load_options)
+            if warm:
+                started = time.time()
+                try:
+                    warm_up(whisper_models[key])
+                    logger.info(f"Warmed up {model_size} model in {time.time() - started:.1f}s")
+                except Exception as e:
+                    logger.warning(f"Warm-up of {model_size} model failed: {e}")
+    # Move everything loaded so far out of the collector's generations, so
+    # garbage collection in the children does not write to shared pages
+    gc.freeze()
+
+
+# Only the fork server is started with PRELOAD_ENV set
+if os.environ.get(PRELOAD_ENV):
+    try:
+        config = json.loads(os.environ[PRELOAD_ENV])
+        preload_models(config['models'], config['warm_up'], **config['load_options'])
+    except Exception as e:
+        # Jobs then load their own models
+        logger.error(f"Model preload failed: {e}")
@@ -0,0 +1,63 @@
+"""
+S3-compatible media storage (AWS S3, MinIO, ...), used when MEDIA_STORAGE is
+'s3'. Needs django-storages and boto3 (`pip install django-storages[s3]`).
+
+Uploads are content-addressed as on the filesystem store (see storage.py).
+Jobs read them through presigned URLs and review media is served the same
+way, so the object store answers the Range requests of audio players
+directly.
+"""
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+
+from .storage import ContentAddressedMixin
+
+
+class S3MediaStorage(S3Storage):
+    """Media in the MEDIA_S3_BUCKET bucket"""
+    local = False
+
+    def __init__(self, **options):
+        options.setdefault('bucket_name', settings.MEDIA_S3_BUCKET)
+        options.setdefault('endpoint_url', settings.MEDIA_S3_ENDPOINT_URL)
+        options.setdefault('region_name', settings.MEDIA_S3_REGION)
+        options.setdefault('access_key', settings.MEDIA_S3_ACCESS_KEY_ID)
+        options.setdefault('secret_key', settings.MEDIA_S3_SECRET_ACCESS_KEY)
+        options.setdefault('location', settings.MEDIA_S3_PREFIX)
+        options.setdefault('querystring_expire', settings.MEDIA_S3_URL_EXPIRE)
+        # MinIO and most S3 stand-ins only serve path-style URLs
+        options.setdefault('addressing_style', 'path' if settings.MEDIA_S3_ENDPOINT_URL else None)
+        options.setdefault('file_overwrite', True)
+        super().__init__(**options)
+
+    def staging_dir(self, directory):
+        # Uploads are spooled on local disk while they are hashed
+        return tempfile.gettempdir()
+
+    def store_staged(self, staged_path, name):
+        with open(staged_path, 'rb') as fh:
+            super()._save(name, File(fh))
+
+    def touch(self, name):
+        # Last use is tracked by the analyses that use a file; nothing to do
+        pass
+
+    def read_range(self, name, first, last):
+        """Bytes first..last (inclusive) of an object, fetched with one ranged GET"""
+        key = self._normalize_name(clean_name(name))
+        return self.bucket.Object(key).get(Range=f'bytes={first}-{last}')['Body'].read()
+
+    def list_files(self, prefix):
+        """(name, size, modified) of every object under prefix, from the bucket listing"""
+        base = self._normalize_name(clean_name(prefix)).rstrip('/') + '/'
+        strip = len(self.location.rstrip('/') + '/') if self.location else 0
+        for summary in self.bucket.objects.filter(Prefix=base):
+            yield summary.key[strip:], summary.size, summary.last_modified
+
+
+class S3ContentAddressedStorage(ContentAddressedMixin, S3MediaStorage):
+    """Uploads in object storage, named by content hash"""
@@ -0,0 +1,130 @@
+"""
+N-gram index over a script's word IDs, for finding where a take begins and
+ends in a long master script.
+
+Every NGRAM_SIZE consecutive words of the script are hashed into one uint64
+key, and the keys are sorted once along with their word offsets. Looking up
+the n-grams of a transcript is then a binary search each (np.searchsorted),
+so locating a take costs O(transcript words * log script words) however
+long the script is. The index is built once per ParsedScript (see
+scripts.py); takes that share a script in a job share its index.
+
+A transcript n-gram found at a script offset is an anchor. N-grams found
+more than MAX_OCCURRENCES times (refrains, stock phrases) say nothing about
+where the take is and are ignored. The anchors that agree on one reading
+order are chained: the longest chain whose script offsets increase with the
+transcript's, cut where the script jumps more than MAX_SKIP_WORDS words
+further than the transcript does. The longest such run is the take's span.
+
+This module does not import Django, so job processes can use it.
+"""
+import bisect
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+NGRAM_SIZE = 4
+MAX_OCCURRENCES = 8
+# Words of script a reader may skip within a take without the span being cut
+MAX_SKIP_WORDS = 300
+# A span needs at least this many anchors; otherwise the take is not located
+MIN_ANCHORS = 3
+# Multiplier of the n-gram hash; arithmetic wraps modulo 2**64
+HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+# Word ID of transcript words that are not in the script
+UNKNOWN_WORD = np.iinfo(np.uint32).max
+
+
+def ngram_keys(word_ids: np.ndarray, size: int = NGRAM_SIZE) -> np.ndarray:
+    """Hash of the size words starting at each offset, as uint64"""
+    count = len(word_ids) - size + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    ids = word_ids.astype(np.uint64)
+    keys = np.zeros(count, dtype=np.uint64)
+    for k in range(size):
+        keys = keys * HASH_BASE + ids[k:k + count]
+    return keys
+
+
+class ScriptIndex:
+    """Sorted n-gram keys of a script and the word offsets they start at"""
+
+    def __init__(self, word_ids: np.ndarray, size: int = NGRAM_SIZE):
+        self.word_ids = word_ids
+        self.size = size
+        keys = ngram_keys(word_ids, size)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.offsets = order.astype(np.uint32)
+
+    def anchors(self, query_ids: np.ndarray) -> List[Tuple[int, int]]:
+        """(transcript offset, script offset) of every distinctive n-gram both share"""
+        if len(query_ids) < self.size:
+            return []
+        keys = ngram_keys(query_ids, self.size)
+        # n-grams with a word the script does not have cannot match
+        known = np.convolve(query_ids == UNKNOWN_WORD, np.ones(self.size, dtype=int), mode='valid') == 0
+        first = np.searchsorted(self.keys, keys, side='left')
+        last = np.searchsorted(self.keys, keys, side='right')
+        counts = last - first
+        anchors = []
+        for position in np.flatnonzero(known & (counts > 0) & (counts <= MAX_OCCURRENCES)).tolist():
+            ngram = query_ids[position:position + self.size]
+            for offset in self.offsets[first[position]:last[position]].tolist():
+                # Hashes can collide; keep real matches only
+                if np.array_equal(self.word_ids[offset:offset + self.size], ngram):
+                    anchors.append((position, offset))
+        return anchors
+
+    def locate(self, query_ids: np.ndarray) -> Optional[Tuple[int, int, int]]:
+        """
+        (start, end, anchors) of the script words a transcript reads, or
+        None if too few of its n-grams are found. The span is stretched by
+        the transcript words before its first anchor and after its last, so
+        misread words at either end are still compared.
+        """
+        chain = longest_chain(self.anchors(query_ids))
+        runs = [[]]
+        for anchor in chain:
+            if runs[-1]:
+                previous = runs[-1][-1]
+                if (anchor[1] - previous[1]) - (anchor[0] - previous[0]) > MAX_SKIP_WORDS:
+                    runs.append([])
+            runs[-1].append(anchor)
+        run = max(runs, key=len)
+        if len(run) < MIN_ANCHORS:
+            return None
+        (first_query, first_script), (last_query, last_script) = run[0], run[-1]
+        start = max(0, first_script - first_query)
+        end = min(len(self.word_ids), last_script + (len(query_ids) - last_query))
+        return start, end, len(run)
+
+
+def longest_chain(anchors: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Longest run of anchors whose transcript and script offsets both
+    increase (a longest increasing subsequence, O(anchors log anchors))
+    """
+    # Within one transcript offset, later script offsets first, so at most
+    # one of them joins the chain
+    anchors = sorted(anchors, key=lambda anchor: (anchor[0], -anchor[1]))
+    tails = []  # script offset ending the best chain of each length
+    tail_index = []
+    previous = [-1] * len(anchors)
+    for index, (_, offset) in enumerate(anchors):
+        length = bisect.bisect_left(tails, offset)
+        if length:
+            previous[index] = tail_index[length - 1]
+        if length == len(tails):
+            tails.append(offset)
+            tail_index.append(index)
+        else:
+            tails[length] = offset
+            tail_index[length] = index
+    chain = []
+    index = tail_index[-1] if tail_index else -1
+    while index >= 0:
+        chain.append(anchors[index])
+        index = previous[index]
+    return chain[::-1]
@@ -0,0 +1,104 @@
+"""
+Parsed scripts.
+
+A script is parsed and tokenized once per unique file and kept in the Script
+registry (models.Script, keyed by the content hash of the .docx), so one
+master script read against dozens of takes is not re-read for each of them.
+The registry stores the text, its paragraphs and the comparison words as IDs
+into a vocabulary of the script's distinct words: a little-endian uint32
+array, about 4 bytes per word.
+
+Jobs receive a ParsedScript instead of the script file. Analyses of the same
+script in one job share a single ParsedScript, so its words are decoded, and
+its n-gram index (see script_index.py) is built, once.
+
+This module does not import Django, so job processes can use it.
+"""
+import re
+from typing import Callable, List
+
+import numpy as np
+
+from .script_index import UNKNOWN_WORD, ScriptIndex
+
+WORD_ID_DTYPE = np.dtype('<u4')
+RAW_TOKEN = re.compile(r'\S+')
+
+
+class ParsedScript:
+    """A script's text, paragraphs and word IDs, as stored in the registry"""
+
+    def __init__(self, text: str, paragraphs: List[str], vocabulary: List[str], word_ids: np.ndarray):
+        self.text = text
+        self.paragraphs = paragraphs
+        self.vocabulary = vocabulary
+        self.word_ids = word_ids
+        self._words = None
+        self._word_lookup = None
+        self._index = None
+        self._token_starts = None
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs: List[str], tokenize: Callable[[str], List[str]]):
+        """Tokenize a script's paragraphs; tokenize must be the one used on transcripts"""
+        text = ' '.join(paragraphs)
+        ids = {}
+        word_ids = np.fromiter((ids.setdefault(word, len(ids)) for word in tokenize(text)), dtype=WORD_ID_DTYPE)
+        return cls(text, paragraphs, list(ids), word_ids)
+
+    @classmethod
+    def from_stored(cls, text: str, paragraphs: List[str], vocabulary: List[str], word_ids: bytes):
+        return cls(text, paragraphs, vocabulary, np.frombuffer(word_ids, dtype=WORD_ID_DTYPE))
+
+    def word_id_bytes(self) -> bytes:
+        return self.word_ids.astype(WORD_ID_DTYPE, copy=False).tobytes()
+
+    @property
+    def words(self) -> List[str]:
+        """The comparison words, decoded once"""
+        if self._words is None:
+            vocabulary = self.vocabulary
+            self._words = [vocabulary[i] for i in self.word_ids.tolist()]
+        return self._words
+
+    @property
+    def index(self) -> ScriptIndex:
+        """The script's n-gram index, built on first use"""
+        if self._index is None:
+            self._index = ScriptIndex(self.word_ids)
+        return self._index
+
+    def lookup_ids(self, words: List[str]) -> np.ndarray:
+        """Word IDs of comparison words, UNKNOWN_WORD for words the script does not have"""
+        if self._word_lookup is None:
+            self._word_lookup = {word: i for i, word in enumerate(self.vocabulary)}
+        lookup = self._word_lookup
+        return np.fromiter((lookup.get(word, UNKNOWN_WORD) for word in words), dtype=WORD_ID_DTYPE, count=len(words))
+
+    def span_text(self, start: int, end: int, tokenize: Callable[[str], List[str]]) -> str:
+        """
+        The script text of words start..end-1, as written. tokenize must be
+        the one the words came from; it turns each whitespace-separated token
+        into at most one word.
+        """
+        if self._token_starts is None:
+            # Offset in text of the token each word comes from
+            starts = []
+            for match in RAW_TOKEN.finditer(self.text):
+                starts.extend([match.start()] * len(tokenize(match.group())))
+            self._token_starts = starts if len(starts) == len(self) else []
+        if not self._token_starts:
+            return self.text
+        if start >= end:
+            return ''
+        return self.text[self._token_starts[start]:RAW_TOKEN.match(self.text, self._token_starts[end - 1]).end()]
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def __getstate__(self):
+        # Sent to job processes without what they can rebuild
+        state = self.__dict__.copy()
+        for cached in ('_words', '_word_lookup', '_index', '_token_starts'):
+            state[cached] = None
+        return state
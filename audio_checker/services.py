@@ -1,28 +1,117 @@
-import whisper
 import time
 import re
-import os
-from docx import Document
+import tempfile
 from fuzzywuzzy import fuzz
 from typing import List, Tuple, Dict
+from .cancellation import AnalysisCancelled, CancelToken
+from .docx_text import docx_paragraphs
+from .engines import create_engine, SAMPLE_RATE
+from .inference import inference_context
+from .scripts import ParsedScript
+from .sources import is_url, probe_duration, source_size
+from .timeline import WordTimeline
 import logging
 import difflib
+import bisect
+import math
+import random
 
 logger = logging.getLogger(__name__)
 
+# Cascade mode: a segment is re-transcribed with the larger model when at least
+# this fraction of its words (and at least CASCADE_MIN_ERRORS words) are errors.
+CASCADE_ERROR_DENSITY = 0.25
+CASCADE_MIN_ERRORS = 2
+
+# Verify mode: script words are force-aligned to 30 second windows. The window
+# is offered at most VERIFY_MAX_WORDS_PER_SECOND words of script, words scoring
+# below VERIFY_MIN_WORD_PROBABILITY are re-checked with open decoding, and a
+# window with fewer than VERIFY_RESYNC_RATIO confident words is open-decoded and
+# re-located in the script.
+VERIFY_WINDOW_SECONDS = 30.0
+VERIFY_WINDOW_MARGIN = 1.0
+VERIFY_MAX_WORDS_PER_SECOND = 4.0
+VERIFY_MAX_WORDS = 150
+VERIFY_MIN_WORD_PROBABILITY = 0.15
+VERIFY_RESYNC_RATIO = 0.5
+VERIFY_RESYNC_SEARCH_FACTOR = 4
+
+# Batch transcription: clips no longer than one Whisper window are decoded
+# together, BATCH_TRANSCRIBE_SIZE at a time, as a single stacked mel batch.
+BATCH_MAX_CLIP_SECONDS = 30.0
+BATCH_TRANSCRIBE_SIZE = 16
+
+# A take is located in its script (see script_index.py) and aligned only
+# against the span it reads when the script has more than this many times
+# as many words as the transcript
+SCRIPT_LOCATE_RATIO = 2.0
+
+# Quick check: transcribe one QUICK_WINDOW_SECONDS window from each of up to
+# QUICK_SAMPLE_WINDOWS equal strata and estimate accuracy from the sample.
+QUICK_SAMPLE_WINDOWS = 8
+QUICK_WINDOW_SECONDS = 30.0
+QUICK_MIN_MATCH_WORDS = 2
+# Two-sided 95% Student t critical values by degrees of freedom
+T_CRITICAL_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+                 8: 2.306, 9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042}
+
 class AudioAnalyzer:
-    def __init__(self, model_size='tiny'):
+    def __init__(self, model_size='tiny', refine_model_size=None, quantize=False, engine='whisper', threads=0,
+                 cancel_token=None, model_dir=None, compile_mode=None, compile_cache_dir=None,
+                 word_timestamps=False):
         """
-        Initialize the audio analyzer with Whisper model
+        Initialize the audio analyzer with a transcription engine
         model_size options: 'tiny', 'base', 'small', 'medium', 'large'
         For large files, 'tiny' is recommended for speed
+        refine_model_size is the larger model used by cascade mode; it is only
+        loaded the first time a cascade analysis needs it
+        quantize=True runs the models as int8 on CPU
+        engine: 'whisper', 'faster-whisper' or 'stub' (see engines.py)
+        cancel_token: CancelToken checked between windows; cancelling it makes
+        the running analysis raise AnalysisCancelled
+        model_dir: directory of offline model bundles (WHISPER_MODEL_DIR);
+        when set, models are never downloaded
+        compile_mode: 'compile' or 'torchscript' to run the whisper encoder
+        compiled, with artifacts cached in compile_cache_dir (WHISPER_COMPILE)
+        word_timestamps: ask the engine for per-word times; otherwise word
+        times are interpolated within segments (WORD_TIMESTAMPS)
         """
-        self.model = whisper.load_model(model_size)
+        self.engine_name = engine
+        self.quantize = quantize
+        self.threads = threads
+        self.cancel_token = cancel_token or CancelToken()
+        self.model_dir = model_dir
+        self.engine_options = {
+            'compile_mode': compile_mode,
+            'compile_cache_dir': compile_cache_dir,
+            'word_timestamps': word_timestamps,
+        }
+        self.engine = create_engine(engine, model_size, quantize=quantize, threads=threads,
+                                    cancel_token=self.cancel_token, model_dir=model_dir, **self.engine_options)
         self.model_size = model_size
+        self.refine_model_size = refine_model_size
+        self._refine_engine = None
+
+    @property
+    def refine_engine(self):
+        """Engine with the larger model used to re-transcribe error regions (lazy)"""
+        if self._refine_engine is None:
+            if not self.refine_model_size:
+                raise ValueError("Cascade mode requires refine_model_size")
+            logger.info(f"Loading refine model: {self.refine_model_size}")
+            self._refine_engine = create_engine(
+                self.engine_name, self.refine_model_size, quantize=self.quantize, threads=self.threads,
+                cancel_token=self.cancel_token, model_dir=self.model_dir, **self.engine_options
+            )
+        return self._refine_engine
     
-    def get_audio_duration(self, audio_path: str) -> float:
-        """Get audio duration in seconds"""
+    @staticmethod
+    def get_audio_duration(audio_path: str) -> float:
+        """Get audio duration in seconds; audio_path may be a presigned URL (see sources.py)"""
         try:
+            if is_url(audio_path):
+                # Reads only the container header from object storage
+                return probe_duration(audio_path)
             import librosa
             duration = librosa.get_duration(path=audio_path)
             return duration
@@ -48,63 +137,61 @@ class AudioAnalyzer:
         
         return estimated_time
     
+    @staticmethod
+    def read_docx_paragraphs(docx_path: str) -> List[str]:
+        """The non-empty paragraphs of a DOCX file (body, tables and text boxes), stripped"""
+        return docx_paragraphs(docx_path)
+
     def extract_text_from_docx(self, docx_path: str) -> str:
         """Extract text from a DOCX file"""
         try:
-            doc = Document(docx_path)
-            text = []
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text.append(paragraph.text.strip())
-            return ' '.join(text)
+            return ' '.join(self.read_docx_paragraphs(docx_path))
+        except Exception as e:
+            logger.error(f"Error extracting text from DOCX: {e}")
+            raise
+
+    @classmethod
+    def parse_script(cls, docx_path: str) -> ParsedScript:
+        """Read and tokenize a script once, for the Script registry; needs no engine"""
+        try:
+            script = ParsedScript.from_paragraphs(cls.read_docx_paragraphs(docx_path), cls.preprocess_text)
         except Exception as e:
             logger.error(f"Error extracting text from DOCX: {e}")
             raise
+        logger.info(f"Parsed script: {len(script.paragraphs)} paragraphs, {len(script)} words, "
+                    f"{len(script.vocabulary)} distinct")
+        return script
     
+    @inference_context()
     def transcribe_audio(self, audio_path: str):
-        """Transcribe audio file using Whisper with optimized settings and return segments."""
+        """Transcribe audio file with the configured engine and return text, time and segments."""
         try:
             start_time = time.time()
-            file_size = os.path.getsize(audio_path) / (1024 * 1024)  # MB
+            file_size = source_size(audio_path) / (1024 * 1024)  # MB
             if file_size > 100:
                 logger.warning(f"Large file detected: {file_size:.1f}MB. This may take a long time.")
                 print(f"[WARNING] Large file: {file_size:.1f}MB. Processing may take a long time or fail. For best results, split into smaller chunks.")
             try:
-                logger.info("Attempting direct Whisper transcription")
-                result = self.model.transcribe(
-                    audio_path,
-                    fp16=False,
-                    language=None,
-                    task="transcribe",
-                    verbose=False,
-                    condition_on_previous_text=False,
-                    temperature=0.0
-                )
-                logger.info("Direct Whisper transcription successful")
+                logger.info(f"Attempting direct transcription with {self.engine_name}")
+                result = self.engine.transcribe(audio_path)
+                logger.info("Direct transcription successful")
+            except AnalysisCancelled:
+                raise
             except Exception as direct_error:
-                logger.warning(f"Direct Whisper failed: {direct_error}")
+                logger.warning(f"Direct transcription failed: {direct_error}")
+                if is_url(audio_path):
+                    # The fallbacks below re-decode local files only
+                    raise
                 try:
                     import librosa
                     import soundfile as sf
                     logger.info("Using librosa for audio loading")
                     audio, sr = librosa.load(audio_path, sr=16000)
-                    temp_path = audio_path + "_temp.wav"
-                    sf.write(temp_path, audio, sr)
-                    logger.info(f"Created temporary file: {temp_path}")
-                    result = self.model.transcribe(
-                        temp_path,
-                        fp16=False,
-                        language=None,
-                        task="transcribe",
-                        verbose=False,
-                        condition_on_previous_text=False,
-                        temperature=0.0
-                    )
-                    try:
-                        os.remove(temp_path)
-                        logger.info("Cleaned up temporary file")
-                    except Exception as cleanup_error:
-                        logger.warning(f"Could not clean up temp file: {cleanup_error}")
+                    # Deleted when closed
+                    with tempfile.NamedTemporaryFile(suffix='.wav') as temp_file:
+                        sf.write(temp_file.name, audio, sr)
+                        logger.info(f"Created temporary file: {temp_file.name}")
+                        result = self.engine.transcribe(temp_file.name)
                 except Exception as librosa_error:
                     logger.warning(f"librosa failed: {librosa_error}")
                     try:
@@ -117,25 +204,13 @@ class AudioAnalyzer:
                             audio_data = wav_file.readframes(frames)
                             audio_array = np.frombuffer(audio_data, dtype=np.int16)
                             audio_float = audio_array.astype(np.float32) / 32768.0
-                        temp_path = audio_path + "_numpy_temp.wav"
-                        with wave.open(temp_path, 'wb') as temp_wav:
-                            temp_wav.setnchannels(1)
-                            temp_wav.setsampwidth(2)
-                            temp_wav.setframerate(sample_rate)
-                            temp_wav.writeframes(audio_float.tobytes())
-                        result = self.model.transcribe(
-                            temp_path,
-                            fp16=False,
-                            language=None,
-                            task="transcribe",
-                            verbose=False,
-                            condition_on_previous_text=False,
-                            temperature=0.0
-                        )
-                        try:
-                            os.remove(temp_path)
-                        except:
-                            pass
+                        with tempfile.NamedTemporaryFile(suffix='.wav') as temp_file:
+                            with wave.open(temp_file.name, 'wb') as temp_wav:
+                                temp_wav.setnchannels(1)
+                                temp_wav.setsampwidth(2)
+                                temp_wav.setframerate(sample_rate)
+                                temp_wav.writeframes(audio_float.tobytes())
+                            result = self.engine.transcribe(temp_file.name)
                     except Exception as numpy_error:
                         logger.error(f"All audio loading methods failed: {numpy_error}")
                         raise Exception("Could not load audio file with any available method")
@@ -146,8 +221,25 @@ class AudioAnalyzer:
         except Exception as e:
             logger.error(f"Error transcribing audio: {e}")
             raise
-    
-    def preprocess_text(self, text: str) -> List[str]:
+
+    @inference_context()
+    def transcribe_batch(self, audio_paths: List[str]) -> List[Tuple[str, float, List[Dict]]]:
+        """
+        Transcribe several short clips (each at most one 30 second window) in
+        one engine call; the Whisper engine stacks them into a single encoder
+        and greedy-decoder batch.
+        Returns (text, processing_time, segments) per clip, in input order;
+        processing_time is the clip's share of the batch wall time.
+        """
+        start_time = time.time()
+        results = self.engine.transcribe_batch(audio_paths)
+        elapsed = time.time() - start_time
+        processing_time = elapsed / max(len(audio_paths), 1)
+        logger.info(f"Batch transcription of {len(audio_paths)} clips completed in {elapsed:.2f} seconds using {self.model_size} model")
+        return [(result['text'].strip(), processing_time, result.get('segments', [])) for result in results]
+
+    @staticmethod
+    def preprocess_text(text: str) -> List[str]:
         """Clean and tokenize text for comparison"""
         # Remove extra whitespace and convert to lowercase
         text = re.sub(r'\s+', ' ', text.lower().strip())
@@ -157,7 +249,8 @@ class AudioAnalyzer:
         words = text.split()
         return words
     
-    def calculate_similarity(self, word1: str, word2: str) -> float:
+    @staticmethod
+    def calculate_similarity(word1: str, word2: str) -> float:
         """Calculate similarity between two words using fuzzy matching"""
         return fuzz.ratio(word1.lower(), word2.lower())
     
@@ -173,6 +266,7 @@ class AudioAnalyzer:
                         'script_word': script_words[i1 + idx],
                         'audio_word': audio_words[j1 + idx],
                         'word_index': i1 + idx,
+                        'audio_index': j1 + idx,
                         'is_correct': True,
                         'similarity_score': 100,
                         'error_type': 'correct'
@@ -186,6 +280,7 @@ class AudioAnalyzer:
                         'script_word': s_word,
                         'audio_word': a_word,
                         'word_index': i1 + idx,
+                        'audio_index': min(j1 + idx, j2),
                         'is_correct': similarity >= 80,
                         'similarity_score': similarity,
                         'error_type': 'wrong' if s_word and a_word else ('missing' if s_word else 'extra')
@@ -196,6 +291,7 @@ class AudioAnalyzer:
                         'script_word': script_words[idx],
                         'audio_word': '',
                         'word_index': idx,
+                        'audio_index': j1,
                         'is_correct': False,
                         'similarity_score': 0,
                         'error_type': 'missing'
@@ -206,70 +302,608 @@ class AudioAnalyzer:
                         'script_word': '',
                         'audio_word': audio_words[idx],
                         'word_index': i1,
+                        'audio_index': idx,
                         'is_correct': False,
                         'similarity_score': 0,
                         'error_type': 'extra'
                     })
         return comparisons
     
-    def analyze_audio_accuracy(self, script_path: str, audio_path: str) -> Dict:
-        """Main analysis function with performance optimizations and segment support"""
+    def align_to_script(self, script: ParsedScript, audio_words: List[str]):
+        """
+        Align a transcript with the part of the script it reads. When the
+        script is much longer than the transcript (SCRIPT_LOCATE_RATIO), the
+        take is located with the script's n-gram index and only that span is
+        aligned, instead of reporting the rest of the script as missing.
+        Returns the comparisons (word_index still counts from the start of
+        the script) and the (start, end) word span that was aligned.
+        """
+        script_words = script.words
+        start, end = 0, len(script_words)
+        if audio_words and len(script_words) > SCRIPT_LOCATE_RATIO * len(audio_words):
+            located = script.index.locate(script.lookup_ids(audio_words))
+            if located:
+                start, end, anchors = located
+                logger.info(f"Located take at script words {start}-{end} of {len(script_words)} ({anchors} anchors)")
+            else:
+                logger.warning("Could not locate the take in the script; aligning against all of it")
+        comparisons = self.align_texts(script_words[start:end], audio_words)
+        if start:
+            for comp in comparisons:
+                comp['word_index'] += start
+        return comparisons, (start, end)
+
+    def add_word_times(self, comparisons: List[Dict], segments: List[Dict]):
+        """
+        Give every comparison 'start'/'end' times, keeping any it already has.
+        Words heard in the audio are looked up by their audio_index on the
+        segments' timeline; a run of missing words is spread evenly over the
+        gap between the timed words around it.
+        """
+        timeline = WordTimeline(segments, tokenize=self.preprocess_text)
+        for comp in comparisons:
+            if comp.get('start') is None and comp['audio_word']:
+                comp['start'], comp['end'] = timeline.word_time(comp['audio_index'])
+        untimed = []
+        previous_end = 0.0
+        for comp in comparisons + [None]:
+            if comp is not None and comp.get('start') is None:
+                untimed.append(comp)
+                continue
+            if untimed:
+                next_start = comp['start'] if comp is not None else previous_end
+                step = max(next_start - previous_end, 0.0) / len(untimed)
+                for position, missing in enumerate(untimed):
+                    missing['start'] = previous_end + step * position
+                    missing['end'] = previous_end + step * (position + 1)
+                untimed = []
+            if comp is not None:
+                previous_end = max(previous_end, comp['end'])
+
+    def calculate_statistics(self, script_words: List[str], comparisons: List[Dict]) -> Dict:
+        """Summarise a word alignment into the counts stored on AudioAnalysis"""
+        total_words = len(script_words)
+        correct_words = sum(1 for comp in comparisons if comp['is_correct'])
+        missing_words = sum(1 for comp in comparisons if comp['error_type'] == 'missing')
+        wrong_words = sum(1 for comp in comparisons if comp['error_type'] == 'wrong')
+        accuracy_score = (correct_words / total_words * 100) if total_words > 0 else 0
+        return {
+            'total_words': total_words,
+            'correct_words': correct_words,
+            'missing_words': missing_words,
+            'wrong_words': wrong_words,
+            'accuracy_score': accuracy_score
+        }
+
+    def load_audio_array(self, audio_path: str):
+        """Decode an audio file to a 16kHz mono float32 array"""
+        return self.engine.load_audio(audio_path)
+
+    def transcribe_window(self, engine, audio, start: float, end: float, language=None) -> List[Dict]:
+        """Transcribe audio[start:end] (seconds) and return segments on the file's timeline"""
+        return engine.transcribe_window(audio, start, end, language=language)
+
+    def segment_word_spans(self, segments: List[Dict]) -> List[Tuple[int, int]]:
+        """Return the [first, last) audio word offsets covered by each segment"""
+        spans = []
+        offset = 0
+        for seg in segments:
+            count = len(self.preprocess_text(seg.get('text', '')))
+            spans.append((offset, offset + count))
+            offset += count
+        return spans
+
+    def find_error_windows(self, comparisons: List[Dict], segments: List[Dict]) -> List[Tuple[int, int]]:
+        """
+        Find runs of consecutive segments with dense alignment errors.
+        Returns (first_segment, last_segment) index pairs, inclusive.
+        Missing words are charged to the segment holding the next audio word.
+        """
+        spans = self.segment_word_spans(segments)
+        if not spans:
+            return []
+        starts = [span[0] for span in spans]
+        errors = [0] * len(segments)
+        for comp in comparisons:
+            if comp['is_correct']:
+                continue
+            seg_idx = bisect.bisect_right(starts, comp['audio_index']) - 1
+            errors[max(0, min(seg_idx, len(segments) - 1))] += 1
+        flagged = []
+        for idx, (first, last) in enumerate(spans):
+            words = max(last - first, 1)
+            if errors[idx] >= CASCADE_MIN_ERRORS and errors[idx] / words >= CASCADE_ERROR_DENSITY:
+                flagged.append(idx)
+        windows = []
+        for idx in flagged:
+            if windows and windows[-1][1] == idx - 1:
+                windows[-1] = (windows[-1][0], idx)
+            else:
+                windows.append((idx, idx))
+        return windows
+
+    def transcribe_cascade(self, audio_path: str, script: ParsedScript):
+        """
+        Two-pass transcription: the fast model transcribes the whole file, then
+        only segments with dense errors against the script are re-transcribed
+        with the refine model and spliced back into the segment list.
+        """
+        transcribed_text, first_pass_time, segments = self.transcribe_audio(audio_path)
+        audio_words = [w for seg in segments for w in self.preprocess_text(seg.get('text', ''))]
+        comparisons, (start, end) = self.align_to_script(script, audio_words)
+        first_pass_stats = self.calculate_statistics(script.words[start:end], comparisons)
+        windows = self.find_error_windows(comparisons, segments)
+        logger.info(f"Cascade: {len(windows)} error windows out of {len(segments)} segments")
+
+        refine_start = time.time()
+        refined_seconds = 0.0
+        if windows:
+            audio = self.load_audio_array(audio_path)
+            language = self.engine.detect_language(audio)
+            spliced = []
+            previous = 0
+            for first, last in windows:
+                spliced.extend(segments[previous:first])
+                start, end = segments[first]['start'], segments[last]['end']
+                refined = self.transcribe_window(self.refine_engine, audio, start, end, language=language)
+                if any(self.preprocess_text(seg.get('text', '')) for seg in refined):
+                    spliced.extend(refined)
+                else:
+                    # Never drop first-pass words because the refine pass heard nothing
+                    spliced.extend(segments[first:last + 1])
+                refined_seconds += end - start
+                previous = last + 1
+            spliced.extend(segments[previous:])
+            segments = spliced
+            transcribed_text = ''.join(seg.get('text', '') for seg in segments).strip()
+        refine_time = time.time() - refine_start
+
+        metrics = {
+            'fast_model': self.model_size,
+            'refine_model': self.refine_model_size,
+            'first_pass_time': first_pass_time,
+            'refine_time': refine_time,
+            'refined_windows': len(windows),
+            'refined_seconds': refined_seconds,
+            'first_pass_accuracy': first_pass_stats['accuracy_score'],
+        }
+        return transcribed_text, first_pass_time + refine_time, segments, metrics
+
+    def script_word_pairs(self, script_text: str) -> List[Tuple[str, str]]:
+        """
+        Split a script into (display_word, normalized_word) pairs, one per word
+        preprocess_text finds, dropping punctuation-only tokens. A token that
+        normalizes to several words is displayed as those words.
+        """
+        pairs = []
+        for token in script_text.split():
+            normalized = self.preprocess_text(token)
+            if len(normalized) == 1:
+                pairs.append((token, normalized[0]))
+            else:
+                pairs.extend((word, word) for word in normalized)
+        return pairs
+
+    def resolve_open_region(self, audio, start: float, end: float, script_norm: List[str],
+                            script_offset: int, audio_offset: int, language=None, exact: bool = True):
+        """
+        Open-decode audio[start:end] and align it against script_norm.
+        With exact=False the region is re-located: script words after the last
+        matching block are left for the next window.
+        Returns (comparisons, segments, script_words_consumed).
+        """
+        segments = self.transcribe_window(self.engine, audio, start, end, language=language)
+        decoded = [w for seg in segments for w in self.preprocess_text(seg.get('text', ''))]
+        consumed = len(script_norm)
+        if not exact:
+            matcher = difflib.SequenceMatcher(None, script_norm, decoded, autojunk=False)
+            blocks = [b for b in matcher.get_matching_blocks() if b.size]
+            consumed = blocks[-1].a + blocks[-1].size if blocks else 0
+        comparisons = self.align_texts(script_norm[:consumed], decoded)
+        spans = self.segment_word_spans(segments)
+        starts = [span[0] for span in spans]
+        for comp in comparisons:
+            comp['word_index'] += script_offset
+            if starts:
+                seg = segments[max(0, min(bisect.bisect_right(starts, comp['audio_index']) - 1, len(segments) - 1))]
+                comp['start'], comp['end'] = seg['start'], seg['end']
+            else:
+                comp['start'], comp['end'] = start, end
+            comp['audio_index'] += audio_offset
+        return comparisons, segments, consumed
+
+    def verify_against_script(self, audio_path: str, script: ParsedScript):
+        """
+        Script-guided verification. Each window is force-aligned to the expected
+        span of script words, which costs one teacher-forced decoder pass instead
+        of token-by-token decoding. Low-probability words are re-checked with open
+        decoding so missing/wrong/extra words are still reported, and every
+        comparison carries start/end times.
+        Returns (comparisons, transcribed_text, processing_time, segments, metrics).
+        """
+        start_time = time.time()
+        # The script's comparison words, so comparisons index script.words
+        norm = script.words
+        pairs = self.script_word_pairs(script.text)
+        display = [p[0] for p in pairs] if [p[1] for p in pairs] == norm else norm
+        audio = self.load_audio_array(audio_path)
+        duration = len(audio) / SAMPLE_RATE
+        language = self.engine.detect_language(audio)
+
+        comparisons, segments = [], []
+        cursor, audio_index, seek = 0, 0, 0.0
+        aligned_windows, open_seconds = 0, 0.0
+
+        def emit_confident(run):
+            nonlocal audio_index
+            if not run:
+                return
+            for idx, timing in run:
+                comparisons.append({
+                    'script_word': norm[idx],
+                    'audio_word': norm[idx],
+                    'word_index': idx,
+                    'audio_index': audio_index,
+                    'is_correct': True,
+                    'similarity_score': 100,
+                    'error_type': 'correct',
+                    'start': timing['start'],
+                    'end': timing['end'],
+                })
+                audio_index += 1
+            segments.append({
+                'start': run[0][1]['start'],
+                'end': run[-1][1]['end'],
+                'text': ' ' + ' '.join(display[idx] for idx, _ in run),
+                'words': [dict(timing, word=' ' + display[idx]) for idx, timing in run],
+            })
+
+        def emit_open(start, end, script_norm, script_offset, exact=True):
+            nonlocal audio_index, open_seconds
+            comps, segs, consumed = self.resolve_open_region(
+                audio, start, end, script_norm, script_offset, audio_index, language=language, exact=exact
+            )
+            comparisons.extend(comps)
+            segments.extend(segs)
+            audio_index += sum(1 for c in comps if c['audio_word'])
+            open_seconds += end - start
+            return consumed
+
+        while cursor < len(norm) and seek < duration - 0.1:
+            window_end = min(seek + VERIFY_WINDOW_SECONDS, duration)
+            final_window = window_end >= duration
+            budget = min(int((window_end - seek) * VERIFY_MAX_WORDS_PER_SECOND) + 1, VERIFY_MAX_WORDS)
+            # Normalized words, so each one gets exactly one timing
+            candidate = norm[cursor:cursor + budget]
+            try:
+                timings = self.engine.force_align(audio, seek, window_end, candidate, language)
+                if timings and len(timings) != len(candidate):
+                    raise ValueError(f"{len(timings)} timings for {len(candidate)} words")
+            except ValueError as e:
+                logger.warning(f"Forced alignment of the window at {seek:.1f}s failed ({e}); decoding it instead")
+                timings = []
+            aligned_windows += 1
+            limit = window_end if final_window else window_end - VERIFY_WINDOW_MARGIN
+            accepted = []
+            for offset, timing in enumerate(timings):
+                if timing['end'] > limit:
+                    break
+                accepted.append((cursor + offset, timing))
+            confident = sum(1 for _, t in accepted if t['probability'] >= VERIFY_MIN_WORD_PROBABILITY)
+            if not accepted or confident / len(accepted) < VERIFY_RESYNC_RATIO:
+                # Narration and script have diverged: decode the window and re-locate it
+                search = norm[cursor:cursor + budget * VERIFY_RESYNC_SEARCH_FACTOR]
+                cursor += emit_open(seek, window_end, search, cursor, exact=False)
+                seek = window_end
+                continue
+
+            run, suspects = [], []
+            previous_end = seek
+            for idx, timing in accepted:
+                if timing['probability'] >= VERIFY_MIN_WORD_PROBABILITY:
+                    if suspects:
+                        emit_confident(run)
+                        run = []
+                        emit_open(previous_end, timing['start'], [norm[i] for i in suspects], suspects[0])
+                        suspects = []
+                    run.append((idx, timing))
+                    previous_end = timing['end']
+                else:
+                    suspects.append(idx)
+            emit_confident(run)
+            cursor += len(accepted)
+            if suspects:
+                # A trailing low-confidence run may have drifted past the offered
+                # span, so re-locate it and leave unmatched words for the next window
+                search = norm[suspects[0]:suspects[0] + len(suspects) + budget]
+                cursor = suspects[0] + emit_open(previous_end, accepted[-1][1]['end'], search, suspects[0], exact=False)
+            seek = max(accepted[-1][1]['end'], seek + VERIFY_WINDOW_MARGIN)
+
+        if cursor < len(norm):
+            end = duration if duration else 0.0
+            for idx in range(cursor, len(norm)):
+                comparisons.append({
+                    'script_word': norm[idx],
+                    'audio_word': '',
+                    'word_index': idx,
+                    'audio_index': audio_index,
+                    'is_correct': False,
+                    'similarity_score': 0,
+                    'error_type': 'missing',
+                    'start': end,
+                    'end': end,
+                })
+        elif seek < duration - VERIFY_WINDOW_MARGIN:
+            # Script finished but narration continues: everything left is extra
+            emit_open(seek, duration, [], len(norm))
+
+        transcribed_text = ''.join(seg.get('text', '') for seg in segments).strip()
+        processing_time = time.time() - start_time
+        metrics = {
+            'language': language,
+            'aligned_windows': aligned_windows,
+            'open_decoded_seconds': open_seconds,
+            'audio_seconds': duration,
+        }
+        logger.info(f"Verification completed in {processing_time:.2f}s: {aligned_windows} windows, {open_seconds:.1f}s open-decoded")
+        return comparisons, transcribed_text, processing_time, segments, metrics
+
+    def sample_windows(self, duration: float, seed: int = 0) -> List[Tuple[float, float]]:
+        """Pick one window at a random offset inside each of up to QUICK_SAMPLE_WINDOWS equal strata"""
+        if duration <= 0:
+            return []
+        count = min(QUICK_SAMPLE_WINDOWS, max(1, int(duration // QUICK_WINDOW_SECONDS)))
+        stratum = duration / count
+        rng = random.Random(seed)
+        windows = []
+        for idx in range(count):
+            stratum_start = idx * stratum
+            slack = max(stratum - QUICK_WINDOW_SECONDS, 0.0)
+            start = stratum_start + rng.uniform(0, slack)
+            windows.append((start, min(start + QUICK_WINDOW_SECONDS, duration)))
+        return windows
+
+    def locate_in_script(self, script_words: List[str], window_words: List[str], expected: int):
+        """
+        Find the script span a window transcript covers. The search is limited
+        to a region around the expected word offset. Returns (start, end) or None.
+        """
+        reach = max(len(window_words) * 3, 200)
+        lo = max(0, expected - reach)
+        hi = min(len(script_words), expected + reach)
+        matcher = difflib.SequenceMatcher(None, script_words[lo:hi], window_words, autojunk=False)
+        blocks = [b for b in matcher.get_matching_blocks() if b.size]
+        if sum(b.size for b in blocks) < QUICK_MIN_MATCH_WORDS:
+            return None
+        return lo + blocks[0].a, lo + blocks[-1].a + blocks[-1].size
+
+    def confidence_interval(self, accuracies: List[float], correct: int, total: int, sampled_fraction: float):
+        """
+        95% interval for the sampled accuracy. With two or more windows the
+        spread between windows is used (with finite population correction);
+        a single window falls back to a Wilson interval over its words.
+        """
+        if len(accuracies) >= 2:
+            mean = sum(accuracies) / len(accuracies)
+            variance = sum((a - mean) ** 2 for a in accuracies) / (len(accuracies) - 1)
+            fpc = max(0.0, 1.0 - sampled_fraction)
+            se = math.sqrt(variance / len(accuracies) * fpc)
+            df = len(accuracies) - 1
+            t = T_CRITICAL_95[max(k for k in T_CRITICAL_95 if k <= df)]
+            return max(0.0, mean - t * se), min(100.0, mean + t * se)
+        if total == 0:
+            return 0.0, 100.0
+        z = 1.96
+        p = correct / total
+        denom = 1 + z * z / total
+        centre = (p + z * z / (2 * total)) / denom
+        half = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denom
+        return max(0.0, centre - half) * 100, min(1.0, centre + half) * 100
+
+    def locate_window(self, script: ParsedScript, window_words: List[str], expected: int):
+        """
+        The script span a window transcript covers: found with the script's
+        n-gram index, or failing that by searching around the expected word
+        offset. Returns (start, end) or None.
+        """
+        located = script.index.locate(script.lookup_ids(window_words))
+        if located:
+            return located[0], located[1]
+        return self.locate_in_script(script.words, window_words, expected)
+
+    def quick_check(self, audio_path: str, script: ParsedScript):
+        """
+        Estimate accuracy from a stratified sample of windows instead of a full
+        transcription. Each window is transcribed, located in the script, and
+        aligned against just that span. Windows that cannot be located are
+        left out of the estimate and counted separately. Paragraph rows compare
+        each located window with its script span, one row per window.
+        Returns (comparisons, transcribed_text, processing_time, segments,
+        paragraphs, metrics).
+        """
+        script_words = script.words
+        start_time = time.time()
+        audio = self.load_audio_array(audio_path)
+        duration = len(audio) / SAMPLE_RATE
+        windows = self.sample_windows(duration, seed=len(audio))
+        language = self.engine.detect_language(audio) if windows else None
+        comparisons, segments, window_results, paragraphs = [], [], [], []
+        audio_offset = 0
+        previous = None  # (end time, script end) of the last located window
+        for start, end in windows:
+            window_segments = self.transcribe_window(self.engine, audio, start, end, language=language)
+            window_words = [w for seg in window_segments for w in self.preprocess_text(seg.get('text', ''))]
+            if previous:
+                # Carry on from the last located window at this window's reading speed
+                rate = len(window_words) / (end - start) if end > start else 0.0
+                expected = previous[1] + int((start - previous[0]) * rate)
+            else:
+                expected = int((start + end) / 2 / duration * len(script_words)) if duration else 0
+            span = self.locate_window(script, window_words, expected)
+            if span is None:
+                window_results.append({'start': start, 'end': end, 'accuracy': None, 'located': False})
+                continue
+            comps = self.align_texts(script_words[span[0]:span[1]], window_words)
+            for comp in comps:
+                comp['word_index'] += span[0]
+                comp['audio_index'] += audio_offset
+            audio_offset += len(window_words)
+            correct = sum(1 for comp in comps if comp['is_correct'])
+            window_results.append({
+                'start': start,
+                'end': end,
+                'script_start': span[0],
+                'script_end': span[1],
+                'accuracy': correct / (span[1] - span[0]) * 100,
+                'located': True,
+            })
+            comparisons.extend(comps)
+            segments.extend(window_segments)
+            window_text = ' '.join(seg.get('text', '').strip() for seg in window_segments).strip()
+            for row in self.compare_paragraphs(script.span_text(span[0], span[1], self.preprocess_text), window_text,
+                                               force_single_paragraph=True, segments=window_segments):
+                row['index'] = len(paragraphs)
+                paragraphs.append(row)
+            previous = (end, span[1])
+
+        sampled_words = sum(r['script_end'] - r['script_start'] for r in window_results if r['located'])
+        correct_words = sum(1 for comp in comparisons if comp['is_correct'])
+        sampled_seconds = sum(end - start for start, end in windows)
+        accuracies = [r['accuracy'] for r in window_results if r['located']]
+        estimate = sum(accuracies) / len(accuracies) if accuracies else 0.0
+        located_seconds = sum(r['end'] - r['start'] for r in window_results if r['located'])
+        ci_low, ci_high = self.confidence_interval(
+            accuracies, correct_words, sampled_words, located_seconds / duration if duration else 1.0
+        )
+        processing_time = time.time() - start_time
+        metrics = {
+            'estimated_accuracy': estimate,
+            'accuracy_ci_low': ci_low,
+            'accuracy_ci_high': ci_high,
+            'confidence': 0.95,
+            'windows': window_results,
+            'sampled_seconds': sampled_seconds,
+            'audio_seconds': duration,
+            'sampled_words': sampled_words,
+            'unlocated_windows': sum(1 for r in window_results if not r['located']),
+            'language': language,
+        }
+        transcribed_text = ' '.join(seg.get('text', '').strip() for seg in segments).strip()
+        logger.info(f"Quick check: {estimate:.1f}% [{ci_low:.1f}, {ci_high:.1f}] from {len(windows)} windows in {processing_time:.2f}s")
+        return comparisons, transcribed_text, processing_time, segments, paragraphs, metrics
+
+    @inference_context()
+    def analyze_audio_accuracy(self, script_path: str, audio_path: str, mode: str = 'standard', transcription=None,
+                               script: ParsedScript = None) -> Dict:
+        """
+        Main analysis function with performance optimizations and segment support
+        mode: 'standard' transcribes with a single model, 'cascade' refines
+        error regions with refine_model_size, 'verify' force-aligns the script,
+        'quick' estimates accuracy from a sample of windows
+        transcription: precomputed (text, processing_time, segments) for
+        standard mode, e.g. from transcribe_batch
+        script: the script already parsed (from the Script registry); it is
+        read from script_path otherwise
+        """
         try:
-            file_size = os.path.getsize(audio_path) / (1024 * 1024)  # MB
+            file_size = source_size(audio_path) / (1024 * 1024)  # MB
             duration = self.get_audio_duration(audio_path)
             estimated_time = self.estimate_processing_time(audio_path)
-            logger.info(f"Starting analysis: {file_size:.1f}MB, {duration:.1f}s, estimated time: {estimated_time:.1f}s")
-            script_text = self.extract_text_from_docx(script_path)
-            script_words = self.preprocess_text(script_text)
-            transcribed_text, processing_time, segments = self.transcribe_audio(audio_path)
-            audio_words = self.preprocess_text(transcribed_text)
-            comparisons = self.align_texts(script_words, audio_words)
-            total_words = len(script_words)
-            correct_words = sum(1 for comp in comparisons if comp['is_correct'])
-            missing_words = sum(1 for comp in comparisons if comp['error_type'] == 'missing')
-            wrong_words = sum(1 for comp in comparisons if comp['error_type'] == 'wrong')
-            accuracy_score = (correct_words / total_words * 100) if total_words > 0 else 0
-            logger.info(f"Analysis completed: {accuracy_score:.1f}% accuracy, {processing_time:.1f}s actual time")
+            logger.info(f"Starting {mode} analysis: {file_size:.1f}MB, {duration:.1f}s, estimated time: {estimated_time:.1f}s")
+            if script is None:
+                script = self.parse_script(script_path)
+            script_text = script.text
+            script_words = script.words
+            metrics = {'mode': mode}
+            comparisons = None
+            paragraphs = None
+            if mode == 'verify' and not self.engine.supports_forced_alignment:
+                logger.warning(f"{self.engine_name} engine cannot force-align; running standard transcription")
+                metrics['fallback'] = 'standard'
+                mode = 'standard'
+            if mode == 'quick':
+                (comparisons, transcribed_text, processing_time, segments,
+                 paragraphs, quick_metrics) = self.quick_check(audio_path, script)
+                metrics.update(quick_metrics)
+                model_used = self.model_size
+            elif mode == 'verify':
+                comparisons, transcribed_text, processing_time, segments, verify_metrics = self.verify_against_script(audio_path, script)
+                metrics.update(verify_metrics)
+                model_used = self.model_size
+            elif mode == 'cascade':
+                transcribed_text, processing_time, segments, cascade_metrics = self.transcribe_cascade(audio_path, script)
+                metrics.update(cascade_metrics)
+                if duration:
+                    metrics['refined_fraction'] = cascade_metrics['refined_seconds'] / duration
+                model_used = f"{self.model_size}+{self.refine_model_size}"
+            else:
+                if transcription is not None:
+                    transcribed_text, processing_time, segments = transcription
+                else:
+                    transcribed_text, processing_time, segments = self.transcribe_audio(audio_path)
+                model_used = self.model_size
+            if comparisons is None:
+                audio_words = self.preprocess_text(transcribed_text)
+                comparisons, (start, end) = self.align_to_script(script, audio_words)
+                if end - start < len(script_words):
+                    # Script words outside the take are reported here, not as missing
+                    metrics['script_span'] = {
+                        'start': start,
+                        'end': end,
+                        'script_words': len(script_words),
+                        'out_of_span_words': len(script_words) - (end - start),
+                    }
+                    script_words = script_words[start:end]
+                    script_text = script.span_text(start, end, self.preprocess_text)
+            self.add_word_times(comparisons, segments)
+            statistics = self.calculate_statistics(script_words, comparisons)
+            if mode == 'quick':
+                # Counts describe the sampled spans; the score is the sample estimate
+                statistics['total_words'] = metrics['sampled_words']
+                statistics['accuracy_score'] = metrics['estimated_accuracy']
+            # Stored with the result, so the paragraph view is served from the database
+            if paragraphs is None:
+                paragraphs = self.compare_paragraphs(script_text, transcribed_text, force_single_paragraph=True,
+                                                     segments=segments)
+            logger.info(f"Analysis completed: {statistics['accuracy_score']:.1f}% accuracy, {processing_time:.1f}s actual time")
             return {
-                'script_text': script_text,
                 'transcribed_text': transcribed_text,
                 'processing_time': processing_time,
+                'model_used': model_used,
                 'file_info': {
                     'size_mb': file_size,
                     'duration_seconds': duration,
                     'estimated_time': estimated_time
                 },
                 'comparisons': comparisons,
+                'paragraphs': paragraphs,
                 'segments': segments,
-                'statistics': {
-                    'total_words': total_words,
-                    'correct_words': correct_words,
-                    'missing_words': missing_words,
-                    'wrong_words': wrong_words,
-                    'accuracy_score': accuracy_score
-                }
+                'metrics': metrics,
+                'statistics': statistics
             }
         except Exception as e:
             logger.error(f"Error in audio analysis: {e}")
             raise
-    
-    def extract_paragraphs_from_docx(self, docx_path: str) -> list:
+
+    @staticmethod
+    def extract_paragraphs_from_docx(docx_path: str) -> list:
         """Extract paragraphs from a DOCX file as a list of strings."""
         try:
-            doc = Document(docx_path)
-            return [p.text.strip() for p in doc.paragraphs if p.text.strip()]
+            return docx_paragraphs(docx_path)
         except Exception as e:
             logger.error(f"Error extracting paragraphs from DOCX: {e}")
             return []
 
-    def split_text_into_paragraphs(self, text: str) -> list:
+    @staticmethod
+    def split_text_into_paragraphs(text: str) -> list:
         """Split text into paragraphs by period or newlines."""
         import re
         # Split on period, question mark, exclamation, or newlines
         paras = re.split(r'[.!?]\s+|\n+', text)
         return [p.strip() for p in paras if p.strip()]
 
-    def highlight_differences(self, script_para, audio_para):
+    @staticmethod
+    def highlight_differences(script_para, audio_para):
         import difflib
         script_words = script_para.split()
         audio_words = audio_para.split()
@@ -296,21 +930,24 @@ class AudioAnalyzer:
                     audio_result.append(f'<span class="extra-word">{audio_words[idx]}</span>')
         return ' '.join(script_result), ' '.join(audio_result)
 
-    def compare_paragraphs(self, script_text: str, audio_text: str, script_path: str = None, force_single_paragraph: bool = False, segments=None) -> list:
+    @classmethod
+    def compare_paragraphs(cls, script_text: str, audio_text: str, script_path: str = None, force_single_paragraph: bool = False, segments=None) -> list:
+        """Paragraph-mode rows of a script against a transcript; needs no engine"""
         import difflib
         if force_single_paragraph:
             script_paragraphs = [script_text.strip()] if script_text.strip() else []
             audio_paragraphs = [audio_text.strip()] if audio_text.strip() else []
         else:
             if script_path:
-                script_paragraphs = self.extract_paragraphs_from_docx(script_path)
+                script_paragraphs = cls.extract_paragraphs_from_docx(script_path)
             else:
-                script_paragraphs = self.split_text_into_paragraphs(script_text)
-            audio_paragraphs = self.split_text_into_paragraphs(audio_text)
-        logger.error(f"[DEBUG] Script paragraphs ({len(script_paragraphs)}): {script_paragraphs}")
-        logger.error(f"[DEBUG] Audio paragraphs ({len(audio_paragraphs)}): {audio_paragraphs}")
-        print(f"[DEBUG] Script paragraphs ({len(script_paragraphs)}): {script_paragraphs}")
-        print(f"[DEBUG] Audio paragraphs ({len(audio_paragraphs)}): {audio_paragraphs}")
+                script_paragraphs = cls.split_text_into_paragraphs(script_text)
+            audio_paragraphs = cls.split_text_into_paragraphs(audio_text)
+        # Word offset of each audio paragraph in the transcript, for the timeline
+        timeline = WordTimeline(segments)
+        audio_offsets = [0]
+        for a_para in audio_paragraphs:
+            audio_offsets.append(audio_offsets[-1] + len(a_para.split()))
         matcher = difflib.SequenceMatcher(None, script_paragraphs, audio_paragraphs, autojunk=False)
         opcodes = matcher.get_opcodes()
         results = []
@@ -318,20 +955,11 @@ class AudioAnalyzer:
             for idx in range(max(i2 - i1, j2 - j1)):
                 s_para = script_paragraphs[i1 + idx] if i1 + idx < i2 else ''
                 a_para = audio_paragraphs[j1 + idx] if j1 + idx < j2 else ''
-                similarity = self.calculate_similarity(s_para, a_para) if s_para and a_para else 0
-                highlighted_script, highlighted_audio = self.highlight_differences(s_para, a_para)
-                # Match segments to audio paragraph (a_para)
+                similarity = cls.calculate_similarity(s_para, a_para) if s_para and a_para else 0
+                highlighted_script, highlighted_audio = cls.highlight_differences(s_para, a_para)
                 para_start, para_end = None, None
-                if segments and a_para:
-                    para_words = set(a_para.lower().split())
-                    matched_segments = []
-                    for seg in segments:
-                        seg_words = set(seg['text'].lower().split())
-                        if para_words & seg_words:
-                            matched_segments.append(seg)
-                    if matched_segments:
-                        para_start = min(seg['start'] for seg in matched_segments)
-                        para_end = max(seg['end'] for seg in matched_segments)
+                if a_para:
+                    para_start, para_end = timeline.span_time(audio_offsets[j1 + idx], audio_offsets[j1 + idx + 1])
                 results.append({
                     'script_paragraph': highlighted_script,
                     'audio_paragraph': highlighted_audio,
@@ -341,14 +969,5 @@ class AudioAnalyzer:
                     'start': para_start,
                     'end': para_end
                 })
-        logger.error(f"[DEBUG] Paragraph comparison results: {results}")
-        print(f"[DEBUG] Paragraph comparison results: {results}")
-        if segments and audio_paragraphs:
-            logger.error(f"[DEBUG] First audio paragraph: {audio_paragraphs[0]}")
-            logger.error(f"[DEBUG] First 3 segment texts: {[seg['text'] for seg in segments[:3]]}")
-            para_words = set(audio_paragraphs[0].lower().split())
-            for i, seg in enumerate(segments[:3]):
-                seg_words = set(seg['text'].lower().split())
-                overlap = para_words & seg_words
-                logger.error(f"[DEBUG] Segment {i} overlap: {overlap}")
+        logger.info(f"Compared {len(script_paragraphs)} script paragraphs with {len(audio_paragraphs)} audio paragraphs")
         return results 
\ No newline at end of file
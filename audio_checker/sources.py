@@ -0,0 +1,55 @@
+"""
+Where a job process reads an upload from.
+
+With the filesystem media store a source is a local path. With object
+storage it is a presigned http(s) URL (see storage.media_source), so a job
+can run on any node. Audio is decoded straight from the URL: ffmpeg (whisper)
+and PyAV (faster-whisper) read it as a stream with range requests, and
+nothing is staged on local disk. A script is small and read into memory,
+since zipfile needs a seekable file to read the .docx package (see
+docx_text.py).
+
+This module does not import Django, so job processes can use it.
+"""
+import io
+import os
+import subprocess
+import urllib.request
+
+# Seconds to wait on object storage before failing the read
+URL_TIMEOUT = 60
+
+
+def is_url(source: str) -> bool:
+    return source.startswith(('http://', 'https://'))
+
+
+def source_size(source: str) -> int:
+    """Size in bytes of a local file or of the object behind a URL"""
+    if not is_url(source):
+        return os.path.getsize(source)
+    # Presigned URLs are only signed for GET, so ask for one byte and read
+    # the total from Content-Range
+    request = urllib.request.Request(source, headers={'Range': 'bytes=0-0'})
+    with urllib.request.urlopen(request, timeout=URL_TIMEOUT) as response:
+        content_range = response.headers.get('Content-Range', '')
+        if '/' in content_range:
+            return int(content_range.rsplit('/', 1)[1])
+        return int(response.headers.get('Content-Length', 0))
+
+
+def seekable_source(source: str):
+    """A path or file object that zipfile (and other readers needing random access) can open"""
+    if not is_url(source):
+        return source
+    with urllib.request.urlopen(source, timeout=URL_TIMEOUT) as response:
+        return io.BytesIO(response.read())
+
+
+def probe_duration(source: str) -> float:
+    """Duration in seconds from the container header, read by ffprobe"""
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', source],
+        capture_output=True, text=True, check=True, timeout=URL_TIMEOUT
+    ).stdout.strip()
+    return float(output)
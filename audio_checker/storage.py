@@ -0,0 +1,279 @@
+"""
+Content-addressed media store.
+
+Uploads are stored under the sha256 of their content
+(<upload_to>/<hash[:2]>/<hash><ext>), so the same script or take uploaded for
+several analyses is stored once and every analysis points at the same file.
+Media derived from a take (canonical audio, clips, waveform peaks; see
+media.py) is keyed by the take's hash too.
+
+MEDIA_STORAGE picks where media lives: 'filesystem' keeps it under
+MEDIA_ROOT on this host; 's3' keeps it in an S3-compatible bucket (see
+s3.py), so workers on any node can reach it. Code that reads media goes
+through media_store(), review_store() and media_source() rather than local
+paths.
+
+Files are no longer deleted when an analysis finishes. prune_media_store()
+evicts them instead: media last used more than MEDIA_RETENTION_DAYS ago, and
+then the least recently used media while the store is over
+MEDIA_STORE_MAX_BYTES. Media is used when an analysis of it is updated and
+when its review audio, clips or waveform are served (touch_media). Files of
+analyses that are still queued or running are never evicted.
+prune_unused_scripts() then deletes the parsed Script rows no analysis
+points at any more. Workers run both every MEDIA_PRUNE_INTERVAL_SECONDS,
+and `manage.py prune_media` runs them by hand.
+"""
+import functools
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Max
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HASH_NAME = re.compile(r'^[0-9a-f]{64}$')
+# Files younger than this are never treated as orphans: their upload may not
+# have been saved to an analysis yet
+ORPHAN_GRACE_SECONDS = 3600
+
+
+class LocalMediaStorage(FileSystemStorage):
+    """
+    Media on this host's disk (MEDIA_ROOT). Saving a name that exists
+    replaces the file, since review media is rewritten under fixed names.
+    """
+    local = True
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def staging_dir(self, directory):
+        path = self.path(directory)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def store_staged(self, staged_path, name):
+        """Move a fully written temporary file into place as name"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(staged_path, self.file_permissions_mode)
+        os.replace(staged_path, path)
+
+    def touch(self, name):
+        os.utime(self.path(name))
+
+    def _save(self, name, content):
+        with tempfile.NamedTemporaryFile(dir=self.staging_dir(os.path.dirname(name)), prefix='.upload-',
+                                         delete=False) as tmp:
+            for chunk in content.chunks():
+                tmp.write(chunk)
+        self.store_staged(tmp.name, name)
+        return name.replace('\\', '/')
+
+    def read_range(self, name, first, last):
+        """Bytes first..last (inclusive) of a stored file"""
+        with self.open(name, 'rb') as fh:
+            fh.seek(first)
+            return fh.read(last - first + 1)
+
+    def list_files(self, prefix):
+        """(name, size, modified) of every file under the prefix directory"""
+        for dirpath, _, files in os.walk(self.path(prefix)):
+            for filename in files:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                yield (os.path.relpath(path, self.location).replace(os.sep, '/'), stat.st_size,
+                       datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc))
+
+
+class ContentAddressedMixin:
+    """Names saved files by their sha256 and stores each content once"""
+
+    def get_available_name(self, name, max_length=None):
+        # The name is derived from the content in _save, and an existing file
+        # with that name already holds the same bytes
+        return name
+
+    def _save(self, name, content):
+        directory, basename = os.path.split(name)
+        ext = os.path.splitext(basename)[1].lower()
+        digest = hashlib.sha256()
+        # Hash while copying, so the upload is read once
+        with tempfile.NamedTemporaryFile(dir=self.staging_dir(directory), prefix='.upload-', delete=False) as tmp:
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                os.remove(tmp.name)
+                raise
+        sha = digest.hexdigest()
+        name = os.path.join(directory, sha[:2], sha + ext).replace('\\', '/')
+        try:
+            if self.exists(name):
+                # Mark the content as used again
+                self.touch(name)
+                logger.info(f"{basename} is already stored as {name}")
+            else:
+                self.store_staged(tmp.name, name)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+        return name
+
+
+class ContentAddressedStorage(ContentAddressedMixin, LocalMediaStorage):
+    """Uploads on this host's disk, named by content hash"""
+
+
+@functools.lru_cache(maxsize=None)
+def media_store():
+    """
+    Storage of uploaded scripts and takes, picked by MEDIA_STORAGE (a
+    callable, so migrations do not pin the backend)
+    """
+    if settings.MEDIA_STORAGE == 's3':
+        from .s3 import S3ContentAddressedStorage
+        return S3ContentAddressedStorage()
+    return ContentAddressedStorage()
+
+
+@functools.lru_cache(maxsize=None)
+def review_store():
+    """Storage of the canonical audio, clips and peaks derived from takes"""
+    if settings.MEDIA_STORAGE == 's3':
+        from .s3 import S3MediaStorage
+        return S3MediaStorage()
+    return LocalMediaStorage()
+
+
+def media_source(field_file):
+    """
+    What a job reads a stored file from: its local path, or a presigned URL
+    it can stream from object storage
+    """
+    store = field_file.storage
+    if store.local:
+        return store.path(field_file.name)
+    return store.url(field_file.name, expire=settings.MEDIA_S3_URL_EXPIRE)
+
+
+def content_key(name):
+    """The content hash a stored file is named by, or None for files stored before hashing"""
+    stem = os.path.splitext(os.path.basename(name or ''))[0]
+    return stem if HASH_NAME.match(stem) else None
+
+
+def derived_key(name):
+    """The take key of a review media name: canonical/<key>.wav, clips/<key>/..., peaks/<key>/..."""
+    parts = name.split('/')
+    return os.path.splitext(parts[1])[0] if len(parts) > 1 else None
+
+
+def stored_media():
+    """
+    {name: (files, size, last_used)} for every stored upload: files are the
+    (storage, name) of the upload and of the review media derived from it.
+    last_used is the last update or review of an analysis using the upload,
+    or its modification time if no analysis does.
+    """
+    from .models import AudioAnalysis
+    uploads, review = media_store(), review_store()
+    last_used = {}
+    for field in ('audio_file', 'script_file'):
+        rows = AudioAnalysis.objects.exclude(**{field: ''}).values(field).annotate(
+            last=Max('updated_at'), reviewed=Max('last_reviewed_at')
+        )
+        for row in rows:
+            name = row[field]
+            last = max(row['last'], row['reviewed'] or row['last'])
+            if name not in last_used or last > last_used[name]:
+                last_used[name] = last
+    derived = {}
+    for folder in ('canonical', 'clips', 'peaks'):
+        for name, size, _ in review.list_files(folder):
+            derived.setdefault(derived_key(name), []).append((name, size))
+    media = {}
+    for folder in ('audio', 'scripts'):
+        for name, size, modified in uploads.list_files(folder):
+            if os.path.basename(name).startswith('.upload-'):
+                continue
+            files = [(uploads, name)]
+            key = content_key(name) if folder == 'audio' else None
+            for derived_name, derived_size in derived.get(key, []):
+                files.append((review, derived_name))
+                size += derived_size
+            media[name] = (files, size, last_used.get(name) or modified)
+    return media
+
+
+def touch_media(analysis):
+    """
+    Record that an analysis' review media was just served, so eviction
+    counts it as used. Writes at most once per MEDIA_TOUCH_INTERVAL_SECONDS.
+    """
+    now = timezone.now()
+    last = analysis.last_reviewed_at
+    if last and now - last < timedelta(seconds=settings.MEDIA_TOUCH_INTERVAL_SECONDS):
+        return
+    type(analysis).objects.filter(id=analysis.id).update(last_reviewed_at=now)
+    analysis.last_reviewed_at = now
+
+
+def prune_media_store(retention_days=None, max_bytes=None):
+    """
+    Evict expired and, over the size limit, least recently used media.
+    Returns (uploads evicted, bytes freed).
+    """
+    from .models import AudioAnalysis
+    retention_days = settings.MEDIA_RETENTION_DAYS if retention_days is None else retention_days
+    max_bytes = settings.MEDIA_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    media = stored_media()
+    in_use = set()
+    for row in AudioAnalysis.objects.filter(job_status__in=['queued', 'running']).values('audio_file', 'script_file'):
+        in_use.update(row.values())
+    referenced = set(
+        AudioAnalysis.objects.values_list('audio_file', flat=True)
+    ) | set(AudioAnalysis.objects.values_list('script_file', flat=True))
+    now = timezone.now()
+    expired_before = now - timedelta(days=retention_days) if retention_days else None
+    total = sum(size for _, size, _ in media.values())
+    evicted, freed = 0, 0
+    # Least recently used first
+    for name, (files, size, last_used) in sorted(media.items(), key=lambda item: item[1][2]):
+        if name in in_use:
+            continue
+        orphan = name not in referenced and now - last_used > timedelta(seconds=ORPHAN_GRACE_SECONDS)
+        expired = expired_before is not None and last_used < expired_before
+        over_limit = max_bytes and total > max_bytes
+        if not (orphan or expired or over_limit):
+            continue
+        for store, file_name in files:
+            store.delete(file_name)
+        total -= size
+        evicted += 1
+        freed += size
+        logger.info(f"Evicted {name} ({size} bytes, last used {last_used:%Y-%m-%d %H:%M})")
+    return evicted, freed
+
+
+def prune_unused_scripts():
+    """
+    Delete the parsed scripts (Script rows) no analysis uses any more. Rows
+    younger than ORPHAN_GRACE_SECONDS are kept: a worker may have registered
+    one and not yet saved it to its analysis. Returns the rows deleted.
+    """
+    from .models import Script
+    cutoff = timezone.now() - timedelta(seconds=ORPHAN_GRACE_SECONDS)
+    scripts, _ = Script.objects.filter(analyses__isnull=True, created_at__lt=cutoff).delete()
+    if scripts:
+        logger.info(f"Removed {scripts} unused parsed scripts")
+    return scripts
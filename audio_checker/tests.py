@@ -1,3 +1,731 @@
-from django.test import TestCase
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import wave
+from dataclasses import asdict
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from docx import Document
+
+from . import views, worker
+from .bundles import (
+    MANIFEST_FILE, WEIGHTS_FILE, ModelBundleError, load_whisper_bundle, stage_whisper_bundle, verify_bundle,
+)
+from .cancellation import CancelToken
+from .docx_text import docx_paragraphs
+from .forms import AudioAnalysisForm, BatchUploadForm
+from .jobs import batch_job
+from .media import (
+    PEAK_BASE_SAMPLES_PER_PIXEL, PEAK_HEADER, PEAK_LEVELS, SAMPLE_RATE, SAMPLE_WIDTH, WAV_HEADER_SIZE, peak_levels,
+    peaks_for_zoom, store_peaks, wav_header,
+)
+from .models import AudioAnalysis, Script, WordComparison
+from .script_index import MAX_OCCURRENCES
+from .scripts import ParsedScript
+from .services import AudioAnalyzer
+from .storage import content_key, media_store, prune_media_store, prune_unused_scripts, touch_media
+
+# 240 words; every 4 consecutive words occur once, so windows can be located
+SCRIPT = ' '.join(f'line{n} of the script' for n in range(60))
+
+
+class StubEngineAnalysisTests(SimpleTestCase):
+    """The analysis modes end to end, on takes read by the stub engine"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.analyzer = AudioAnalyzer(model_size='tiny', refine_model_size='base', engine='stub')
+        self.script = ParsedScript.from_paragraphs([SCRIPT], self.analyzer.preprocess_text)
+
+    def take(self, name, transcript):
+        """An (empty) audio file whose stub transcript is the given text"""
+        path = os.path.join(self.directory, name)
+        open(path, 'wb').close()
+        with open(path + '.stub.txt', 'w', encoding='utf-8') as fh:
+            fh.write(transcript)
+        return path
+
+    def analyze(self, path, mode):
+        return self.analyzer.analyze_audio_accuracy('', path, mode=mode, script=self.script)
+
+    def test_standard_counts_misread_words(self):
+        path = self.take('misread.wav', SCRIPT.replace('line7 ', 'banana '))
+        result = self.analyze(path, 'standard')
+        statistics = result['statistics']
+        self.assertEqual(statistics['total_words'], 240)
+        self.assertEqual(statistics['correct_words'], 239)
+        self.assertEqual(statistics['wrong_words'], 1)
+        self.assertNotIn('script_span', result['metrics'])
+
+    def test_standard_locates_partial_take(self):
+        path = self.take('partial.wav', ' '.join(f'line{n} of the script' for n in range(20, 30)))
+        result = self.analyze(path, 'standard')
+        span = result['metrics']['script_span']
+        self.assertEqual((span['start'], span['end']), (80, 120))
+        self.assertEqual(result['statistics']['accuracy_score'], 100.0)
+
+    def test_cascade_refines_dense_errors(self):
+        garbled = SCRIPT.replace('line3 of the script', 'mumble mumble mumble mumble')
+        result = self.analyze(self.take('garbled.wav', garbled), 'cascade')
+        metrics = result['metrics']
+        self.assertEqual(result['model_used'], 'tiny+base')
+        self.assertGreaterEqual(metrics['refined_windows'], 1)
+        self.assertGreater(metrics['refined_seconds'], 0)
+        # The refine engine hears the same take, so the errors remain
+        self.assertEqual(result['statistics']['wrong_words'], 4)
+
+    def test_verify_force_aligns_script(self):
+        path = self.take('dropped.wav', SCRIPT.replace('line5 ', ''))
+        result = self.analyze(path, 'verify')
+        metrics = result['metrics']
+        self.assertNotIn('fallback', metrics)
+        self.assertGreaterEqual(metrics['aligned_windows'], 1)
+        statistics = result['statistics']
+        self.assertEqual(statistics['total_words'], 240)
+        self.assertEqual(statistics['correct_words'], 239)
+        self.assertEqual(statistics['missing_words'], 1)
+        self.assertTrue(all('start' in comp for comp in result['comparisons']))
+
+    def test_verify_comparisons_index_script_words(self):
+        script = ParsedScript.from_paragraphs(["It's a well-known fact -- the script's words, counted once."],
+                                              self.analyzer.preprocess_text)
+        path = self.take('punctuated.wav', "it's a well-known fact the script's words counted once")
+        result = self.analyzer.analyze_audio_accuracy('', path, mode='verify', script=script)
+        self.assertEqual([c['script_word'] for c in result['comparisons']], script.words)
+        self.assertEqual(result['statistics']['correct_words'], len(script.words))
+
+    def test_verify_decodes_window_when_alignment_is_short(self):
+        align = self.analyzer.engine.force_align
+        short = mock.patch.object(self.analyzer.engine, 'force_align',
+                                  side_effect=lambda *args: align(*args)[:-1])
+        path = self.take('short.wav', SCRIPT)
+        with short:
+            result = self.analyze(path, 'verify')
+        self.assertEqual(result['statistics']['correct_words'], 240)
+        self.assertEqual(result['metrics']['open_decoded_seconds'], result['metrics']['audio_seconds'])
+
+    def test_quick_estimates_from_located_windows(self):
+        path = self.take('quick.wav', SCRIPT)
+        result = self.analyze(path, 'quick')
+        metrics = result['metrics']
+        self.assertEqual(metrics['unlocated_windows'], 0)
+        self.assertEqual(len(metrics['windows']), 3)
+        self.assertEqual(metrics['estimated_accuracy'], 100.0)
+        self.assertEqual(result['statistics']['accuracy_score'], 100.0)
+        # Paragraph rows cover the sampled windows, not the whole script
+        self.assertEqual([p['status'] for p in result['paragraphs']], ['Correct'] * 3)
+        self.assertEqual([p['index'] for p in result['paragraphs']], [0, 1, 2])
+
+    def test_quick_leaves_out_unlocated_windows(self):
+        # The last third of the take is not in the script
+        unrelated = ' '.join(f'aside{n} about something else' for n in range(20))
+        path = self.take('aside.wav', ' '.join(f'line{n} of the script' for n in range(40)) + ' ' + unrelated)
+        metrics = self.analyze(path, 'quick')['metrics']
+        self.assertEqual(metrics['unlocated_windows'], 1)
+        self.assertEqual(metrics['estimated_accuracy'], 100.0)
+
+    def test_refine_engine_transcribes_the_array_it_is_given(self):
+        # Takes of the same length used to share a transcript
+        first = self.take('first.wav', 'one two three four')
+        second = self.take('second.wav', 'five six seven eight')
+        first_audio = self.analyzer.load_audio_array(first)
+        second_audio = self.analyzer.load_audio_array(second)
+        self.assertEqual(len(first_audio), len(second_audio))
+        refine = self.analyzer.refine_engine
+        self.assertEqual(refine.transcribe_window(first_audio, 0.0, 1.6)[0]['text'], ' one two three four')
+        self.assertEqual(refine.transcribe_window(second_audio, 0.0, 1.6)[0]['text'], ' five six seven eight')
+
+
+class TranscriptionFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.analyzer = AudioAnalyzer(model_size='tiny', engine='stub')
+        self.decoded = []
+
+    def local_take(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'take.wav')
+        with wave.open(path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(16000)
+            wav_file.writeframes(bytes(3200))
+        return path
+
+    def transcribe(self, path):
+        """Engine stand-in: fails on the original file, reads any re-encoded copy"""
+        if not self.decoded:
+            self.decoded.append(path)
+            raise RuntimeError('cannot decode')
+        self.decoded.append(path)
+        self.assertTrue(os.path.exists(path))
+        return {'text': ' re-encoded ', 'segments': []}
+
+    def test_url_sources_skip_the_temp_file_fallback(self):
+        url = 'https://bucket.example.com/audio/take.wav?X-Amz-Signature=abc'
+        with mock.patch('audio_checker.services.source_size', return_value=1024), \
+                mock.patch.object(self.analyzer.engine, 'transcribe', side_effect=self.transcribe), \
+                mock.patch('tempfile.NamedTemporaryFile') as temp_file:
+            with self.assertRaisesMessage(RuntimeError, 'cannot decode'):
+                self.analyzer.transcribe_audio(url)
+        temp_file.assert_not_called()
+        self.assertEqual(self.decoded, [url])
+
+    def test_local_fallback_removes_its_temp_file(self):
+        path = self.local_take()
+        with mock.patch.object(self.analyzer.engine, 'transcribe', side_effect=self.transcribe):
+            text, _, segments = self.analyzer.transcribe_audio(path)
+        self.assertEqual((text, segments), ('re-encoded', []))
+        original, copy = self.decoded
+        self.assertEqual(original, path)
+        self.assertNotEqual(copy, path)
+        self.assertFalse(os.path.exists(copy))
+
+    def test_failed_local_fallback_removes_its_temp_file(self):
+        path = self.local_take()
+        failing = mock.patch.object(self.analyzer.engine, 'transcribe', side_effect=RuntimeError('cannot decode'))
+        with failing as transcribe:
+            with self.assertRaises(Exception):
+                self.analyzer.transcribe_audio(path)
+        copies = [call.args[0] for call in transcribe.call_args_list[1:]]
+        self.assertTrue(copies)
+        self.assertFalse(any(os.path.exists(copy) for copy in copies))
+
+
+class ModelBundleTests(SimpleTestCase):
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir)
+
+    def write_bundle(self, weights=b'tensor bytes'):
+        directory = os.path.join(self.model_dir, 'tiny')
+        os.makedirs(directory)
+        with open(os.path.join(directory, WEIGHTS_FILE), 'wb') as fh:
+            fh.write(weights)
+        manifest = {
+            'format': 1,
+            'model_size': 'tiny',
+            'dims': {},
+            'alignment_heads': None,
+            'files': {WEIGHTS_FILE: {'size': len(weights), 'sha256': hashlib.sha256(weights).hexdigest()}},
+        }
+        with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh)
+        return directory, manifest
+
+    def test_verify_bundle_returns_its_manifest(self):
+        _, manifest = self.write_bundle()
+        self.assertEqual(verify_bundle(self.model_dir, 'tiny'), manifest)
+
+    def test_checksum_mismatch_raises(self):
+        directory, _ = self.write_bundle()
+        # Same size, different bytes
+        with open(os.path.join(directory, WEIGHTS_FILE), 'wb') as fh:
+            fh.write(b'tensor BYTES')
+        with self.assertRaisesMessage(ModelBundleError, 'sha256'):
+            verify_bundle(self.model_dir, 'tiny')
+        with open(os.path.join(directory, WEIGHTS_FILE), 'wb') as fh:
+            fh.write(b'truncated')
+        with self.assertRaisesMessage(ModelBundleError, 'expected 12'):
+            verify_bundle(self.model_dir, 'tiny')
+        os.remove(os.path.join(directory, WEIGHTS_FILE))
+        with self.assertRaisesMessage(ModelBundleError, 'missing'):
+            verify_bundle(self.model_dir, 'tiny')
+
+    def test_missing_or_unknown_bundles_raise(self):
+        with self.assertRaisesMessage(ModelBundleError, 'stage_models base'):
+            verify_bundle(self.model_dir, 'base')
+        directory, manifest = self.write_bundle()
+        with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as fh:
+            json.dump(dict(manifest, format=99), fh)
+        with self.assertRaisesMessage(ModelBundleError, 'unsupported bundle format'):
+            verify_bundle(self.model_dir, 'tiny')
+
+    @skipUnless(all(importlib.util.find_spec(name) for name in ('torch', 'whisper', 'safetensors')),
+                'needs torch, whisper and safetensors')
+    def test_staged_bundle_loads_the_checkpoint_weights(self):
+        import torch
+        from whisper.model import ModelDimensions, Whisper
+        dims = ModelDimensions(n_mels=80, n_audio_ctx=8, n_audio_state=16, n_audio_head=2, n_audio_layer=1,
+                               n_vocab=32, n_text_ctx=8, n_text_state=16, n_text_head=2, n_text_layer=2)
+        model = Whisper(dims)
+        checkpoint = os.path.join(self.model_dir, 'toy.pt')
+        torch.save({'dims': asdict(dims), 'model_state_dict': model.state_dict()}, checkpoint)
+        stage_whisper_bundle('toy', self.model_dir, checkpoint)
+        self.assertFalse(os.path.exists(os.path.join(self.model_dir, 'toy.staging')))
+        loaded = load_whisper_bundle(self.model_dir, 'toy', device='cpu')
+        expected = model.state_dict()
+        self.assertEqual(set(loaded.state_dict()), set(expected))
+        for name, tensor in loaded.state_dict().items():
+            self.assertTrue(torch.equal(tensor, expected[name]), name)
+        # Tampering with the staged weights is caught before loading
+        with open(os.path.join(self.model_dir, 'toy', WEIGHTS_FILE), 'r+b') as fh:
+            fh.seek(-1, os.SEEK_END)
+            last = fh.read(1)
+            fh.seek(-1, os.SEEK_END)
+            fh.write(bytes([last[0] ^ 1]))
+        with self.assertRaises(ModelBundleError):
+            load_whisper_bundle(self.model_dir, 'toy', device='cpu')
+
+
+class JobQueueTests(TransactionTestCase):
+    """
+    Claims, leases and retries on the database queue. On SQLite the queue's
+    writes run on the writer thread's own connection (see db.py), which
+    cannot see rows inside a test transaction, so these tests commit.
+    """
+
+    def queue(self, count=1, **fields):
+        return [AudioAnalysis.objects.create(title=f'take {n}', script_file='scripts/script.docx',
+                                             audio_file='audio/take.wav', **fields) for n in range(count)]
+
+    def expire(self, analysis, seconds=1):
+        AudioAnalysis.objects.filter(id=analysis.id).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=seconds)
+        )
+
+    def test_claim_takes_oldest_queued_analysis(self):
+        first, second = self.queue(2)
+        self.assertEqual(worker.claim_next_job('w1'), [first.id])
+        first.refresh_from_db()
+        self.assertEqual((first.job_status, first.worker_id, first.attempts), ('running', 'w1', 1))
+        self.assertGreater(first.lease_expires_at, timezone.now())
+        self.assertEqual(worker.claim_next_job('w2'), [second.id])
+        self.assertEqual(worker.claim_next_job('w3'), [])
+
+    def test_claim_takes_whole_batch_group(self):
+        analyses = self.queue(3, job_group='1-stub-tiny')
+        loner, = self.queue()
+        self.assertEqual(sorted(worker.claim_next_job('w1')), [a.id for a in analyses])
+        self.assertEqual(worker.claim_next_job('w2'), [loner.id])
+
+    def test_heartbeat_extends_lease(self):
+        analysis, = self.queue()
+        worker.claim_next_job('w1')
+        self.expire(analysis, seconds=-1)
+        self.assertTrue(worker.renew_lease([analysis.id], 'w1'))
+        analysis.refresh_from_db()
+        self.assertGreater(analysis.lease_expires_at, timezone.now() + timedelta(seconds=30))
+        self.assertEqual(worker.reap_expired_leases(), 0)
+
+    def test_heartbeat_of_lost_lease_fails(self):
+        analysis, = self.queue()
+        worker.claim_next_job('w1')
+        self.expire(analysis)
+        worker.reap_expired_leases()
+        self.assertFalse(worker.renew_lease([analysis.id], 'w1'))
+
+    @override_settings(ANALYSIS_RETRY_BACKOFF=10, ANALYSIS_MAX_ATTEMPTS=3)
+    def test_expired_lease_is_requeued_with_backoff(self):
+        analysis, = self.queue()
+        worker.claim_next_job('w1')
+        self.expire(analysis)
+        self.assertEqual(worker.reap_expired_leases(), 1)
+        analysis.refresh_from_db()
+        self.assertEqual((analysis.job_status, analysis.worker_id), ('queued', ''))
+        self.assertIsNone(analysis.lease_expires_at)
+        self.assertIn('w1 stopped heartbeating', analysis.last_error)
+        self.assertGreater(analysis.next_attempt_at, timezone.now() + timedelta(seconds=5))
+        # Not runnable until the backoff has passed
+        self.assertEqual(worker.claim_next_job('w2'), [])
+        AudioAnalysis.objects.filter(id=analysis.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(worker.claim_next_job('w2'), [analysis.id])
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.attempts, 2)
+
+    @override_settings(ANALYSIS_RETRY_BACKOFF=10)
+    def test_backoff_doubles_up_to_limit(self):
+        self.assertEqual([worker.retry_backoff(n) for n in (1, 2, 3, 4)], [10, 20, 40, 80])
+        self.assertEqual(worker.retry_backoff(20), worker.MAX_BACKOFF_SECONDS)
+
+    @override_settings(ANALYSIS_MAX_ATTEMPTS=3)
+    def test_analysis_fails_after_max_attempts(self):
+        analysis, = self.queue(job_status='running', worker_id='w1', attempts=3,
+                               lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(worker.reap_expired_leases(), 1)
+        analysis.refresh_from_db()
+        self.assertEqual((analysis.job_status, analysis.failure_reason), ('failed', 'error'))
+        self.assertEqual(analysis.accuracy_score, -1)
+        self.assertEqual(worker.claim_next_job('w2'), [])
+
+    def test_failed_group_member_runs_alone_on_retry(self):
+        analyses = self.queue(2, job_group='1-stub-tiny')
+        worker.claim_next_job('w1')
+        self.assertTrue(worker.retry_or_fail(analyses[0], 'decode error', worker_id='w1'))
+        analyses[0].refresh_from_db()
+        self.assertEqual((analyses[0].job_status, analyses[0].job_group), ('queued', ''))
+        # Only the worker holding the lease can requeue it
+        self.assertTrue(worker.retry_or_fail(analyses[1], 'decode error', worker_id='w2'))
+        analyses[1].refresh_from_db()
+        self.assertEqual((analyses[1].job_status, analyses[1].worker_id), ('running', 'w1'))
+
+
+class TouchMediaTests(TestCase):
+    @override_settings(MEDIA_TOUCH_INTERVAL_SECONDS=3600)
+    def test_review_reads_record_use_at_most_once_per_interval(self):
+        analysis = AudioAnalysis.objects.create(title='take', script_file='scripts/script.docx',
+                                                audio_file='audio/take.wav')
+        touch_media(analysis)
+        first = AudioAnalysis.objects.get(id=analysis.id).last_reviewed_at
+        self.assertIsNotNone(first)
+        touch_media(analysis)
+        self.assertEqual(AudioAnalysis.objects.get(id=analysis.id).last_reviewed_at, first)
+        stale = first - timedelta(hours=2)
+        AudioAnalysis.objects.filter(id=analysis.id).update(last_reviewed_at=stale)
+        analysis.refresh_from_db()
+        touch_media(analysis)
+        self.assertGreater(AudioAnalysis.objects.get(id=analysis.id).last_reviewed_at, stale)
+
+
+class MediaStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=directory, MEDIA_STORAGE='filesystem')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = directory
+
+    def upload(self, content, days_ago, job_status='done'):
+        """An analysis of a take with content, last used days_ago, and the take's canonical audio"""
+        name = media_store().save('audio/take.wav', ContentFile(content))
+        os.makedirs(os.path.join(self.media_root, 'canonical'), exist_ok=True)
+        with open(os.path.join(self.media_root, self.canonical(name)), 'wb') as fh:
+            fh.write(content)
+        analysis = AudioAnalysis.objects.create(title='take', script_file='', audio_file=name, job_status=job_status)
+        AudioAnalysis.objects.filter(id=analysis.id).update(updated_at=timezone.now() - timedelta(days=days_ago))
+        return name
+
+    def canonical(self, name):
+        return f'canonical/{content_key(name)}.wav'
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+    def test_uploads_are_named_by_content_and_stored_once(self):
+        first = media_store().save('audio/first.WAV', ContentFile(b'same bytes'))
+        second = media_store().save('audio/second.wav', ContentFile(b'same bytes'))
+        other = media_store().save('audio/first.wav', ContentFile(b'other bytes'))
+        sha = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first, f'audio/{sha[:2]}/{sha}.wav')
+        self.assertEqual(second, first)
+        self.assertNotEqual(other, first)
+        files = [name for root, _, names in os.walk(os.path.join(self.media_root, 'audio')) for name in names]
+        self.assertEqual(sorted(files), sorted([os.path.basename(first), os.path.basename(other)]))
+
+    def test_expired_media_is_evicted_with_its_review_media(self):
+        old = self.upload(b'old take', days_ago=40)
+        fresh = self.upload(b'fresh take', days_ago=1)
+        running = self.upload(b'running take', days_ago=40, job_status='running')
+        evicted, freed = prune_media_store(retention_days=30, max_bytes=0)
+        self.assertEqual((evicted, freed), (1, 2 * len(b'old take')))
+        self.assertFalse(self.exists(old))
+        self.assertFalse(self.exists(self.canonical(old)))
+        self.assertTrue(self.exists(self.canonical(fresh)))
+        self.assertTrue(self.exists(fresh))
+        self.assertTrue(self.exists(running))
+
+    def test_least_recently_used_media_is_evicted_over_the_size_limit(self):
+        names = [self.upload(f'take {n}'.encode(), days_ago=days) for n, days in enumerate((3, 1, 2))]
+        # Each take and its canonical audio are 12 bytes; room for two takes
+        evicted, _ = prune_media_store(retention_days=0, max_bytes=24)
+        self.assertEqual(evicted, 1)
+        self.assertEqual([self.exists(name) for name in names], [False, True, True])
+
+    def test_recent_review_counts_as_use(self):
+        name = self.upload(b'reviewed take', days_ago=40)
+        AudioAnalysis.objects.filter(audio_file=name).update(last_reviewed_at=timezone.now())
+        self.assertEqual(prune_media_store(retention_days=30, max_bytes=0), (0, 0))
+        self.assertTrue(self.exists(name))
+
+    def test_unused_parsed_scripts_are_removed_after_a_grace_period(self):
+        old_unused = Script.objects.create(content_hash='a' * 64, text='one')
+        new_unused = Script.objects.create(content_hash='b' * 64, text='two')
+        used = Script.objects.create(content_hash='c' * 64, text='three')
+        AudioAnalysis.objects.create(title='take', script_file='', audio_file='', script=used)
+        Script.objects.filter(id__in=[old_unused.id, used.id]).update(created_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(prune_unused_scripts(), 1)
+        self.assertEqual(set(Script.objects.values_list('id', flat=True)), {new_unused.id, used.id})
+
+
+class ReviewMediaTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=directory, MEDIA_STORAGE='filesystem')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = directory
+        frames = 2 * SAMPLE_RATE
+        self.wav = wav_header(frames) + bytes(range(256)) * (frames * SAMPLE_WIDTH // 256)
+        os.makedirs(os.path.join(directory, 'canonical'))
+        with open(os.path.join(directory, 'canonical', 'take.wav'), 'wb') as fh:
+            fh.write(self.wav)
+        self.analysis = AudioAnalysis.objects.create(title='take', script_file='scripts/script.docx',
+                                                     audio_file='audio/take.wav', canonical_audio='canonical/take.wav')
+
+    def get_audio(self, **headers):
+        response = self.client.get(reverse('audio_checker:analysis_audio', args=[self.analysis.id]), headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_parse_byte_range(self):
+        self.assertEqual(views.parse_byte_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(views.parse_byte_range('bytes=900-5000', 1000), (900, 999))
+        # Open-ended and suffix ranges
+        self.assertEqual(views.parse_byte_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(views.parse_byte_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(views.parse_byte_range('bytes=-5000', 1000), (0, 999))
+        # Unsatisfiable
+        self.assertIs(views.parse_byte_range('bytes=1000-', 1000), False)
+        self.assertIs(views.parse_byte_range('bytes=5-2', 1000), False)
+        # Sent whole: no header, multiple ranges, other units, garbage
+        for header in (None, '', 'bytes=0-1,5-6', 'items=0-1', 'bytes=a-b'):
+            self.assertIsNone(views.parse_byte_range(header, 1000), header)
+
+    def test_ranged_audio_responses(self):
+        size = len(self.wav)
+        response, body = self.get_audio(Range='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {size - 100}-{size - 1}/{size}')
+        self.assertEqual(body, self.wav[-100:])
+        response, body = self.get_audio(Range='bytes=1000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Length'], str(size - 1000))
+        self.assertEqual(body, self.wav[1000:])
+        response, _ = self.get_audio(Range=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        # Multiple ranges are answered with the whole file
+        response, body = self.get_audio(Range='bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.wav)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_peak_pyramid(self):
+        audio = np.zeros(PEAK_BASE_SAMPLES_PER_PIXEL * 5, dtype=np.float32)
+        audio[10] = 1.0
+        audio[PEAK_BASE_SAMPLES_PER_PIXEL * 4 + 3] = -0.5
+        pyramid = peak_levels(audio, levels=4)
+        self.assertEqual(sorted(pyramid), [PEAK_BASE_SAMPLES_PER_PIXEL << level for level in range(4)])
+        mins, maxs = pyramid[PEAK_BASE_SAMPLES_PER_PIXEL]
+        self.assertEqual(maxs.tolist(), [127, 0, 0, 0, 0])
+        self.assertEqual(mins.tolist(), [0, 0, 0, 0, -64])
+        # Each level halves the pixels; an odd last pixel covers fewer samples
+        for spp, pixels in ((2, 3), (4, 2), (8, 1)):
+            mins, maxs = pyramid[PEAK_BASE_SAMPLES_PER_PIXEL * spp]
+            self.assertEqual(len(mins), pixels)
+            self.assertEqual((maxs[0], mins[-1]), (127, -64))
+        # Zooms between levels get the finer one; beyond the ends, the nearest end
+        base = PEAK_BASE_SAMPLES_PER_PIXEL
+        self.assertEqual(peaks_for_zoom('peaks', 1), f'peaks/{base}.dat')
+        self.assertEqual(peaks_for_zoom('peaks', base * 3), f'peaks/{base * 2}.dat')
+        self.assertEqual(peaks_for_zoom('peaks', base << 20), f'peaks/{base << (PEAK_LEVELS - 1)}.dat')
+
+    def test_waveform_peaks_etag(self):
+        store_peaks(np.linspace(-1, 1, SAMPLE_RATE, dtype=np.float32),
+                    os.path.join(self.media_root, 'peaks', str(self.analysis.id)))
+        url = reverse('audio_checker:waveform_peaks', args=[self.analysis.id])
+        response = self.client.get(url, {'samples_per_pixel': PEAK_BASE_SAMPLES_PER_PIXEL * 3})
+        self.assertEqual(response.status_code, 200)
+        data = b''.join(response.streaming_content)
+        response.close()
+        version, flags, rate, spp, pixels = PEAK_HEADER.unpack(data[:PEAK_HEADER.size])
+        self.assertEqual((version, flags, rate, spp), (1, 1, SAMPLE_RATE, PEAK_BASE_SAMPLES_PER_PIXEL * 2))
+        self.assertEqual(len(data), PEAK_HEADER.size + pixels * 2)
+        etag = response['ETag']
+        response = self.client.get(url, {'samples_per_pixel': PEAK_BASE_SAMPLES_PER_PIXEL * 3},
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Another level has its own ETag
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response.close()
+        self.assertEqual(self.client.get(url, {'samples_per_pixel': 'wide'}).status_code, 400)
+
+    @override_settings(CLIP_PADDING_SECONDS=0)
+    def test_clip_is_cut_without_writing_to_the_store(self):
+        WordComparison.objects.create(analysis=self.analysis, script_word='one', audio_word='won', word_index=0,
+                                      error_type='wrong', start_ms=500, end_ms=1000)
+        url = reverse('audio_checker:audio_clip', args=[self.analysis.id]) + '?word=0'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        clip = response.content
+        frames = SAMPLE_RATE // 2
+        self.assertEqual(clip[:WAV_HEADER_SIZE], wav_header(frames))
+        start = WAV_HEADER_SIZE + SAMPLE_RATE // 2 * SAMPLE_WIDTH
+        self.assertEqual(clip[WAV_HEADER_SIZE:], self.wav[start:start + frames * SAMPLE_WIDTH])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'clips')))
+        response = self.client.get(url, headers={'Range': 'bytes=-10'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, clip[-10:])
+
+
+class EngineChoiceTests(TestCase):
+    def test_forms_do_not_offer_stub_engine(self):
+        for form in (AudioAnalysisForm(), BatchUploadForm()):
+            self.assertNotIn('stub', dict(form.fields['engine'].choices))
+
+    def test_faster_whisper_offered_only_when_installed(self):
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            self.assertNotIn('faster-whisper', dict(AudioAnalysisForm().fields['engine'].choices))
+        with mock.patch('importlib.util.find_spec', return_value=object()):
+            self.assertIn('faster-whisper', dict(AudioAnalysisForm().fields['engine'].choices))
+
+    def test_reanalyze_rejects_stub_engine(self):
+        analysis = AudioAnalysis.objects.create(title='take', script_file='scripts/script.docx',
+                                                audio_file='audio/take.wav')
+        response = self.client.post(reverse('audio_checker:reanalyze_analysis', args=[analysis.id]), {'engine': 'stub'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ParagraphBackfillTests(TransactionTestCase):
+    def test_backfill_compares_text_without_an_engine(self):
+        analysis = AudioAnalysis.objects.create(title='take', script_file='scripts/script.docx',
+                                                audio_file='audio/take.wav')
+        WordComparison.objects.bulk_create([
+            WordComparison(analysis=analysis, script_word='hello', audio_word='hello', word_index=0, is_correct=True),
+            WordComparison(analysis=analysis, script_word='world', audio_word='word', word_index=1),
+        ])
+        with mock.patch('audio_checker.services.create_engine') as create_engine:
+            views.backfill_paragraph_comparisons(analysis, None, [])
+        create_engine.assert_not_called()
+        paragraph, = analysis.paragraph_comparisons.all()
+        self.assertEqual(paragraph.status, 'Wrong')
+        self.assertIn('wrong-word', paragraph.script_paragraph)
+
+
+class ScriptParsingTests(SimpleTestCase):
+    def test_parse_script_needs_no_engine(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'script.docx')
+        document = Document()
+        document.add_paragraph('Hello, world.')
+        document.add_paragraph('Second line!')
+        document.save(path)
+        with mock.patch('audio_checker.services.create_engine') as create_engine:
+            script = AudioAnalyzer.parse_script(path)
+        create_engine.assert_not_called()
+        self.assertEqual(script.paragraphs, ['Hello, world.', 'Second line!'])
+        self.assertEqual(script.words, ['hello', 'world', 'second', 'line'])
+
+    def test_streaming_parser_matches_python_docx(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'script.docx')
+        document = Document()
+        document.add_paragraph('INT. KITCHEN - NIGHT')
+        document.add_paragraph('')
+        run = document.add_paragraph('Name:').add_run()
+        run.add_tab()
+        run.add_text('Ada')
+        run = document.add_paragraph('First line').add_run()
+        run.add_break()
+        run.add_text('second line')
+        document.add_paragraph('   ')
+        table = document.add_table(rows=2, cols=2)
+        table.cell(0, 0).text = 'Speaker'
+        table.cell(0, 1).text = 'Line'
+        table.cell(1, 0).text = 'ADA'
+        table.cell(1, 1).paragraphs[0].add_run('Hello there.')
+        table.cell(1, 1).add_paragraph('')
+        table.cell(1, 1).add_paragraph('Two paragraphs in a cell.')
+        document.add_paragraph('After the table.')
+        document.save(path)
+
+        # document.paragraphs skips tables, so read body paragraphs and
+        # table cell paragraphs in document order
+        expected = []
+        for block in Document(path).iter_inner_content():
+            if hasattr(block, 'rows'):
+                paragraphs = [p for row in block.rows for cell in row.cells for p in cell.paragraphs]
+            else:
+                paragraphs = [block]
+            expected.extend(p.text.strip() for p in paragraphs if p.text.strip())
+        self.assertEqual(docx_paragraphs(path), expected)
+        self.assertIn('Name:\tAda', expected)
+        self.assertIn('First line\nsecond line', expected)
+        self.assertIn('Two paragraphs in a cell.', expected)
+
+
+class ScriptIndexTests(SimpleTestCase):
+    def script(self, text):
+        return ParsedScript.from_paragraphs([text], AudioAnalyzer.preprocess_text)
+
+    def test_locates_a_passage(self):
+        script = self.script(' '.join(f'word{n}' for n in range(500)))
+        take = [f'word{n}' for n in range(200, 260)]
+        start, end, anchors = script.index.locate(script.lookup_ids(take))
+        self.assertEqual((start, end), (200, 260))
+        self.assertEqual(anchors, 60 - 4 + 1)
+
+    def test_misread_ends_stay_in_the_span(self):
+        script = self.script(' '.join(f'word{n}' for n in range(500)))
+        take = ['mumble'] + [f'word{n}' for n in range(101, 150)] + ['banana']
+        start, end, _ = script.index.locate(script.lookup_ids(take))
+        self.assertEqual((start, end), (100, 151))
+
+    def test_repeated_ngrams_are_ignored(self):
+        refrain = 'and the chorus goes round again'
+        verses = [' '.join(f'verse{v}word{n}' for n in range(20)) for v in range(MAX_OCCURRENCES + 1)]
+        script = self.script(' '.join(f'{verse} {refrain}' for verse in verses))
+        # Only the refrain: it occurs more than MAX_OCCURRENCES times, so it places nothing
+        ids = script.lookup_ids(refrain.split() * 3)
+        self.assertEqual(script.index.anchors(ids), [])
+        self.assertIsNone(script.index.locate(ids))
+        # With a verse the take is placed by the n-grams holding a verse word
+        take = f'{verses[5]} {refrain}'.split()
+        start, end, anchors = script.index.locate(script.lookup_ids(take))
+        self.assertEqual(start, 5 * 26)
+        self.assertEqual(end, start + len(take))
+        self.assertEqual(anchors, len(take) - 4 + 1 - 3)
+
+    def test_unmatched_take_is_not_located(self):
+        script = self.script(' '.join(f'word{n}' for n in range(500)))
+        self.assertIsNone(script.index.locate(script.lookup_ids([f'aside{n}' for n in range(40)])))
+        # Too few anchors to trust
+        self.assertIsNone(script.index.locate(script.lookup_ids([f'word{n}' for n in range(5)])))
+        self.assertIsNone(script.index.locate(script.lookup_ids(['word1', 'word2'])))
+
+    def test_unlocated_window_falls_back_to_the_expected_offset(self):
+        script = self.script(' '.join(f'word{n}' for n in range(500)))
+        analyzer = AudioAnalyzer(model_size='tiny', engine='stub')
+        window = [f'word{n}' if n % 2 else 'mumble' for n in range(300, 320)]
+        self.assertIsNone(script.index.locate(script.lookup_ids(window)))
+        with mock.patch.object(analyzer, 'locate_in_script', return_value=(300, 320)) as fallback:
+            self.assertEqual(analyzer.locate_window(script, window, 310), (300, 320))
+        fallback.assert_called_once_with(script.words, window, 310)
+
+
+class BatchJobTests(SimpleTestCase):
+    def test_long_clips_are_left_out_and_unknown_durations_kept(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        script = ParsedScript.from_paragraphs(['one two three four'], AudioAnalyzer.preprocess_text)
+        pairs = []
+        for name in ('short', 'long', 'unknown'):
+            path = os.path.join(directory, name + '.wav')
+            open(path, 'wb').close()
+            with open(path + '.stub.txt', 'w', encoding='utf-8') as fh:
+                fh.write('one two three four')
+            pairs.append((script, path))
+        durations = {pairs[0][1]: 10.0, pairs[1][1]: 45.0, pairs[2][1]: 0}
+        with mock.patch.object(AudioAnalyzer, 'get_audio_duration', side_effect=durations.get):
+            results = batch_job(CancelToken(), {'engine': 'stub', 'model_size': 'tiny'}, pairs)
+        self.assertEqual(results[0]['statistics']['accuracy_score'], 100.0)
+        self.assertIsNone(results[1])
+        self.assertEqual(results[2]['statistics']['accuracy_score'], 100.0)
@@ -0,0 +1,70 @@
+"""
+Positional index from transcript word offsets to audio times.
+
+The transcript is the concatenation of the engine's segments, so word n of
+transcribed_text.split() lies in the segment whose first word offset is the
+largest one not above n. WordTimeline keeps those first offsets sorted and
+finds the segment with bisect, so a word or a span of words resolves to a time
+in O(log segments), and the same transcript always resolves the same way.
+
+Within a segment a word's time comes from the segment's word timestamps when
+the engine produced them ('words', as whisper returns with
+word_timestamps=True), and is otherwise interpolated evenly across the
+segment.
+
+Words are counted with tokenize, which must match how the transcript was
+split into the offsets being looked up (str.split for raw text,
+AudioAnalyzer.preprocess_text for the comparison's audio words).
+"""
+import bisect
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class WordTimeline:
+    """Maps transcript word offsets to (start, end) times in seconds"""
+
+    def __init__(self, segments: List[Dict], tokenize: Callable[[str], List[str]] = str.split):
+        # First word offset of each non-empty segment, ascending
+        self.first_words = []
+        self.segments = []
+        offset = 0
+        for seg in segments or []:
+            count = len(tokenize(seg.get('text', '')))
+            if not count:
+                continue
+            self.first_words.append(offset)
+            self.segments.append((seg['start'], seg['end'], count, self.token_times(seg, tokenize, count)))
+            offset += count
+        self.word_count = offset
+
+    @staticmethod
+    def token_times(seg: Dict, tokenize, count: int) -> Optional[List[Tuple[float, float]]]:
+        """(start, end) per token from the segment's word timestamps, if they cover every token"""
+        times = []
+        for word in seg.get('words') or []:
+            times.extend([(word['start'], word['end'])] * len(tokenize(word.get('word', ''))))
+        return times if len(times) == count else None
+
+    def __len__(self):
+        return self.word_count
+
+    def word_time(self, offset: int) -> Tuple[Optional[float], Optional[float]]:
+        """(start, end) of the word at offset; offsets past the end clamp to the last word"""
+        if not self.segments or offset < 0:
+            return None, None
+        offset = min(offset, self.word_count - 1)
+        index = bisect.bisect_right(self.first_words, offset) - 1
+        start, end, count, words = self.segments[index]
+        position = offset - self.first_words[index]
+        if words:
+            return words[position]
+        step = (end - start) / count
+        return start + step * position, start + step * (position + 1)
+
+    def span_time(self, first: int, last: int) -> Tuple[Optional[float], Optional[float]]:
+        """(start, end) of the words first..last-1"""
+        if last <= first:
+            return None, None
+        start, _ = self.word_time(first)
+        _, end = self.word_time(last - 1)
+        return start, end
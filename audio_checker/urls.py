@@ -11,6 +11,12 @@ urlpatterns = [
     path('upload-file-pair/', views.upload_file_pair, name='upload_file_pair'),
     path('analysis/<int:analysis_id>/', views.analysis_detail, name='analysis_detail'),
     path('analysis/<int:analysis_id>/status/', views.check_analysis_status, name='check_analysis_status'),
+    path('analysis/<int:analysis_id>/cancel/', views.cancel_analysis, name='cancel_analysis'),
+    path('analysis/<int:analysis_id>/reanalyze/', views.reanalyze_analysis, name='reanalyze_analysis'),
+    path('analysis/<int:analysis_id>/next-error/', views.next_error, name='next_error'),
+    path('analysis/<int:analysis_id>/audio/', views.analysis_audio, name='analysis_audio'),
+    path('analysis/<int:analysis_id>/clip/', views.audio_clip, name='audio_clip'),
+    path('analysis/<int:analysis_id>/peaks/', views.waveform_peaks, name='waveform_peaks'),
     path('analysis/<int:analysis_id>/download/', views.download_results, name='download_results'),
     path('analysis/<int:analysis_id>/download-transcript/', views.download_transcript_docx, name='download_transcript_docx'),
     path('analysis/<int:analysis_id>/transcript/', views.transcript_segments_view, name='transcript_segments'),
@@ -1,7 +1,8 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 import os
@@ -12,10 +13,18 @@ from docx import Document
 from docx.shared import Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import json
+from django.conf import settings
 
-from .models import AudioAnalysis, WordComparison, AnalysisResult, BatchUpload
+from .models import (
+    ANALYSIS_MODE_CHOICES, AudioAnalysis, WordComparison, AnalysisResult, BatchUpload, selectable_engine_choices
+)
 from .forms import AudioAnalysisForm, BatchUploadForm
-from .services import AudioAnalyzer
+from .jobs import cancel_running_job
+from .media import (
+    PEAK_BASE_SAMPLES_PER_PIXEL, canonical_frames, clip_bytes, clip_bounds, clip_path, frames_to_ms, peaks_for_zoom
+)
+from .storage import review_store, touch_media
+from .worker import clip_dir, enqueue_analyses, peaks_dir, seconds_to_ms
 
 logger = logging.getLogger(__name__)
 
@@ -29,10 +38,8 @@ def home(request):
                 analysis.user = request.user
             analysis.save()
             
-            # Start analysis in background with timeout
-            thread = threading.Thread(target=run_analysis_with_timeout, args=(analysis.id,))
-            thread.daemon = True
-            thread.start()
+            # Queue the analysis for the background workers
+            enqueue_analyses([analysis])
             
             messages.success(request, 'Analysis started! You will be notified when it completes.')
             return redirect('audio_checker:analysis_detail', analysis_id=analysis.id)
@@ -41,168 +48,53 @@ def home(request):
     
     return render(request, 'audio_checker/home.html', {'form': form})
 
-def run_analysis_with_timeout(analysis_id):
-    """Background task to run audio analysis with timeout and better error handling"""
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f'[BATCH DEBUG] Starting analysis for ID {analysis_id}')
-    try:
-        analysis = AudioAnalysis.objects.get(id=analysis_id)
-        logger.info(f'[BATCH DEBUG] Loaded analysis: {analysis}')
-        
-        # Choose model size based on file size
-        file_size = analysis.audio_file.size / (1024 * 1024)  # MB
-        logger.info(f'[BATCH DEBUG] Audio file size: {file_size:.2f} MB')
-        if file_size > 50:
-            model_size = 'tiny'  # Use tiny model for large files
-        elif file_size > 20:
-            model_size = 'base'  # Use base model for medium files
-        else:
-            model_size = 'small'  # Use small model for small files
-        logger.info(f'[BATCH DEBUG] Using model size: {model_size}')
-        
-        # Set a timeout for the entire analysis (30 minutes max)
-        start_time = time.time()
-        timeout = 1800  # 30 minutes
-        
-        try:
-            analyzer = AudioAnalyzer(model_size=model_size)
-            
-            # Get file paths
-            script_path = analysis.script_file.path
-            audio_path = analysis.audio_file.path
-            logger.info(f'[BATCH DEBUG] Script path: {script_path}, Audio path: {audio_path}')
-            logger.info(f'[BATCH DEBUG] Script exists: {os.path.exists(script_path)}, Audio exists: {os.path.exists(audio_path)}')
-            
-            # Check if files exist
-            if not os.path.exists(script_path):
-                logger.error(f'[BATCH DEBUG] Script file not found: {script_path}')
-                raise FileNotFoundError(f"Script file not found: {script_path}")
-            if not os.path.exists(audio_path):
-                logger.error(f'[BATCH DEBUG] Audio file not found: {audio_path}')
-                raise FileNotFoundError(f"Audio file not found: {audio_path}")
-            
-            # Run analysis
-            result = analyzer.analyze_audio_accuracy(script_path, audio_path)
-            logger.info(f'[BATCH DEBUG] Analysis result: {result}')
-            
-            # Check timeout
-            if time.time() - start_time > timeout:
-                logger.error('[BATCH DEBUG] Analysis timed out')
-                raise TimeoutError("Analysis timed out after 30 minutes")
-            
-            # Update analysis with results
-            analysis.accuracy_score = result['statistics']['accuracy_score']
-            analysis.total_words = result['statistics']['total_words']
-            analysis.correct_words = result['statistics']['correct_words']
-            analysis.missing_words = result['statistics']['missing_words']
-            analysis.wrong_words = result['statistics']['wrong_words']
-            analysis.save()
-            logger.info(f'[BATCH DEBUG] Analysis updated with results')
-            
-            # Create detailed result with better error handling
-            try:
-                analysis_result, created = AnalysisResult.objects.get_or_create(
-                    analysis=analysis,
-                    defaults={
-                        'transcribed_text': result['transcribed_text'],
-                        'script_text': result['script_text'],
-                        'processing_time': result['processing_time'],
-                        'whisper_model_used': analyzer.model_size,
-                        'segments': result.get('segments', None),
-                    }
-                )
-
-                if not created:
-                    analysis_result.transcribed_text = result['transcribed_text']
-                    analysis_result.script_text = result['script_text']
-                    analysis_result.processing_time = result['processing_time']
-                    analysis_result.segments = result.get('segments', None)
-                    analysis_result.save()
-                logger.info(f'[BATCH DEBUG] AnalysisResult saved for analysis {analysis_id}')
-            except Exception as e:
-                logger.error(f"[BATCH DEBUG] Failed to save AnalysisResult for analysis {analysis_id}: {e}")
-                raise Exception(f"Failed to save analysis results: {e}")
-            
-            # Create word comparisons
-            WordComparison.objects.filter(analysis=analysis).delete()
-            for comp in result['comparisons']:
-                WordComparison.objects.create(
-                    analysis=analysis,
-                    script_word=comp['script_word'],
-                    audio_word=comp['audio_word'],
-                    word_index=comp['word_index'],
-                    is_correct=comp['is_correct'],
-                    similarity_score=comp['similarity_score'],
-                    error_type=comp['error_type']
-                )
-            logger.info(f'[BATCH DEBUG] Word comparisons created for analysis {analysis_id}')
-            
-            # Verify AnalysisResult exists before cleanup
-            try:
-                verification_result = AnalysisResult.objects.get(analysis=analysis)
-                if not verification_result.transcribed_text or not verification_result.script_text:
-                    logger.error(f"[BATCH DEBUG] AnalysisResult for analysis {analysis_id} is incomplete - skipping cleanup")
-                    raise Exception("AnalysisResult is incomplete")
-                logger.info(f"[BATCH DEBUG] AnalysisResult verification passed for analysis {analysis_id}")
-            except AnalysisResult.DoesNotExist:
-                logger.error(f"[BATCH DEBUG] AnalysisResult not found for analysis {analysis_id} - skipping cleanup")
-                raise Exception("AnalysisResult not found")
-            
-            # Only clean up files after AnalysisResult is successfully saved and verified
-            cleanup_analysis_files(analysis)
-            logger.info(f'[BATCH DEBUG] Cleanup complete for analysis {analysis_id}')
-        except Exception as e:
-            logger.error(f"[BATCH DEBUG] Error in analysis {analysis_id}: {e}")
-            # Mark analysis as failed
-            analysis.accuracy_score = -1  # Use -1 to indicate failure
-            analysis.save()
-            raise
-        
-    except AudioAnalysis.DoesNotExist:
-        logger.error(f"[BATCH DEBUG] Analysis {analysis_id} not found")
-    except Exception as e:
-        logger.error(f"[BATCH DEBUG] Critical error in analysis {analysis_id}: {e}")
+# Word-mode and paragraph-mode rows per page
+WORDS_PER_PAGE = 50
+PARAGRAPHS_PER_PAGE = 20
 
-def run_analysis(analysis_id):
-    """Legacy function - now calls the timeout version"""
-    run_analysis_with_timeout(analysis_id)
+def backfill_paragraph_comparisons(analysis, result, segments):
+    """Compute and store paragraph-mode rows for analyses finished before they were precomputed"""
+    from .services import AudioAnalyzer
+    from .worker import save_paragraph_comparisons
+    # A quick check only transcribed sampled windows, so it is compared over the spans it aligned
+    if result and analysis.analysis_mode != 'quick':
+        script_text = result.get_script_text()
+        audio_text = result.transcribed_text
+    else:
+        comparisons = analysis.word_comparisons.all()
+        script_text = ' '.join([c.script_word for c in comparisons if c.script_word])
+        audio_text = ' '.join([c.audio_word for c in comparisons if c.audio_word])
+    paragraphs = AudioAnalyzer.compare_paragraphs(script_text, audio_text, force_single_paragraph=True,
+                                                  segments=segments)
+    save_paragraph_comparisons(analysis, paragraphs)
 
 def analysis_detail(request, analysis_id):
-    print("[DEBUG] analysis_detail called")
     analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
     result = None
     segments = []
     try:
         result = analysis.detailed_result
-        print(f"[DEBUG] AnalysisResult found: {result}")
-        # Try to load segments from a JSONField if you add it, or fallback to re-transcribe if needed
-        if hasattr(result, 'segments') and result.segments:
+        if result.segments:
             segments = result.segments
-        else:
-            # Optionally, you could re-run the analyzer here to get segments if not stored
-            pass
-    except Exception as e:
-        print(f"[DEBUG] No AnalysisResult: {e}")
+    except AnalysisResult.DoesNotExist:
+        pass
     mode = request.GET.get('mode', 'word')
-    paragraph_results = None
-    if mode == 'paragraph':
-        analyzer = AudioAnalyzer()
-        if result:
-            print(f"[DEBUG] Using AnalysisResult for paragraph analysis")
-            script_text = result.script_text
-            audio_text = result.transcribed_text
-        else:
-            print(f"[DEBUG] Reconstructing script/audio text from WordComparison for paragraph analysis")
-            comparisons = analysis.word_comparisons.all()
-            script_text = ' '.join([c.script_word for c in comparisons if c.script_word])
-            audio_text = ' '.join([c.audio_word for c in comparisons if c.audio_word])
-        paragraph_results = analyzer.compare_paragraphs(script_text, audio_text, script_path=None, force_single_paragraph=True, segments=segments)
     if analysis.accuracy_score == -1:
-        messages.error(request, 'Analysis failed. Please try again with a smaller file or different format.')
+        if analysis.failure_reason == 'cancelled':
+            messages.info(request, 'Analysis was cancelled.')
+        elif analysis.failure_reason == 'timeout':
+            messages.error(request, 'Analysis exceeded its time limit. Try a smaller file, the quick check mode, or a faster engine.')
+        else:
+            messages.error(request, 'Analysis failed. Please try again with a smaller file or different format.')
         return redirect('audio_checker:home')
+    paragraph_page = None
+    if mode == 'paragraph':
+        paragraphs = analysis.paragraph_comparisons.all()
+        if analysis.accuracy_score is not None and not paragraphs.exists():
+            backfill_paragraph_comparisons(analysis, result, segments)
+        paragraph_page = Paginator(paragraphs, PARAGRAPHS_PER_PAGE).get_page(request.GET.get('page'))
     comparisons = analysis.word_comparisons.all()
-    paginator = Paginator(comparisons, 50)
+    paginator = Paginator(comparisons, WORDS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     context = {
@@ -210,7 +102,7 @@ def analysis_detail(request, analysis_id):
         'page_obj': page_obj,
         'comparisons': page_obj,
         'mode': mode,
-        'paragraph_results': paragraph_results,
+        'paragraph_results': paragraph_page,
         'segments': segments,
     }
     return render(request, 'audio_checker/analysis_detail.html', context)
@@ -232,6 +124,10 @@ def check_analysis_status(request, analysis_id):
         
         # Check if analysis failed
         if analysis.accuracy_score == -1:
+            if analysis.failure_reason == 'cancelled':
+                return JsonResponse({'status': 'cancelled', 'error': 'Analysis was cancelled.'})
+            if analysis.failure_reason == 'timeout':
+                return JsonResponse({'status': 'failed', 'error': 'Analysis exceeded its time limit.'})
             return JsonResponse({
                 'status': 'failed',
                 'error': 'Analysis failed. Please try again.'
@@ -244,10 +140,258 @@ def check_analysis_status(request, analysis_id):
             'correct_words': analysis.correct_words,
             'missing_words': analysis.missing_words,
             'wrong_words': analysis.wrong_words,
+            'analysis_mode': analysis.analysis_mode,
+            'cancel_requested': analysis.cancel_requested,
+            'job_status': analysis.job_status,
+            'attempts': analysis.attempts,
         })
     except AudioAnalysis.DoesNotExist:
         return JsonResponse({'error': 'Analysis not found'}, status=404)
 
+@require_POST
+def cancel_analysis(request, analysis_id):
+    """
+    Request cancellation of a queued or running analysis. A job running in
+    this process is signalled right away; otherwise its worker picks the
+    flag up on its next poll.
+    """
+    analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
+    if analysis.accuracy_score is not None:
+        return JsonResponse({'status': 'finished', 'error': 'Analysis is not running.'}, status=409)
+    AudioAnalysis.objects.filter(id=analysis_id).update(cancel_requested=True)
+    # Not claimed by a worker yet: fail it straight away
+    if AudioAnalysis.objects.filter(id=analysis_id, job_status='queued').update(
+            job_status='failed', accuracy_score=-1, failure_reason='cancelled'):
+        return JsonResponse({'status': 'cancelled'})
+    signalled = cancel_running_job(analysis_id)
+    logger.info(f"Cancel requested for analysis {analysis_id} (signalled running job: {signalled})")
+    return JsonResponse({'status': 'cancelling'})
+
+@require_POST
+def reanalyze_analysis(request, analysis_id):
+    """
+    Queue a new analysis of the same script and take, optionally with another
+    analysis_mode or engine. The files are shared through the media store, so
+    nothing is uploaded or copied; once they have been evicted they have to
+    be uploaded again.
+    """
+    analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
+    mode = request.POST.get('analysis_mode', analysis.analysis_mode)
+    engine = request.POST.get('engine', analysis.engine)
+    if mode not in dict(ANALYSIS_MODE_CHOICES) or engine not in dict(selectable_engine_choices()):
+        return JsonResponse({'error': 'Unknown analysis_mode or engine.'}, status=400)
+    for field in (analysis.script_file, analysis.audio_file):
+        if not field or not field.storage.exists(field.name):
+            return JsonResponse({'error': 'The files of this analysis are no longer stored; upload them again.'},
+                                status=410)
+    rerun = AudioAnalysis.objects.create(
+        title=analysis.title,
+        script_file=analysis.script_file.name,
+        audio_file=analysis.audio_file.name,
+        script=analysis.script,
+        user=analysis.user,
+        analysis_mode=mode,
+        engine=engine,
+    )
+    enqueue_analyses([rerun])
+    return JsonResponse({'status': 'queued', 'analysis_id': rerun.id})
+
+def next_error(request, analysis_id):
+    """
+    The first wrong, missing or extra word starting at or after ?after= seconds,
+    with its time and the word-by-word page that lists it
+    """
+    analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
+    try:
+        after_ms = max(0, round(float(request.GET.get('after', 0)) * 1000))
+    except (ValueError, OverflowError):
+        return JsonResponse({'error': 'after must be a number of seconds'}, status=400)
+    error = analysis.word_comparisons.filter(
+        error_type__in=['wrong', 'missing', 'extra'], start_ms__gte=after_ms
+    ).order_by('start_ms', 'word_index').first()
+    if error is None:
+        return JsonResponse({'found': False})
+    position = analysis.word_comparisons.filter(word_index__lt=error.word_index).count()
+    return JsonResponse({
+        'found': True,
+        'word_index': error.word_index,
+        'error_type': error.error_type,
+        'script_word': error.script_word,
+        'audio_word': error.audio_word,
+        'start': error.start_time,
+        'end': error.end_time,
+        'page': position // WORDS_PER_PAGE + 1,
+    })
+
+def parse_byte_range(header, size):
+    """
+    (first, last) byte offsets asked for by a single-range Range header, None
+    to send the whole file, or False if the range lies outside it
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            first, last = max(0, size - int(last)), size - 1
+        else:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        return False
+    return first, last
+
+def ranged_file_response(request, path, content_type):
+    """
+    Serve a file with HTTP Range support, so audio players seek by fetching
+    only the bytes they play
+    """
+    size = os.path.getsize(path)
+    byte_range = parse_byte_range(request.headers.get('Range'), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        first, last = byte_range
+
+        def read_range(chunk_size=64 * 1024):
+            with open(path, 'rb') as fh:
+                fh.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = fh.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        response = StreamingHttpResponse(read_range(), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = str(last - first + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+def ranged_bytes_response(request, data, content_type):
+    """Serve bytes held in memory with HTTP Range support"""
+    size = len(data)
+    byte_range = parse_byte_range(request.headers.get('Range'), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = HttpResponse(data, content_type=content_type)
+    else:
+        first, last = byte_range
+        response = HttpResponse(data[first:last + 1], status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+def canonical_audio_name(analysis):
+    if not analysis.canonical_audio or not review_store().exists(analysis.canonical_audio.name):
+        raise Http404('No audio is kept for this analysis')
+    return analysis.canonical_audio.name
+
+def review_media_response(request, name, content_type):
+    """
+    Serve review media with Range support: from local disk, or by redirecting
+    to a presigned URL, where the object store answers Range and
+    conditional requests itself
+    """
+    review = review_store()
+    if not review.local:
+        return redirect(review.url(name))
+    return ranged_file_response(request, review.path(name), content_type)
+
+def analysis_audio(request, analysis_id):
+    """The take's canonical audio (16 kHz mono WAV), seekable with Range requests"""
+    analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
+    name = canonical_audio_name(analysis)
+    touch_media(analysis)
+    return review_media_response(request, name, 'audio/wav')
+
+def audio_clip(request, analysis_id):
+    """
+    WAV clip around a word (?word=<word_index>) or paragraph
+    (?paragraph=<paragraph_index>), padded by ?padding= seconds on each side
+    (default CLIP_PADDING_SECONDS). Clips around errors were cut at ingest
+    and are served from the take's clip directory; any other clip is cut
+    from the canonical audio with a ranged read and served without being
+    stored, so a GET never writes to the review store.
+    """
+    analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
+    canonical = canonical_audio_name(analysis)
+    try:
+        padding_ms = seconds_to_ms(float(request.GET.get('padding', settings.CLIP_PADDING_SECONDS)))
+        if 'word' in request.GET:
+            word = analysis.word_comparisons.filter(word_index=int(request.GET['word'])).first()
+            if word is None:
+                raise Http404('No such word')
+            start_ms, end_ms = word.start_ms, word.end_ms
+        elif 'paragraph' in request.GET:
+            paragraph = analysis.paragraph_comparisons.filter(paragraph_index=int(request.GET['paragraph'])).first()
+            if paragraph is None:
+                raise Http404('No such paragraph')
+            start_ms, end_ms = seconds_to_ms(paragraph.start_time), seconds_to_ms(paragraph.end_time)
+        else:
+            return JsonResponse({'error': 'pass word or paragraph'}, status=400)
+    except (ValueError, OverflowError):
+        return JsonResponse({'error': 'word, paragraph and padding must be numbers'}, status=400)
+    if start_ms is None:
+        raise Http404('The word or paragraph has no time in the audio')
+    review = review_store()
+    frames = canonical_frames(review.size(canonical))
+    start_ms, end_ms = clip_bounds(start_ms, end_ms, padding_ms, seconds_to_ms(settings.CLIP_MAX_SECONDS),
+                                   frames_to_ms(frames))
+    name = clip_path(clip_dir(analysis), start_ms, end_ms)
+    touch_media(analysis)
+    if review.exists(name):
+        response = review_media_response(request, name, 'audio/wav')
+    else:
+        data = clip_bytes(lambda first, last: review.read_range(canonical, first, last), frames, start_ms, end_ms)
+        response = ranged_bytes_response(request, data, 'audio/wav')
+    # The same word or paragraph always resolves to the same clip
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+def waveform_peaks(request, analysis_id):
+    """
+    The take's waveform for a zoom of ?samples_per_pixel= (default the finest
+    level): the nearest stored level at or below it, as an audiowaveform .dat
+    file of 8-bit min/max pairs
+    """
+    analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
+    try:
+        samples_per_pixel = int(request.GET.get('samples_per_pixel', PEAK_BASE_SAMPLES_PER_PIXEL))
+    except ValueError:
+        return JsonResponse({'error': 'samples_per_pixel must be a whole number'}, status=400)
+    review = review_store()
+    name = peaks_for_zoom(peaks_dir(analysis), samples_per_pixel)
+    if not review.exists(name):
+        raise Http404('No waveform is stored for this analysis')
+    touch_media(analysis)
+    if not review.local:
+        # The object store sends its own ETag
+        return redirect(review.url(name))
+    path = review.path(name)
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/octet-stream')
+    # Levels are only rewritten if the take is analysed again, which the
+    # ETag catches
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
 def download_results(request, analysis_id):
     """Download analysis results as CSV"""
     analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
@@ -259,7 +403,8 @@ def download_results(request, analysis_id):
     response['Content-Disposition'] = f'attachment; filename="analysis_{analysis_id}.csv"'
     
     writer = csv.writer(response)
-    writer.writerow(['Word Index', 'Script Word', 'Audio Word', 'Error Type', 'Similarity Score', 'Is Correct'])
+    writer.writerow(['Word Index', 'Script Word', 'Audio Word', 'Error Type', 'Similarity Score', 'Is Correct',
+                     'Start', 'End'])
     
     for comparison in analysis.word_comparisons.all():
         writer.writerow([
@@ -268,7 +413,9 @@ def download_results(request, analysis_id):
             comparison.audio_word,
             comparison.error_type,
             comparison.similarity_score,
-            comparison.is_correct
+            comparison.is_correct,
+            comparison.start_time,
+            comparison.end_time
         ])
     
     return response
@@ -343,38 +490,33 @@ def download_transcript_docx(request, analysis_id):
         return redirect('audio_checker:analysis_detail', analysis_id=analysis_id)
 
 def transcript_segments_view(request, analysis_id):
+    """
+    The transcript segments stored with the analysis. Transcribing belongs to
+    the workers, so missing segments are not regenerated here; re-analyzing
+    (reanalyze_analysis) queues a job that stores them.
+    """
     import json
-    from .services import AudioAnalyzer
     analysis = get_object_or_404(AudioAnalysis, id=analysis_id)
-    result = None
     segments = []
     warning = None
     
-    # First try to get segments from AnalysisResult
     try:
         result = analysis.detailed_result
-        if hasattr(result, 'segments') and result.segments:
+        if result.segments:
             segments = result.segments
             if isinstance(segments, str):
                 segments = json.loads(segments)
-    except Exception as e:
+    except AnalysisResult.DoesNotExist:
         pass
     
-    # Fallback: if segments are missing, try to re-run transcription
     if not segments:
-        try:
-            # Check if audio file exists
-            if not analysis.audio_file or not os.path.exists(analysis.audio_file.path):
-                warning = f"Audio file not found: {analysis.audio_file.name if analysis.audio_file else 'No file'}. Cannot regenerate segments."
-            else:
-                analyzer = AudioAnalyzer()
-                audio_path = analysis.audio_file.path
-                _, _, segments = analyzer.transcribe_audio(audio_path)
-                warning = "Segments were missing and have been regenerated. This may take extra time."
-        except Exception as e:
-            warning = f"Could not regenerate segments: {e}"
+        if analysis.job_status in ('queued', 'running'):
+            warning = "The analysis is still running; segments appear once it finishes."
+        elif not analysis.audio_file or not analysis.audio_file.storage.exists(analysis.audio_file.name):
+            warning = "No segments were stored and the audio is no longer kept. Upload it again to analyze it."
+        else:
+            warning = "No segments were stored for this analysis. Re-analyze it to regenerate them."
     
-    print("Segments in view:", segments)
     context = {
         'analysis': analysis,
         'segments': segments,
@@ -382,18 +524,6 @@ def transcript_segments_view(request, analysis_id):
     }
     return render(request, 'audio_checker/transcript_segments.html', context)
 
-def cleanup_analysis_files(analysis):
-    """Clean up uploaded files after analysis is complete"""
-    try:
-        if analysis.script_file and os.path.exists(analysis.script_file.path):
-            os.remove(analysis.script_file.path)
-        if analysis.audio_file and os.path.exists(analysis.audio_file.path):
-            os.remove(analysis.audio_file.path)
-        logger.info(f"Cleaned up files for analysis {analysis.id}")
-    except Exception as e:
-        logger.error(f"Error cleaning up files for analysis {analysis.id}: {e}")
-
-# New batch upload views
 def batch_upload(request):
     """Handle batch upload of multiple script-audio pairs"""
     import logging
@@ -419,6 +549,7 @@ def batch_upload(request):
             print(f"files_data raw: {files_data}")
             logger.info(f'files_data raw: {files_data}')
             if files_data:
+                created_analyses = []
                 try:
                     files_list = json.loads(files_data)
                     print(f"files_list parsed: {files_list}")
@@ -446,17 +577,13 @@ def batch_upload(request):
                                         script_file=script_file,
                                         audio_file=audio_file,
                                         user=request.user if request.user.is_authenticated else None,
-                                        batch=batch
+                                        batch=batch,
+                                        analysis_mode=batch.analysis_mode,
+                                        engine=batch.engine
                                     )
                                     print(f"Created AudioAnalysis: {analysis}")
                                     logger.info(f'Created AudioAnalysis: {analysis}')
-                                    
-                                    # Start analysis in background
-                                    thread = threading.Thread(target=run_analysis_with_timeout, args=(analysis.id,))
-                                    thread.daemon = True
-                                    thread.start()
-                                    print(f"Started analysis thread for {analysis.id}")
-                                    logger.info(f'Started analysis thread for {analysis.id}')
+                                    created_analyses.append(analysis)
                                 else:
                                     print(f"Missing files for pair_id={pair_id}")
                                     logger.error(f'Missing files for pair_id={pair_id}')
@@ -465,6 +592,9 @@ def batch_upload(request):
                                 continue
                 except json.JSONDecodeError:
                     logger.error("Invalid JSON in files_data")
+                
+                # Queue analyses for the workers, batching short clips together
+                enqueue_analyses(created_analyses)
             else:
                 logger.error('No files_data found in POST')
             
@@ -0,0 +1,711 @@
+"""
+Durable analysis queue and the workers that drain it.
+
+Analyses are queued in the database (AudioAnalysis.job_status). A worker
+claims one, or a group of short batched clips, by taking a lease. While the
+job process runs, its supervisor renews the lease with a heartbeat. If the
+worker dies, the lease runs out and the reaper puts the analysis back on the
+queue with exponential backoff. An analysis is only marked failed after
+ANALYSIS_MAX_ATTEMPTS attempts. A live job keeps renewing its lease, so the
+reaper never takes it.
+
+Workers run as threads inside the web process (ANALYSIS_EMBEDDED_WORKERS) or
+as separate processes started with `python manage.py run_analysis_worker`.
+A process' workers only start claiming once its job processes are warm
+(PRELOAD_MODELS loaded and warmed up), so queued work goes to the workers that
+can start on it at once. WORKER_READY_FILE exposes the same signal to process
+supervisors.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cancellation import AnalysisCancelled
+from .db import serialized_write
+from .inference import threads_per_worker
+from .jobs import (
+    AnalysisJob, JobTimeout, LeaseLost, analyze_job, batch_job, configure_job_processes, preloaded_models
+)
+from .models import AudioAnalysis, AnalysisResult, ParagraphComparison, Script, WordComparison
+from .services import AudioAnalyzer, BATCH_TRANSCRIBE_SIZE
+from .storage import content_key, media_source, prune_media_store, prune_unused_scripts, review_store
+
+logger = logging.getLogger(__name__)
+
+# How long an idle worker sleeps before looking for queued work again
+WORKER_POLL_SECONDS = 2.0
+# How often each worker looks for expired leases
+REAP_INTERVAL_SECONDS = 30.0
+# Upper bound for the retry delay
+MAX_BACKOFF_SECONDS = 3600
+# Uploads up to this size may be short clips and are queued in batch groups;
+# 30s of 48kHz 16-bit stereo WAV is about 5.5MB
+BATCH_CANDIDATE_MAX_BYTES = 6 * 1024 * 1024
+
+# Set when work is queued so idle embedded workers wake up immediately
+work_available = threading.Event()
+# Set once this process' job processes are warm; workers do not claim before
+workers_ready = threading.Event()
+# When this process' workers last pruned the media store
+last_media_prune = 0.0
+media_prune_lock = threading.Lock()
+embedded_workers = []
+embedded_workers_lock = threading.Lock()
+
+def choose_model_sizes(analysis):
+    """Pick (model_size, refine_model_size) for an analysis based on file size and mode"""
+    file_size = analysis.audio_file.size / (1024 * 1024)  # MB
+    logger.debug(f'Analysis {analysis.id}: audio file size {file_size:.2f} MB')
+    if file_size > 50:
+        model_size = 'tiny'  # Use tiny model for large files
+    elif file_size > 20:
+        model_size = 'base'  # Use base model for medium files
+    else:
+        model_size = 'small'  # Use small model for small files
+    refine_model_size = None
+    if analysis.analysis_mode == 'cascade':
+        # Fast first pass with tiny, refine error regions with the size-based model
+        refine_model_size = model_size if model_size != 'tiny' else 'base'
+        model_size = 'tiny'
+    return model_size, refine_model_size
+
+def worker_threads():
+    """Torch threads for one analysis job"""
+    return settings.TORCH_THREADS_PER_WORKER or threads_per_worker(settings.ANALYSIS_WORKERS)
+
+def analyzer_kwargs(analysis, model_size, refine_model_size=None):
+    """AudioAnalyzer arguments for the analysis' engine and the deployment's inference settings"""
+    return {
+        'model_size': model_size,
+        'refine_model_size': refine_model_size,
+        'quantize': settings.WHISPER_QUANTIZE_INT8,
+        'engine': analysis.engine or settings.TRANSCRIPTION_ENGINE,
+        'threads': worker_threads(),
+        'model_dir': settings.WHISPER_MODEL_DIR,
+        'compile_mode': settings.WHISPER_COMPILE,
+        'compile_cache_dir': settings.WHISPER_COMPILE_CACHE_DIR,
+        'word_timestamps': settings.WORD_TIMESTAMPS,
+    }
+
+def media_key(analysis):
+    """
+    What an analysis' review media is stored under: the content hash of its
+    take, so analyses of the same take share it (the id for uploads stored
+    before content addressing)
+    """
+    return content_key(analysis.audio_file.name) or str(analysis.id)
+
+def clip_dir(analysis):
+    """Directory, in the review store, of an analysis' cached review clips"""
+    return f'clips/{media_key(analysis)}'
+
+def peaks_dir(analysis):
+    """Directory, in the review store, of an analysis' waveform peak levels"""
+    return f'peaks/{media_key(analysis)}'
+
+def media_options(analysis):
+    """
+    Where the job process keeps an analysis' review media (see
+    media.store_take_media): straight into the filesystem store, or into a
+    staging directory that staged_review_media() uploads to object storage
+    """
+    review = review_store()
+    canonical_audio = f'canonical/{media_key(analysis)}.wav'
+    return {
+        'root': review.location if review.local else tempfile.mkdtemp(prefix='review-media-'),
+        'stored': not review.local and review.exists(canonical_audio),
+        'canonical_audio': canonical_audio,
+        'clip_dir': clip_dir(analysis),
+        'peaks_dir': peaks_dir(analysis),
+        'padding_ms': round(settings.CLIP_PADDING_SECONDS * 1000),
+        'max_ms': round(settings.CLIP_MAX_SECONDS * 1000),
+        'precut_limit': settings.CLIP_PRECUT_LIMIT,
+    }
+
+@contextmanager
+def staged_review_media(analyses):
+    """
+    media_options() for each analysis. With object storage, the media the job
+    staged is uploaded when the block succeeds, and the staging directories
+    are removed either way.
+    """
+    review = review_store()
+    options = [media_options(analysis) for analysis in analyses]
+    try:
+        yield options
+        if not review.local:
+            for media in options:
+                names = []
+                for dirpath, _, files in os.walk(media['root']):
+                    names += [os.path.relpath(os.path.join(dirpath, f), media['root']).replace(os.sep, '/')
+                              for f in files]
+                # The canonical audio goes last: its presence marks the take's media complete
+                for name in sorted(names, key=lambda name: name == media['canonical_audio']):
+                    with open(os.path.join(media['root'], name), 'rb') as fh:
+                        review.save(name, File(fh))
+    finally:
+        if not review.local:
+            for media in options:
+                shutil.rmtree(media['root'], ignore_errors=True)
+
+def cancel_requested(analysis_ids, every=False):
+    """Whether any (or, with every=True, all) of the analyses have a pending cancel request"""
+    flagged = AudioAnalysis.objects.filter(id__in=analysis_ids, cancel_requested=True).count()
+    return flagged == len(analysis_ids) if every else flagged > 0
+
+@serialized_write
+def mark_analysis_failed(analysis, reason, error=''):
+    """Record a stopped analysis; reason is 'error', 'timeout' or 'cancelled'"""
+    analysis.accuracy_score = -1  # Use -1 to indicate failure
+    analysis.failure_reason = reason
+    analysis.job_status = 'failed'
+    analysis.lease_expires_at = None
+    analysis.last_error = error or analysis.last_error
+    analysis.save(update_fields=['accuracy_score', 'failure_reason', 'job_status', 'lease_expires_at',
+                                 'last_error', 'updated_at'])
+
+def retry_backoff(attempts):
+    """Seconds to wait before attempt number attempts + 1"""
+    return min(settings.ANALYSIS_RETRY_BACKOFF * 2 ** max(0, attempts - 1), MAX_BACKOFF_SECONDS)
+
+@serialized_write
+def retry_or_fail(analysis, error, worker_id=None):
+    """
+    Put an analysis whose attempt failed back on the queue with exponential
+    backoff, or mark it failed once it has used ANALYSIS_MAX_ATTEMPTS.
+    With worker_id, only touch the row if that worker still holds its lease.
+    """
+    if analysis.attempts >= settings.ANALYSIS_MAX_ATTEMPTS:
+        logger.error(f"Analysis {analysis.id} failed after {analysis.attempts} attempts: {error}")
+        mark_analysis_failed(analysis, 'error', str(error))
+        return False
+    delay = retry_backoff(analysis.attempts)
+    rows = AudioAnalysis.objects.filter(id=analysis.id, job_status='running')
+    if worker_id is not None:
+        rows = rows.filter(worker_id=worker_id)
+    rows.update(
+        job_status='queued',
+        worker_id='',
+        lease_expires_at=None,
+        next_attempt_at=timezone.now() + timedelta(seconds=delay),
+        last_error=str(error)[:1000],
+        # A failed batch falls back to running its clips one by one
+        job_group='',
+    )
+    logger.warning(f"Analysis {analysis.id} attempt {analysis.attempts} failed ({error}); retrying in {delay:.0f}s")
+    return True
+
+def seconds_to_ms(seconds):
+    return max(0, round(seconds * 1000)) if seconds is not None else None
+
+@serialized_write
+@transaction.atomic
+def save_analysis_results(analysis, result):
+    """
+    Persist an analysis result dict onto the analysis and its related rows,
+    in one transaction so the writer holds the lock once per analysis
+    """
+    analysis_id = analysis.id
+    # Update analysis with results
+    analysis.accuracy_score = result['statistics']['accuracy_score']
+    analysis.total_words = result['statistics']['total_words']
+    analysis.correct_words = result['statistics']['correct_words']
+    analysis.missing_words = result['statistics']['missing_words']
+    analysis.wrong_words = result['statistics']['wrong_words']
+    analysis.job_status = 'done'
+    analysis.lease_expires_at = None
+    if result.get('canonical_audio'):
+        analysis.canonical_audio.name = result['canonical_audio']
+    analysis.save()
+    logger.debug(f'Analysis {analysis_id} updated with results')
+    
+    # Create detailed result with better error handling
+    try:
+        analysis_result, created = AnalysisResult.objects.get_or_create(
+            analysis=analysis,
+            defaults={
+                'transcribed_text': result['transcribed_text'],
+                'processing_time': result['processing_time'],
+                'whisper_model_used': result['model_used'],
+                'segments': result.get('segments', None),
+                'metrics': result.get('metrics', None),
+            }
+        )
+
+        if not created:
+            analysis_result.transcribed_text = result['transcribed_text']
+            analysis_result.processing_time = result['processing_time']
+            analysis_result.whisper_model_used = result['model_used']
+            analysis_result.segments = result.get('segments', None)
+            analysis_result.metrics = result.get('metrics', None)
+            analysis_result.save()
+        logger.debug(f'AnalysisResult saved for analysis {analysis_id}')
+    except Exception as e:
+        logger.error(f"Failed to save AnalysisResult for analysis {analysis_id}: {e}")
+        raise Exception(f"Failed to save analysis results: {e}")
+    
+    # Create word comparisons
+    WordComparison.objects.filter(analysis=analysis).delete()
+    WordComparison.objects.bulk_create([
+        WordComparison(
+            analysis=analysis,
+            script_word=comp['script_word'],
+            audio_word=comp['audio_word'],
+            word_index=comp['word_index'],
+            is_correct=comp['is_correct'],
+            similarity_score=comp['similarity_score'],
+            error_type=comp['error_type'],
+            start_ms=seconds_to_ms(comp.get('start')),
+            end_ms=seconds_to_ms(comp.get('end'))
+        )
+        for comp in result['comparisons']
+    ], batch_size=500)
+    logger.debug(f'Word comparisons created for analysis {analysis_id}')
+    save_paragraph_comparisons(analysis, result.get('paragraphs', []))
+    
+    # Verify AnalysisResult was saved
+    try:
+        verification_result = AnalysisResult.objects.get(analysis=analysis)
+        if not verification_result.transcribed_text or not verification_result.get_script_text():
+            logger.error(f"AnalysisResult for analysis {analysis_id} is incomplete")
+            raise Exception("AnalysisResult is incomplete")
+        logger.debug(f"AnalysisResult verification passed for analysis {analysis_id}")
+    except AnalysisResult.DoesNotExist:
+        logger.error(f"AnalysisResult not found for analysis {analysis_id}")
+        raise Exception("AnalysisResult not found")
+
+@serialized_write
+def save_paragraph_comparisons(analysis, paragraphs):
+    """Replace the analysis' paragraph-mode rows with the compare_paragraphs() results"""
+    ParagraphComparison.objects.filter(analysis=analysis).delete()
+    ParagraphComparison.objects.bulk_create([
+        ParagraphComparison(
+            analysis=analysis,
+            paragraph_index=para['index'],
+            script_paragraph=para['script_paragraph'],
+            audio_paragraph=para['audio_paragraph'],
+            similarity=para['similarity'],
+            status=para['status'],
+            start_time=para['start'],
+            end_time=para['end']
+        )
+        for para in paragraphs
+    ], batch_size=500)
+
+def check_analysis_files(analysis):
+    """
+    Return the (script, audio) sources the job reads (see
+    storage.media_source), raising FileNotFoundError if either is gone
+    """
+    for label, field in (('Script', analysis.script_file), ('Audio', analysis.audio_file)):
+        if not field.storage.exists(field.name):
+            logger.error(f'{label} file not found: {field.name}')
+            raise FileNotFoundError(f"{label} file not found: {field.name}")
+    logger.debug(f'Script: {analysis.script_file.name}, Audio: {analysis.audio_file.name}')
+    return media_source(analysis.script_file), media_source(analysis.audio_file)
+
+
+def script_hash(field_file):
+    """Content hash of a stored script, read back for files stored before uploads were hashed"""
+    key = content_key(field_file.name)
+    if key:
+        return key
+    digest = hashlib.sha256()
+    with field_file.open('rb') as fh:
+        for chunk in fh.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@serialized_write
+def register_script(analysis, content_hash, parsed):
+    """Store a parsed script (unless another worker just did) and link the analysis to it"""
+    if parsed is not None:
+        script, _ = Script.objects.get_or_create(content_hash=content_hash, defaults={
+            'text': parsed.text,
+            'paragraphs': parsed.paragraphs,
+            'vocabulary': parsed.vocabulary,
+            'word_ids': parsed.word_id_bytes(),
+            'word_count': len(parsed),
+        })
+    else:
+        script = Script.objects.get(content_hash=content_hash)
+    AudioAnalysis.objects.filter(id=analysis.id).update(script=script)
+    analysis.script = script
+    return script
+
+def script_for_analysis(analysis, script_source):
+    """
+    The analysis' Script from the registry. A script file seen for the first
+    time is parsed here, once; later analyses of the same file reuse it.
+    """
+    if analysis.script_id:
+        return analysis.script
+    content_hash = script_hash(analysis.script_file)
+    parsed = None
+    if not Script.objects.filter(content_hash=content_hash).exists():
+        parsed = AudioAnalyzer.parse_script(script_source)
+    return register_script(analysis, content_hash, parsed)
+
+def prune_media_if_due():
+    """
+    Run the media store's retention pass (storage.prune_media_store, then
+    storage.prune_unused_scripts) if this process has not run it in the last
+    MEDIA_PRUNE_INTERVAL_SECONDS
+    """
+    global last_media_prune
+    if not settings.MEDIA_PRUNE_INTERVAL_SECONDS:
+        return
+    with media_prune_lock:
+        if time.time() - last_media_prune < settings.MEDIA_PRUNE_INTERVAL_SECONDS:
+            return
+        last_media_prune = time.time()
+    evicted, freed = prune_media_store()
+    if evicted:
+        logger.info(f"Media store: evicted {evicted} files, freed {freed / (1024 * 1024):.1f}MB")
+    prune_unused_scripts()
+
+@serialized_write
+def renew_lease(analysis_ids, worker_id):
+    """Heartbeat: extend the lease on the worker's analyses. False if it lost any of them."""
+    now = timezone.now()
+    renewed = AudioAnalysis.objects.filter(
+        id__in=analysis_ids, job_status='running', worker_id=worker_id
+    ).update(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=settings.ANALYSIS_LEASE_SECONDS))
+    return renewed == len(analysis_ids)
+
+def start_job(analysis_ids, target, args, worker_id, every=False):
+    """Run a job process for the claimed analyses, heartbeating their leases while it runs"""
+    job = AnalysisJob(
+        analysis_ids,
+        target,
+        args,
+        budget=settings.ANALYSIS_TIME_BUDGET,
+        threads=worker_threads(),
+        is_cancel_requested=lambda: cancel_requested(analysis_ids, every=every),
+        heartbeat=lambda: renew_lease(analysis_ids, worker_id),
+        heartbeat_interval=settings.ANALYSIS_LEASE_SECONDS / 4
+    )
+    return job.run()
+
+def run_analysis_with_timeout(analysis_id, worker_id):
+    """
+    Run one claimed analysis with timeout and better error handling.
+    The model work runs in a job process that is cancelled on request and
+    killed if it overruns ANALYSIS_TIME_BUDGET; other failures are retried.
+    """
+    logger.debug(f'Starting analysis {analysis_id}')
+    try:
+        analysis = AudioAnalysis.objects.get(id=analysis_id)
+        logger.debug(f'Loaded analysis: {analysis} (attempt {analysis.attempts})')
+        if analysis.cancel_requested:
+            logger.info(f'Analysis {analysis_id} was cancelled before it started')
+            mark_analysis_failed(analysis, 'cancelled')
+            return
+        
+        # Choose model size based on file size
+        model_size, refine_model_size = choose_model_sizes(analysis)
+        logger.debug(f'Using model size: {model_size}, refine model: {refine_model_size}')
+        
+        try:
+            script_path, audio_path = check_analysis_files(analysis)
+            script = script_for_analysis(analysis, script_path)
+            with staged_review_media([analysis]) as (media,):
+                result = start_job(
+                    [analysis_id],
+                    analyze_job,
+                    (analyzer_kwargs(analysis, model_size, refine_model_size), script.parsed(), audio_path,
+                     analysis.analysis_mode, media),
+                    worker_id
+                )
+            logger.info(f"Analysis {analysis_id} finished: {result['statistics']['accuracy_score']:.1f}% accuracy")
+            
+            save_analysis_results(analysis, result)
+        except AnalysisCancelled:
+            logger.info(f"Analysis {analysis_id} cancelled")
+            mark_analysis_failed(analysis, 'cancelled')
+        except JobTimeout as e:
+            logger.error(f"Analysis {analysis_id} timed out: {e}")
+            mark_analysis_failed(analysis, 'timeout', str(e))
+        except LeaseLost:
+            logger.warning(f"Lost the lease on analysis {analysis_id}; leaving it to the reaper")
+        except FileNotFoundError as e:
+            # Retrying cannot bring back deleted uploads
+            logger.error(f"Error in analysis {analysis_id}: {e}")
+            mark_analysis_failed(analysis, 'error', str(e))
+        except Exception as e:
+            logger.error(f"Error in analysis {analysis_id}: {e}")
+            retry_or_fail(analysis, e, worker_id)
+        
+    except AudioAnalysis.DoesNotExist:
+        logger.error(f"Analysis {analysis_id} not found")
+    except Exception as e:
+        logger.error(f"Critical error in analysis {analysis_id}: {e}")
+
+@serialized_write
+def release_from_group(analysis, worker_id):
+    """Put a claimed clip back on the queue to run on its own, without counting the attempt"""
+    AudioAnalysis.objects.filter(id=analysis.id, job_status='running', worker_id=worker_id).update(
+        job_status='queued',
+        worker_id='',
+        lease_expires_at=None,
+        job_group='',
+        attempts=F('attempts') - 1,
+    )
+    logger.info(f"Analysis {analysis.id} is not a short clip; queued to run on its own")
+    work_available.set()
+
+def run_batched_analyses(analysis_ids, worker_id):
+    """
+    Run a claimed group of short clips: their encoder and greedy decoder
+    passes run as one stacked batch, then each clip is aligned and saved to
+    its own AudioAnalysis. If the batched job fails, the clips are requeued
+    to run one by one.
+    """
+    analyses = list(AudioAnalysis.objects.filter(id__in=analysis_ids).order_by('id'))
+    try:
+        sources = [check_analysis_files(analysis) for analysis in analyses]
+    except FileNotFoundError as e:
+        logger.error(f"Batched analyses {analysis_ids}: {e}; requeueing clips individually")
+        for analysis in analyses:
+            retry_or_fail(analysis, e, worker_id)
+        return
+    ids = [analysis.id for analysis in analyses]
+    model_size, _ = choose_model_sizes(analyses[0])
+    logger.info(f'Starting batched transcription for IDs {ids} with {model_size}')
+    try:
+        pairs = []
+        # Clips of the same script share one ParsedScript, which is sent to
+        # the job process once
+        parsed = {}
+        for analysis, (script_path, audio_path) in zip(analyses, sources):
+            script = script_for_analysis(analysis, script_path)
+            if script.id not in parsed:
+                parsed[script.id] = script.parsed()
+            pairs.append((parsed[script.id], audio_path))
+        # The batch is shared, so it only stops once every clip is cancelled
+        with staged_review_media(analyses) as media:
+            results = start_job(ids, batch_job, (analyzer_kwargs(analyses[0], model_size), pairs, media), worker_id,
+                                every=True)
+    except AnalysisCancelled:
+        for analysis in analyses:
+            mark_analysis_failed(analysis, 'cancelled')
+        return
+    except JobTimeout as e:
+        logger.error(f"Batched analyses {ids} timed out: {e}")
+        for analysis in analyses:
+            mark_analysis_failed(analysis, 'timeout', str(e))
+        return
+    except LeaseLost:
+        logger.warning(f"Lost the lease on batched analyses {ids}; leaving them to the reaper")
+        return
+    except Exception as e:
+        logger.error(f"Batched transcription failed, requeueing clips individually: {e}")
+        for analysis in analyses:
+            retry_or_fail(analysis, e, worker_id)
+        return
+    for analysis, result in zip(analyses, results):
+        analysis.refresh_from_db(fields=['cancel_requested'])
+        if analysis.cancel_requested:
+            mark_analysis_failed(analysis, 'cancelled')
+            continue
+        if result is None:
+            # Longer than one window; the group was formed by upload size
+            release_from_group(analysis, worker_id)
+            continue
+        try:
+            if isinstance(result, str):
+                raise Exception(result)
+            save_analysis_results(analysis, result)
+        except Exception as e:
+            logger.error(f"Error in batched analysis {analysis.id}: {e}")
+            retry_or_fail(analysis, e, worker_id)
+
+def enqueue_analyses(analyses):
+    """
+    Queue new analyses for the workers. Standard-mode uploads small enough to
+    be short clips are grouped by engine and model size into groups of up to
+    BATCH_TRANSCRIBE_SIZE that a worker claims and transcribes together;
+    everything else runs on its own. Durations are not probed here, so the
+    web process never decodes audio: the batch job checks them and the
+    worker requeues clips that are too long (see jobs.batch_job).
+    """
+    short_clips = {}
+    for analysis in analyses:
+        if analysis.analysis_mode == 'standard':
+            if analysis.audio_file.size <= BATCH_CANDIDATE_MAX_BYTES:
+                model_size, _ = choose_model_sizes(analysis)
+                engine = analysis.engine or settings.TRANSCRIPTION_ENGINE
+                short_clips.setdefault((engine, model_size), []).append(analysis.id)
+    for (engine, model_size), ids in short_clips.items():
+        for i in range(0, len(ids), BATCH_TRANSCRIBE_SIZE):
+            chunk = ids[i:i + BATCH_TRANSCRIBE_SIZE]
+            if len(chunk) > 1:
+                AudioAnalysis.objects.filter(id__in=chunk).update(job_group=f'{chunk[0]}-{engine}-{model_size}')
+                logger.info(f'Queued batched analyses {chunk}')
+    # Rows are created as queued; wake the workers
+    work_available.set()
+    ensure_embedded_workers()
+
+def skip_locked(queryset):
+    """
+    Lock the selected rows, skipping rows another worker has locked, on
+    databases that support it (PostgreSQL). Several worker hosts can then
+    claim jobs at the same time without blocking on or double-claiming the
+    same row. Elsewhere the conditional updates below keep claims exclusive.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+    return queryset
+
+@serialized_write
+def claim_next_job(worker_id):
+    """
+    Lease the oldest runnable queued analysis, together with the rest of its
+    batch group. Returns the claimed ids (empty if there is nothing to do).
+    The conditional update means two workers cannot claim the same row.
+    """
+    now = timezone.now()
+    runnable = skip_locked(AudioAnalysis.objects.filter(job_status='queued').filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    ))
+    with transaction.atomic():
+        candidate = runnable.order_by('id').values('id', 'job_group').first()
+        if candidate is None:
+            return []
+        if candidate['job_group']:
+            ids = list(runnable.filter(job_group=candidate['job_group']).values_list('id', flat=True))
+        else:
+            ids = [candidate['id']]
+        claimed = AudioAnalysis.objects.filter(id__in=ids, job_status='queued').update(
+            job_status='running',
+            worker_id=worker_id,
+            attempts=F('attempts') + 1,
+            heartbeat_at=now,
+            lease_expires_at=now + timedelta(seconds=settings.ANALYSIS_LEASE_SECONDS),
+        )
+    if claimed != len(ids):
+        # Another worker raced us for part of the group; run what we hold
+        ids = list(AudioAnalysis.objects.filter(
+            id__in=ids, job_status='running', worker_id=worker_id
+        ).values_list('id', flat=True))
+    return ids
+
+@serialized_write
+def reap_expired_leases():
+    """Requeue (or fail, after ANALYSIS_MAX_ATTEMPTS) analyses whose worker stopped heartbeating"""
+    reaped = 0
+    with transaction.atomic():
+        # Reapers on other hosts skip the rows this one is handling
+        expired = skip_locked(AudioAnalysis.objects.filter(job_status='running', lease_expires_at__lt=timezone.now()))
+        for analysis in expired:
+            logger.warning(f"Lease on analysis {analysis.id} held by {analysis.worker_id} expired")
+            retry_or_fail(analysis, f"worker {analysis.worker_id} stopped heartbeating", analysis.worker_id)
+            reaped += 1
+    return reaped
+
+def run_worker(worker_id, stop_event=None):
+    """Claim and run queued analyses until stop_event is set"""
+    stop_event = stop_event or threading.Event()
+    last_reap = 0.0
+    while not workers_ready.wait(WORKER_POLL_SECONDS):
+        if stop_event.is_set():
+            return
+    logger.info(f"Analysis worker {worker_id} started")
+    while not stop_event.is_set():
+        try:
+            if time.time() - last_reap >= REAP_INTERVAL_SECONDS:
+                reap_expired_leases()
+                last_reap = time.time()
+                prune_media_if_due()
+            analysis_ids = claim_next_job(worker_id)
+            if not analysis_ids:
+                work_available.wait(WORKER_POLL_SECONDS)
+                work_available.clear()
+                continue
+            if len(analysis_ids) == 1:
+                run_analysis_with_timeout(analysis_ids[0], worker_id)
+            else:
+                run_batched_analyses(analysis_ids, worker_id)
+        except Exception as e:
+            logger.exception(f"Analysis worker {worker_id} error: {e}")
+            stop_event.wait(WORKER_POLL_SECONDS)
+        finally:
+            close_old_connections()
+    logger.info(f"Analysis worker {worker_id} stopped")
+
+def worker_name(index):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+def mark_workers_ready(models):
+    """Let this process' workers claim jobs and write WORKER_READY_FILE"""
+    workers_ready.set()
+    if settings.WORKER_READY_FILE:
+        with open(settings.WORKER_READY_FILE, 'w') as fh:
+            json.dump({'pid': os.getpid(), 'models': models, 'ready_at': timezone.now().isoformat()}, fh)
+        atexit.register(clear_ready_file)
+
+def clear_ready_file():
+    """Withdraw the readiness signal, e.g. when the worker starts shutting down"""
+    if settings.WORKER_READY_FILE:
+        try:
+            os.remove(settings.WORKER_READY_FILE)
+        except FileNotFoundError:
+            pass
+
+def start_job_processes():
+    """
+    Start the fork server for this process' jobs with PRELOAD_MODELS loaded
+    and warmed up, wait until it is ready, then mark the workers ready
+    """
+    expected = [(size, settings.WHISPER_QUANTIZE_INT8) for size in settings.PRELOAD_MODELS]
+    started = time.time()
+    loaded = []
+    try:
+        configure_job_processes(
+            expected,
+            warm_up=settings.WORKER_WARMUP,
+            model_dir=settings.WHISPER_MODEL_DIR,
+            compile_mode=settings.WHISPER_COMPILE,
+            compile_cache_dir=settings.WHISPER_COMPILE_CACHE_DIR
+        )
+        if expected:
+            loaded = preloaded_models()
+            missing = [size for size, quantize in expected if (size, quantize) not in loaded]
+            if missing:
+                logger.warning(f"Models {missing} were not preloaded; jobs will load them themselves")
+    except Exception as e:
+        # Workers still run; each job loads its own model
+        logger.exception(f"Could not start warm job processes: {e}")
+    logger.info(f"Job processes ready in {time.time() - started:.1f}s with {len(loaded)} preloaded models")
+    mark_workers_ready([size for size, _ in loaded])
+
+def ensure_embedded_workers():
+    """Start ANALYSIS_WORKERS worker threads in this process (once), if enabled"""
+    if not settings.ANALYSIS_EMBEDDED_WORKERS:
+        return
+    with embedded_workers_lock:
+        if embedded_workers:
+            return
+        # Warm up in the background so the web process starts serving at
+        # once; the workers wait for it before claiming
+        threading.Thread(target=start_job_processes, name='job-process-warmup', daemon=True).start()
+        for index in range(settings.ANALYSIS_WORKERS):
+            thread = threading.Thread(target=run_worker, args=(worker_name(index),), daemon=True)
+            thread.start()
+            embedded_workers.append(thread)
+        logger.info(f"Started {len(embedded_workers)} embedded analysis workers")
@@ -18,4 +18,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audio_detection.settings')
 
-application = get_wsgi_application() 
\ No newline at end of file
+application = get_wsgi_application()
+
+# Drain the analysis queue from this process (see ANALYSIS_EMBEDDED_WORKERS)
+from audio_checker.worker import ensure_embedded_workers
+
+ensure_embedded_workers()
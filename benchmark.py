@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Benchmark transcription configurations.
+
+Usage:
+    python benchmark.py cascade <script.docx> <audio> [--fast tiny] [--large small]
+    python benchmark.py batch <clip.wav> [<clip.wav> ...] [--model small] [--batch-size 16]
+    python benchmark.py quantize <script.docx> <audio> [--model small] [--workers 2]
+    python benchmark.py engines <script.docx> <audio> [--engines whisper faster-whisper] [--model small]
+    python benchmark.py model-load <model_dir> [--models tiny base small] [--repeat 3]
+    python benchmark.py compile [--models tiny base small] [--modes torchscript compile] [--int8]
+    python benchmark.py startup [--repeat 5]
+
+Each scenario prints a table of wall time (and accuracy or throughput) so that
+a configuration can be compared against the path it is meant to replace. Pass
+--output results.json to keep the numbers.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from audio_checker.services import AudioAnalyzer
+
+
+def run_config(label, script_path, audio_path, model_size, refine_model_size=None, mode='standard', quantize=False,
+               engine='whisper'):
+    """Run one analysis and return its cost/accuracy row"""
+    load_start = time.time()
+    analyzer = AudioAnalyzer(model_size=model_size, refine_model_size=refine_model_size, quantize=quantize,
+                             engine=engine)
+    load_time = time.time() - load_start
+    start = time.time()
+    result = analyzer.analyze_audio_accuracy(script_path, audio_path, mode=mode)
+    wall_time = time.time() - start
+    return {
+        'config': label,
+        'model': result['model_used'],
+        'load_time': load_time,
+        'wall_time': wall_time,
+        'accuracy': result['statistics']['accuracy_score'],
+        'wrong_words': result['statistics']['wrong_words'],
+        'missing_words': result['statistics']['missing_words'],
+        'metrics': result.get('metrics'),
+    }
+
+
+def bench_cascade(args):
+    """Compare the cascade against single-model fast and large runs"""
+    return [
+        run_config(f'single-{args.fast}', args.script, args.audio, args.fast),
+        run_config(f'single-{args.large}', args.script, args.audio, args.large),
+        run_config('cascade', args.script, args.audio, args.fast, refine_model_size=args.large, mode='cascade'),
+    ]
+
+
+def bench_quantize(args):
+    """A/B the fp32 path against int8 dynamic quantization with pinned threads"""
+    import torch
+    from audio_checker.inference import configure_threads, threads_per_worker
+    default_threads = torch.get_num_threads()
+    rows = [run_config(f'fp32-{default_threads}t', args.script, args.audio, args.model)]
+    threads = threads_per_worker(args.workers)
+    configure_threads(threads)
+    rows.append(run_config(f'fp32-{threads}t', args.script, args.audio, args.model))
+    rows.append(run_config(f'int8-{threads}t', args.script, args.audio, args.model, quantize=True))
+    configure_threads(default_threads)
+    return rows
+
+
+def bench_engines(args):
+    """Run the same analysis on each transcription engine"""
+    return [
+        run_config(engine, args.script, args.audio, args.model, quantize=args.int8, engine=engine)
+        for engine in args.engines
+    ]
+
+
+def bench_batch(args):
+    """Compare one-by-one transcription of short clips against stacked batches"""
+    analyzer = AudioAnalyzer(model_size=args.model)
+    clips = args.clips
+    start = time.time()
+    for path in clips:
+        analyzer.transcribe_audio(path)
+    sequential = time.time() - start
+    rows = [{
+        'config': 'sequential',
+        'model': args.model,
+        'clips': len(clips),
+        'wall_time': sequential,
+        'clips_per_second': len(clips) / sequential if sequential else 0,
+    }]
+    start = time.time()
+    for i in range(0, len(clips), args.batch_size):
+        analyzer.transcribe_batch(clips[i:i + args.batch_size])
+    batched = time.time() - start
+    rows.append({
+        'config': f'batch-{args.batch_size}',
+        'model': args.model,
+        'clips': len(clips),
+        'wall_time': batched,
+        'clips_per_second': len(clips) / batched if batched else 0,
+    })
+    return rows
+
+
+def bench_model_load(args):
+    """Time loading each model from whisper's .pt checkpoint and from its offline bundle"""
+    import whisper
+    from audio_checker.bundles import load_whisper_bundle
+    loaders = [
+        ('checkpoint', lambda size: whisper.load_model(size, device='cpu')),
+        ('bundle', lambda size: load_whisper_bundle(args.model_dir, size, device='cpu')),
+        ('bundle-noverify', lambda size: load_whisper_bundle(args.model_dir, size, verify=False, device='cpu')),
+    ]
+    rows = []
+    for size in args.models:
+        for label, load in loaders:
+            # The first load is the closest to a cold start; the page cache is
+            # warm for the rest (drop it between runs for true cold numbers)
+            times = []
+            for _ in range(args.repeat):
+                start = time.time()
+                model = load(size)
+                times.append(time.time() - start)
+                del model
+            rows.append({'config': label, 'model': size, 'first_load': times[0], 'best_load': min(times)})
+    return rows
+
+
+def bench_compile(args):
+    """Time the encoder over one 30-second window, eager vs each compiled mode, per model size"""
+    import tempfile
+    import torch
+    from audio_checker.engines import load_whisper_model
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix='compile-bench-')
+    rows = []
+    for size in args.models:
+        eager_time = None
+        for mode in [None] + args.modes:
+            model = load_whisper_model(size, args.int8, compile_mode=mode, compile_cache_dir=cache_dir)
+            mel = torch.zeros(1, model.dims.n_mels, 2 * model.dims.n_audio_ctx, device=model.device)
+            with torch.inference_mode():
+                # The first call includes compilation (or loading it from the cache)
+                start = time.time()
+                model.encoder(mel)
+                first_call = time.time() - start
+                start = time.time()
+                for _ in range(args.repeat):
+                    model.encoder(mel)
+                per_window = (time.time() - start) / args.repeat
+            eager_time = eager_time or per_window
+            rows.append({
+                'config': mode or 'eager',
+                'model': size,
+                'first_call': first_call,
+                'per_window': per_window,
+                'speedup': eager_time / per_window if per_window else 0,
+            })
+            del model
+    return rows
+
+
+# Child process for bench_startup: boot Django, import what a web process
+# imports, run the system checks, then report peak RSS and heavy modules loaded
+STARTUP_CHILD = """
+import json, os, resource, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audio_detection.settings')
+import django
+django.setup()
+import audio_checker.admin, audio_checker.views
+{preload}
+from django.core.management import call_command
+call_command('check', verbosity=0)
+print(json.dumps({{
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy': [name for name in ('whisper', 'torch', 'librosa', 'soundfile') if name in sys.modules],
+}}))
+"""
+
+
+def bench_startup(args):
+    """
+    Wall time and peak RSS of a web process boot (django.setup, views, admin,
+    system checks), as it is now and with whisper, torch, librosa and
+    soundfile imported up front as the web process used to
+    """
+    configs = [
+        ('lazy', ''),
+        ('eager', 'import whisper, torch, librosa, soundfile'),
+    ]
+    rows = []
+    for label, preload in configs:
+        times, rss, heavy = [], 0.0, []
+        for _ in range(args.repeat):
+            start = time.time()
+            child = subprocess.run([sys.executable, '-c', STARTUP_CHILD.format(preload=preload)],
+                                   capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.time() - start)
+            if child.returncode:
+                print(f"{label}: {child.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+                break
+            report = json.loads(child.stdout.strip().splitlines()[-1])
+            rss, heavy = max(rss, report['rss_mb']), report['heavy']
+        else:
+            rows.append({
+                'config': label,
+                'best_startup': min(times),
+                'median_startup': sorted(times)[len(times) // 2],
+                'peak_rss_mb': rss,
+                'heavy_modules': ','.join(heavy) or '-',
+            })
+    return rows
+
+
+def print_rows(rows):
+    columns = [key for key in rows[0] if key != 'metrics']
+    print(''.join(f"{key:>18}" for key in columns))
+    print('-' * 18 * len(columns))
+    for row in rows:
+        cells = []
+        for key in columns:
+            value = row[key]
+            cells.append(f"{value:>18.2f}" if isinstance(value, float) else f"{str(value):>18}")
+        print(''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    cascade = subparsers.add_parser('cascade', help='Cascade vs single-model runs')
+    cascade.add_argument('script')
+    cascade.add_argument('audio')
+    cascade.add_argument('--fast', default='tiny')
+    cascade.add_argument('--large', default='small')
+    cascade.set_defaults(func=bench_cascade)
+
+    quantize = subparsers.add_parser('quantize', help='fp32 vs int8 with per-worker thread pinning')
+    quantize.add_argument('script')
+    quantize.add_argument('audio')
+    quantize.add_argument('--model', default='small')
+    quantize.add_argument('--workers', type=int, default=2, help='Worker count used to size the thread pool')
+    quantize.set_defaults(func=bench_quantize)
+
+    engines = subparsers.add_parser('engines', help='Compare transcription engines on one analysis')
+    engines.add_argument('script')
+    engines.add_argument('audio')
+    engines.add_argument('--engines', nargs='+', default=['whisper', 'faster-whisper'])
+    engines.add_argument('--model', default='small')
+    engines.add_argument('--int8', action='store_true', help='Run every engine with int8 weights')
+    engines.set_defaults(func=bench_engines)
+
+    batch = subparsers.add_parser('batch', help='Batched vs one-by-one transcription of short clips')
+    batch.add_argument('clips', nargs='+', help='Audio clips of at most 30 seconds')
+    batch.add_argument('--model', default='small')
+    batch.add_argument('--batch-size', type=int, default=16)
+    batch.set_defaults(func=bench_batch)
+
+    model_load = subparsers.add_parser('model-load', help='Checkpoint vs offline bundle model load time')
+    model_load.add_argument('model_dir', help='Directory staged with manage.py stage_models')
+    model_load.add_argument('--models', nargs='+', default=['tiny', 'base', 'small'])
+    model_load.add_argument('--repeat', type=int, default=3)
+    model_load.set_defaults(func=bench_model_load)
+
+    compile_parser = subparsers.add_parser('compile', help='Eager vs compiled Whisper encoder')
+    compile_parser.add_argument('--models', nargs='+', default=['tiny', 'base', 'small'])
+    compile_parser.add_argument('--modes', nargs='+', default=['torchscript', 'compile'])
+    compile_parser.add_argument('--int8', action='store_true', help='Compile the int8 quantized models')
+    compile_parser.add_argument('--repeat', type=int, default=5)
+    compile_parser.add_argument('--cache-dir', help='Compile cache to use (default: a fresh temporary directory)')
+    compile_parser.set_defaults(func=bench_compile)
+
+    startup = subparsers.add_parser('startup', help='Web process boot time and RSS, lazy vs eager model imports')
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    rows = args.func(args)
+    print_rows(rows)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'scenario': args.scenario, 'argv': sys.argv[1:], 'rows': rows}, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
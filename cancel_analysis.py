@@ -13,17 +13,18 @@ django.setup()
 from audio_checker.models import AudioAnalysis
 
 def cancel_analysis(analysis_id):
-    """Cancel an ongoing analysis"""
+    """Cancel a queued or running analysis"""
     try:
         analysis = AudioAnalysis.objects.get(id=analysis_id)
         
         if analysis.accuracy_score is None:
-            # Analysis is still processing
+            # Analysis is still queued or processing
             print(f"Cancelling analysis {analysis_id}...")
             
-            # Delete the analysis to stop processing
-            analysis.delete()
-            print("Analysis cancelled successfully!")
+            # Flag the analysis; the worker supervising its job polls the flag,
+            # stops the job at its next audio window and kills it if it does not
+            AudioAnalysis.objects.filter(id=analysis_id).update(cancel_requested=True)
+            print("Cancel requested. The worker will stop the analysis within a few seconds.")
             
             return True
         else:
@@ -5,25 +5,24 @@ Script to clean up stuck analyses and provide recommendations
 import os
 import sys
 import django
-from datetime import timedelta
 
 # Setup Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'audio_detection.settings')
 django.setup()
 
 from audio_checker.models import AudioAnalysis
+from audio_checker.worker import reap_expired_leases
 from django.utils import timezone
 
 def cleanup_stuck_analyses():
-    """Clean up analyses that have been processing for too long"""
-    # Find analyses that have been processing for more than 20 minutes
-    cutoff_time = timezone.now() - timedelta(minutes=20)
-    stuck_analyses = AudioAnalysis.objects.filter(
-        accuracy_score__isnull=True,
-        created_at__lt=cutoff_time
-    )
+    """Requeue analyses whose worker stopped heartbeating"""
+    # Only jobs whose lease expired are stuck; long jobs that still heartbeat are left alone
+    stuck_analyses = list(AudioAnalysis.objects.filter(
+        job_status='running',
+        lease_expires_at__lt=timezone.now()
+    ))
     
-    print(f"Found {stuck_analyses.count()} stuck analyses:")
+    print(f"Found {len(stuck_analyses)} stuck analyses:")
     print("="*60)
     
     for analysis in stuck_analyses:
@@ -34,14 +33,16 @@ def cleanup_stuck_analyses():
         print(f"Title: {analysis.title}")
         print(f"Duration: {duration}")
         print(f"File Size: {file_size:.1f} MB")
-        
-        # Delete the stuck analysis
-        analysis.delete()
-        print(f"✓ Deleted stuck analysis {analysis.id}")
+        print(f"Worker: {analysis.worker_id} (attempt {analysis.attempts})")
         print("-" * 40)
     
-    if stuck_analyses.count() == 0:
+    if not stuck_analyses:
         print("No stuck analyses found!")
+        return
+    
+    # Requeue with backoff, or fail those that used up their attempts
+    reap_expired_leases()
+    print(f"✓ Requeued or failed {len(stuck_analyses)} stuck analyses")
 
 def show_performance_tips():
     """Show performance optimization tips"""